@@ -3,41 +3,175 @@
 с обучением на размеченном корпусе "train.txt" и теггингом "test.txt".
 """
 
+import gzip
+import multiprocessing
+import os
 import random
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from itertools import islice
 from pathlib import Path
+from typing import NamedTuple
 import numpy as np
 import pandas as pd
 import csv
+import sys
 from sklearn.model_selection import train_test_split
 
+sys.path.insert(0, str(Path(__file__).resolve().parents[2] / 'common'))
+from columnar import STR, write_table
+
 # Пути
 BASE_DIR = Path(__file__).resolve().parent.parent
 PARSE_DIR = BASE_DIR / 'parse'
 OUTPUT_DIR = BASE_DIR / 'output'
 TRAIN_FILE = PARSE_DIR / 'GSD_train.txt'
 TEST_FILE  = PARSE_DIR / 'GSD_test.txt'
+MODEL_DIR = OUTPUT_DIR / 'hmm_model'
 
 SMALL_PROB = 1e-8
+LOG_SMALL = np.log(SMALL_PROB)
 SEED = 1234
+BATCH_SIZE = 256
+SHARD_SIZE = 10000
+N_JOBS = os.cpu_count() or 1
+# Пулы создаются через fork, где он есть: иначе при запуске из процесса,
+# стартовавшего через spawn (benchmark.run_isolated), каждый воркер
+# заново запускал бы интерпретатор и импортировал numpy, pandas и sklearn
+MP_CONTEXT = multiprocessing.get_context('fork') if 'fork' in multiprocessing.get_all_start_methods() else None
+# Модель неизвестных слов: длина суффикса, порог редких слов, сглаживание
+MAX_SUFFIX = 4
+RARE_MAX = 10
+OOV_SMOOTHING = 5.0
+# Ширина луча триграммного декодера и набор ширин для beam_benchmark
+BEAM_WIDTH = 16
+BEAM_WIDTHS = (1, 2, 4, 8, 16, 32, None)
 
 
-def load_sentences(path: Path):
+class Vocabulary:
     """
-    Загружает размеченные предложения из файла.
+    Словарь строка -> номер только для чтения поверх отсортированного
+    массива байтовых строк UTF-8 фиксированной ширины (dtype 'S') и
+    массива номеров. Оба массива хранятся в .npy и открываются через
+    memmap, поэтому процессы не строят dict из текста и делят одну копию;
+    поиск — np.searchsorted сразу по списку слов.
     """
-    text = path.read_text(encoding='utf-8-sig')
-    blocks = [b for b in text.strip().split('\n\n') if b]
-    sents = []
-    for block in blocks:
+
+    def __init__(self, keys: np.ndarray, ids: np.ndarray):
+        self.keys = keys
+        self.ids = ids
+
+    @classmethod
+    def from_mapping(cls, mapping) -> 'Vocabulary':
+        items = sorted((w.encode('utf-8'), i) for w, i in mapping.items())
+        width = max((len(k) for k, _ in items), default=0) or 1
+        keys = np.array([k for k, _ in items], dtype=f'S{width}')
+        ids = np.array([i for _, i in items], dtype=np.int64)
+        return cls(keys, ids)
+
+    def __len__(self):
+        return len(self.keys)
+
+    def lookup(self, words) -> np.ndarray:
+        """Номера слов; -1 для отсутствующих."""
+        if not len(self.keys) or not len(words):
+            return np.full(len(words), -1, dtype=np.int64)
+        encoded = [w.encode('utf-8') for w in words]
+        # Строки длиннее ширины массива numpy обрезал бы — таких слов в словаре нет
+        fits = np.fromiter((len(b) <= self.keys.itemsize for b in encoded), dtype=bool, count=len(encoded))
+        query = np.array(encoded, dtype=self.keys.dtype)
+        pos = np.minimum(np.searchsorted(self.keys, query), len(self.keys) - 1)
+        found = fits & (self.keys[pos] == query)
+        return np.where(found, self.ids[pos], -1)
+
+    def get(self, word: str, default=None):
+        idx = self.lookup([word])[0]
+        return default if idx < 0 else int(idx)
+
+    def __contains__(self, word):
+        return self.get(word) is not None
+
+    def __getitem__(self, word):
+        idx = self.get(word)
+        if idx is None:
+            raise KeyError(word)
+        return idx
+
+    def items(self):
+        return ((k.decode('utf-8'), int(i)) for k, i in zip(self.keys, self.ids))
+
+    def save(self, model_dir: Path, name: str):
+        np.save(model_dir / f'{name}_keys.npy', self.keys)
+        np.save(model_dir / f'{name}_ids.npy', self.ids)
+
+    @classmethod
+    def load(cls, model_dir: Path, name: str, mmap_mode=None) -> 'Vocabulary':
+        return cls(np.load(model_dir / f'{name}_keys.npy', mmap_mode=mmap_mode),
+                   np.load(model_dir / f'{name}_ids.npy', mmap_mode=mmap_mode))
+
+
+def _lookup(mapping, words) -> np.ndarray:
+    """Номера слов по dict или Vocabulary; -1 для отсутствующих."""
+    if isinstance(mapping, Vocabulary):
+        return mapping.lookup(words)
+    return np.fromiter((mapping.get(w, -1) for w in words), dtype=np.int64, count=len(words))
+
+
+class HMMModel(NamedTuple):
+    """
+    Модель в виде лог-вероятностей с целочисленными индексами тегов и слов.
+    log_pi и log_A — плотные массивы, эмиссии хранятся построчно по словам
+    в формате CSR: для слова i теги emit_tags[emit_indptr[i]:emit_indptr[i+1]]
+    и их лог-вероятности emit_logp[...]. Строка с индексом |V| отведена
+    для слов, не встречавшихся в обучении.
+    word_idx и oov_index — dict у обученной модели и Vocabulary
+    у загруженной load_model.
+    Необязательные oov_index и oov_logp задают модель неизвестных слов
+    (см. build_oov_model): индекс ключей суффиксов и плотные столбцы
+    эмиссий для них; в encode_words такие слова получают индексы
+    |V| + 1 + номер строки.
+    """
+    tags: list
+    word_idx: dict
+    log_pi: np.ndarray
+    log_A: np.ndarray
+    emit_indptr: np.ndarray
+    emit_tags: np.ndarray
+    emit_logp: np.ndarray
+    oov_index: dict = None
+    oov_logp: np.ndarray = None
+
+
+def iter_sentences(path: Path):
+    """
+    Построчно читает файл CoNLL-U (в том числе .gz) и по одному
+    выдаёт предложения в виде списков (word, tag).
+    Комментарии, многословные токены (1-2) и пустые узлы (1.1) пропускаются.
+    """
+    path = Path(path)
+    opener = gzip.open if path.suffix == '.gz' else open
+    with opener(path, 'rt', encoding='utf-8-sig') as f:
         sent = []
-        for line in block.splitlines():
+        for line in f:
+            if not line.strip():
+                if sent:
+                    yield sent
+                    sent = []
+                continue
+            if line.startswith('#'):
+                continue
             parts = line.split()
-            if len(parts) >= 4:
-                word, tag = parts[1], parts[3]
-                sent.append((word, tag))
+            if len(parts) >= 4 and '-' not in parts[0] and '.' not in parts[0]:
+                sent.append((parts[1], parts[3]))
         if sent:
-            sents.append(sent)
-    return sents
+            yield sent
+
+
+def load_sentences(path: Path):
+    """
+    Загружает размеченные предложения из файла.
+    """
+    return list(iter_sentences(path))
 
 
 def prepare_data():
@@ -53,9 +187,33 @@ def prepare_data():
     return train_set, test_set, train_bag, test_base, test_words
 
 
-def train_counts(train_set, train_bag):
+def iter_corpus(paths=(TRAIN_FILE, TEST_FILE)):
+    """Поток предложений из всех файлов корпуса подряд."""
+    for path in paths:
+        yield from iter_sentences(path)
+
+
+def split_stream(sentences, test_set: list, train_size=0.8, seed=SEED):
+    """
+    Делит поток предложений на train/test без загрузки в память:
+    обучающие предложения выдаются дальше, отложенные (доля
+    1 - train_size) дописываются в test_set. При том же seed
+    повторный проход даёт то же разбиение.
+    """
+    rng = random.Random(seed)
+    for sent in sentences:
+        if rng.random() < train_size:
+            yield sent
+        else:
+            test_set.append(sent)
+
+
+def train_counts(sentences, train_bag=None):
     """
     Вычисляет счётчики начальных тегов, переходов и эмиссий.
+    sentences может быть любым итерируемым объектом, в том числе
+    генератором iter_sentences: предложения обрабатываются по одному.
+    train_bag не используется и оставлен для совместимости со старыми вызовами.
     Возвращает init_counts, tag_counts, emit_counts, trans_counts.
     """
     from collections import Counter, defaultdict
@@ -64,7 +222,9 @@ def train_counts(train_set, train_bag):
     emit_counts = defaultdict(Counter)
     trans_counts = defaultdict(Counter)
 
-    for sent in train_set:
+    for sent in sentences:
+        if not sent:
+            continue
         first_tag = sent[0][1]
         init_counts[first_tag] += 1
         tag_counts[first_tag] += 1
@@ -101,9 +261,691 @@ def train_probs(init_counts, tag_counts, emit_counts, trans_counts):
     return pi, A, B
 
 
+def build_model(tags, pi, A, B) -> HMMModel:
+    """
+    Переводит словари pi, A и B в массивы лог-вероятностей.
+    Отсутствующие значения заменяются на SMALL_PROB, как в viterbi_fast.
+    """
+    tag_idx = {t: i for i, t in enumerate(tags)}
+    vocab = sorted({w for wc in B.values() for w in wc})
+    word_idx = {w: i for i, w in enumerate(vocab)}
+    n_tags = len(tags)
+
+    log_pi = np.full(n_tags, LOG_SMALL)
+    for tag, p in pi.items():
+        log_pi[tag_idx[tag]] = np.log(p)
+
+    log_A = np.full((n_tags, n_tags), LOG_SMALL)
+    for t1, nxt in A.items():
+        for t2, p in nxt.items():
+            log_A[tag_idx[t1], tag_idx[t2]] = np.log(p)
+
+    by_word = [[] for _ in range(len(vocab) + 1)]
+    for tag, wc in B.items():
+        j = tag_idx[tag]
+        for w, p in wc.items():
+            by_word[word_idx[w]].append((j, p))
+    emit_indptr = np.zeros(len(by_word) + 1, dtype=np.int64)
+    emit_indptr[1:] = np.cumsum([len(row) for row in by_word])
+    emit_tags = np.fromiter((j for row in by_word for j, _ in sorted(row)),
+                            dtype=np.int32, count=emit_indptr[-1])
+    emit_logp = np.log(np.fromiter((p for row in by_word for _, p in sorted(row)),
+                                   dtype=np.float64, count=emit_indptr[-1])).astype(np.float32)
+
+    return HMMModel(list(tags), word_idx, log_pi, log_A, emit_indptr, emit_tags, emit_logp)
+
+
+def emission_rows(ids: np.ndarray, model: HMMModel) -> np.ndarray:
+    """
+    Разворачивает строки CSR-эмиссий для массива индексов слов
+    в плотный блок формы ids.shape + (|T|,).
+    Индексы за пределами CSR берутся из столбцов модели неизвестных слов.
+    """
+    flat = ids.ravel()
+    n_rows = len(model.emit_indptr) - 1
+    oov = flat >= n_rows
+    if oov.any():
+        oov_rows = flat[oov] - n_rows
+        flat = np.where(oov, n_rows - 1, flat)
+    out = np.full((flat.size, len(model.tags)), LOG_SMALL)
+    starts = model.emit_indptr[flat]
+    counts = model.emit_indptr[flat + 1] - starts
+    total = int(counts.sum())
+    if total:
+        rows = np.repeat(np.arange(flat.size), counts)
+        pos = (np.arange(total) - np.repeat(np.cumsum(counts) - counts, counts)
+               + np.repeat(starts, counts))
+        out[rows, model.emit_tags[pos]] = model.emit_logp[pos]
+    if oov.any():
+        out[oov] = model.oov_logp[oov_rows]
+    return out.reshape(ids.shape + (len(model.tags),))
+
+
+def save_model(model: HMMModel, model_dir: Path = MODEL_DIR):
+    """
+    Сохраняет модель в бинарном виде: теги (tags.txt), словарь и ключи
+    модели неизвестных слов как Vocabulary (vocab_*.npy, oov_*.npy)
+    и массивы .npy — всё, кроме тегов, load_model открывает через memmap.
+    """
+    model_dir = Path(model_dir)
+    model_dir.mkdir(parents=True, exist_ok=True)
+    (model_dir / 'tags.txt').write_text('\n'.join(model.tags), encoding='utf-8')
+    as_vocabulary = lambda m: m if isinstance(m, Vocabulary) else Vocabulary.from_mapping(m)
+    as_vocabulary(model.word_idx).save(model_dir, 'vocab')
+    for name in ('log_pi', 'log_A', 'emit_indptr', 'emit_tags', 'emit_logp'):
+        np.save(model_dir / f'{name}.npy', getattr(model, name))
+    if model.oov_index is not None:
+        as_vocabulary(model.oov_index).save(model_dir, 'oov')
+        np.save(model_dir / 'oov_logp.npy', model.oov_logp)
+
+
+def load_model(model_dir: Path = MODEL_DIR, mmap=True) -> HMMModel:
+    """
+    Загружает модель, сохранённую save_model. При mmap=True массивы
+    отображаются в память только для чтения, поэтому несколько процессов
+    используют одну копию файла без обучения и копирования. Словарь
+    тоже не разбирается из текста: это Vocabulary поверх memmap.
+    """
+    model_dir = Path(model_dir)
+    tags = (model_dir / 'tags.txt').read_text(encoding='utf-8').split('\n')
+    mode = 'r' if mmap else None
+    arrays = [np.load(model_dir / f'{name}.npy', mmap_mode=mode)
+              for name in ('log_pi', 'log_A', 'emit_indptr', 'emit_tags', 'emit_logp')]
+    model = HMMModel(tags, Vocabulary.load(model_dir, 'vocab', mode), *arrays)
+    if (model_dir / 'oov_logp.npy').exists():
+        model = model._replace(oov_index=Vocabulary.load(model_dir, 'oov', mode),
+                               oov_logp=np.load(model_dir / 'oov_logp.npy', mmap_mode=mode))
+    return model
+
+
+class CountShard(NamedTuple):
+    """
+    Счётчики HMM по части корпуса в виде целочисленных массивов.
+    Теги и слова интернированы в таблицы tags и vocab; эмиссии хранятся
+    тройками (emit_words, emit_tags, emit_counts). Шарды складываются
+    функцией merge_shards.
+    """
+    tags: list
+    vocab: list
+    init: np.ndarray
+    tag: np.ndarray
+    trans: np.ndarray
+    emit_words: np.ndarray
+    emit_tags: np.ndarray
+    emit_counts: np.ndarray
+
+
+def count_shard(sentences) -> CountShard:
+    """
+    Вычисляет счётчики init/tag/emit/trans для набора предложений.
+    """
+    tag_idx, word_idx = {}, {}
+    word_ids, tag_ids, firsts = [], [], []
+    for sent in sentences:
+        if not sent:
+            continue
+        firsts.append(len(tag_ids))
+        for word, tag in sent:
+            word_ids.append(word_idx.setdefault(word, len(word_idx)))
+            tag_ids.append(tag_idx.setdefault(tag, len(tag_idx)))
+
+    n_tags = len(tag_idx)
+    word_ids = np.array(word_ids, dtype=np.int64)
+    tag_ids = np.array(tag_ids, dtype=np.int64)
+    is_first = np.zeros(len(tag_ids), dtype=bool)
+    is_first[firsts] = True
+
+    init = np.bincount(tag_ids[is_first], minlength=n_tags)
+    tag = np.bincount(tag_ids, minlength=n_tags)
+    cont = np.flatnonzero(~is_first)
+    trans = np.bincount(tag_ids[cont - 1] * n_tags + tag_ids[cont],
+                        minlength=n_tags * n_tags).reshape(n_tags, n_tags)
+    keys, emit_counts = np.unique(word_ids * n_tags + tag_ids, return_counts=True)
+    n_div = max(n_tags, 1)
+    return CountShard(list(tag_idx), list(word_idx), init, tag, trans,
+                      keys // n_div, keys % n_div, emit_counts)
+
+
+def merge_shards(shards) -> CountShard:
+    """
+    Суммирует шарды счётчиков, переводя их в общие отсортированные
+    таблицы тегов и слов. Результат — тоже шард, поэтому новые данные
+    можно досчитывать отдельно и добавлять к уже накопленным.
+    """
+    shards = list(shards)
+    tags = sorted({t for sh in shards for t in sh.tags})
+    vocab = sorted({w for sh in shards for w in sh.vocab})
+    tag_idx = {t: i for i, t in enumerate(tags)}
+    word_idx = {w: i for i, w in enumerate(vocab)}
+    n_tags = len(tags)
+
+    init = np.zeros(n_tags, dtype=np.int64)
+    tag = np.zeros(n_tags, dtype=np.int64)
+    trans = np.zeros((n_tags, n_tags), dtype=np.int64)
+    keys, counts = [], []
+    for sh in shards:
+        tmap = np.array([tag_idx[t] for t in sh.tags], dtype=np.int64)
+        wmap = np.array([word_idx[w] for w in sh.vocab], dtype=np.int64)
+        np.add.at(init, tmap, sh.init)
+        np.add.at(tag, tmap, sh.tag)
+        np.add.at(trans, (tmap[:, None], tmap[None, :]), sh.trans)
+        if len(sh.emit_counts):
+            keys.append(wmap[sh.emit_words] * n_tags + tmap[sh.emit_tags])
+            counts.append(sh.emit_counts)
+
+    if keys:
+        uniq, inverse = np.unique(np.concatenate(keys), return_inverse=True)
+        emit_counts = np.bincount(inverse, weights=np.concatenate(counts)).astype(np.int64)
+    else:
+        uniq = emit_counts = np.zeros(0, dtype=np.int64)
+    n_div = max(n_tags, 1)
+    return CountShard(tags, vocab, init, tag, trans, uniq // n_div, uniq % n_div, emit_counts)
+
+
+def save_shard(shard: CountShard, path: Path):
+    """
+    Сохраняет шард счётчиков в .npz.
+    """
+    arrays = shard._asdict()
+    arrays['tags'] = np.array(shard.tags, dtype=str)
+    arrays['vocab'] = np.array(shard.vocab, dtype=str)
+    np.savez_compressed(path, **arrays)
+
+
+def load_shard(path: Path) -> CountShard:
+    """
+    Загружает шард, сохранённый save_shard.
+    """
+    with np.load(path) as data:
+        fields = {name: data[name] for name in CountShard._fields}
+    fields['tags'] = fields['tags'].tolist()
+    fields['vocab'] = fields['vocab'].tolist()
+    return CountShard(**fields)
+
+
+class _ShardTotals:
+    """
+    Накопитель шардов для train_sharded. Теги и слова интернируются
+    в порядке появления, эмиссии копятся ключами слово * TAG_SPAN + тег
+    и время от времени схлопываются. Сортировка словаря и перевод
+    в CountShard делаются один раз, в shard().
+    """
+    TAG_SPAN = 1 << 16
+
+    def __init__(self):
+        self.tag_idx, self.word_idx = {}, {}
+        self.init = np.zeros(0, dtype=np.int64)
+        self.tag = np.zeros(0, dtype=np.int64)
+        self.trans = np.zeros((0, 0), dtype=np.int64)
+        self.keys, self.counts = [], []
+        self.pending = self.compacted = 0
+
+    def add(self, sh: CountShard):
+        for t in sh.tags:
+            self.tag_idx.setdefault(t, len(self.tag_idx))
+        grow = len(self.tag_idx) - len(self.init)
+        if grow:
+            self.init = np.pad(self.init, (0, grow))
+            self.tag = np.pad(self.tag, (0, grow))
+            self.trans = np.pad(self.trans, ((0, grow), (0, grow)))
+        tmap = np.array([self.tag_idx[t] for t in sh.tags], dtype=np.int64)
+        wmap = np.fromiter((self.word_idx.setdefault(w, len(self.word_idx)) for w in sh.vocab),
+                           dtype=np.int64, count=len(sh.vocab))
+        np.add.at(self.init, tmap, sh.init)
+        np.add.at(self.tag, tmap, sh.tag)
+        np.add.at(self.trans, (tmap[:, None], tmap[None, :]), sh.trans)
+        if len(sh.emit_counts):
+            self.keys.append(wmap[sh.emit_words] * self.TAG_SPAN + tmap[sh.emit_tags])
+            self.counts.append(sh.emit_counts)
+            self.pending += len(sh.emit_counts)
+            if self.pending > max(self.compacted, 1_000_000):
+                self._compact()
+
+    def _compact(self):
+        keys, inverse = np.unique(np.concatenate(self.keys), return_inverse=True)
+        counts = np.bincount(inverse, weights=np.concatenate(self.counts)).astype(np.int64)
+        self.keys, self.counts = [keys], [counts]
+        self.pending = self.compacted = len(keys)
+
+    def shard(self) -> CountShard:
+        """Итоговый шард с отсортированными таблицами тегов и слов (как у merge_shards)."""
+        if self.keys:
+            self._compact()
+        tags = sorted(self.tag_idx)
+        vocab = sorted(self.word_idx)
+        n_tags = len(tags)
+        tnew = np.empty(n_tags, dtype=np.int64)
+        tnew[[self.tag_idx[t] for t in tags]] = np.arange(n_tags)
+        wnew = np.empty(len(vocab), dtype=np.int64)
+        wnew[[self.word_idx[w] for w in vocab]] = np.arange(len(vocab))
+
+        init = np.zeros(n_tags, dtype=np.int64)
+        tag = np.zeros(n_tags, dtype=np.int64)
+        trans = np.zeros((n_tags, n_tags), dtype=np.int64)
+        init[tnew] = self.init
+        tag[tnew] = self.tag
+        trans[np.ix_(tnew, tnew)] = self.trans
+        if self.keys:
+            keys = wnew[self.keys[0] // self.TAG_SPAN] * n_tags + tnew[self.keys[0] % self.TAG_SPAN]
+            order = np.argsort(keys)
+            keys, emit_counts = keys[order], self.counts[0][order]
+        else:
+            keys = emit_counts = np.zeros(0, dtype=np.int64)
+        n_div = max(n_tags, 1)
+        return CountShard(tags, vocab, init, tag, trans, keys // n_div, keys % n_div, emit_counts)
+
+
+def pool_workers(n_chunks: int, n_jobs: int) -> int:
+    """Сколько процессов реально работает над n_chunks кусками при n_jobs."""
+    return min(n_jobs, n_chunks) if n_jobs > 1 and n_chunks > 1 else 1
+
+
+def train_sharded(sentences, n_jobs=N_JOBS, shard_size=SHARD_SIZE) -> CountShard:
+    """
+    Параллельное обучение по схеме map-reduce: поток предложений режется
+    на шарды по shard_size, шарды считаются count_shard в n_jobs процессах
+    и по мере готовности складываются в общий накопитель; общий словарь
+    сортируется один раз в конце. Одновременно в работе не больше
+    2 * n_jobs шардов, поэтому поток не читается целиком в память.
+    """
+    it = iter(sentences)
+    chunks = iter(lambda: list(islice(it, shard_size)), [])
+    total = _ShardTotals()
+    if n_jobs <= 1:
+        for chunk in chunks:
+            total.add(count_shard(chunk))
+        return total.shard()
+
+    with ProcessPoolExecutor(max_workers=n_jobs, mp_context=MP_CONTEXT) as pool:
+        pending = set()
+        for chunk in chunks:
+            pending.add(pool.submit(count_shard, chunk))
+            if len(pending) >= 2 * n_jobs:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for f in done:
+                    total.add(f.result())
+        for f in pending:
+            total.add(f.result())
+    return total.shard()
+
+
+def shard_counts(shard: CountShard):
+    """
+    Переводит шард в словари счётчиков того же вида, что train_counts:
+    init_counts, tag_counts, emit_counts, trans_counts.
+    """
+    from collections import Counter, defaultdict
+    tags, vocab = shard.tags, shard.vocab
+    init_counts = Counter({tags[i]: int(c) for i, c in enumerate(shard.init) if c})
+    tag_counts = Counter({tags[i]: int(c) for i, c in enumerate(shard.tag) if c})
+    trans_counts = defaultdict(Counter)
+    for i, j in zip(*np.nonzero(shard.trans)):
+        trans_counts[tags[i]][tags[j]] = int(shard.trans[i, j])
+    emit_counts = defaultdict(Counter)
+    for w, t, c in zip(shard.emit_words.tolist(), shard.emit_tags.tolist(), shard.emit_counts.tolist()):
+        emit_counts[tags[t]][vocab[w]] = c
+    return init_counts, tag_counts, emit_counts, trans_counts
+
+
+def model_from_shard(shard: CountShard) -> HMMModel:
+    """
+    Строит HMMModel прямо из массивов счётчиков, с теми же оценками,
+    что train_probs и build_model.
+    """
+    shard = merge_shards([shard])
+    n_tags = len(shard.tags)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        log_pi = np.log(shard.init / shard.init.sum())
+        row_totals = shard.trans.sum(axis=1, keepdims=True)
+        log_A = np.log(shard.trans / row_totals)
+        emit_logp = np.log(shard.emit_counts / shard.tag[shard.emit_tags]).astype(np.float32)
+    log_pi[shard.init == 0] = LOG_SMALL
+    log_A[shard.trans == 0] = LOG_SMALL
+
+    emit_indptr = np.zeros(len(shard.vocab) + 2, dtype=np.int64)
+    emit_indptr[1:-1] = np.cumsum(np.bincount(shard.emit_words, minlength=len(shard.vocab)))
+    emit_indptr[-1] = emit_indptr[-2]
+    word_idx = {w: i for i, w in enumerate(shard.vocab)}
+    return HMMModel(shard.tags, word_idx, log_pi, log_A, emit_indptr,
+                    shard.emit_tags.astype(np.int32), emit_logp)
+
+
+def word_shape(word: str) -> str:
+    """
+    Грубая форма слова для модели неизвестных слов:
+    D — есть цифры, P — нет букв и цифр, C — с заглавной буквы, L — остальные.
+    """
+    if any(ch.isdigit() for ch in word):
+        return 'D'
+    if not any(ch.isalnum() for ch in word):
+        return 'P'
+    return 'C' if word[0].isupper() else 'L'
+
+
+def oov_keys(word: str):
+    """
+    Ключи индекса суффиксов для слова, от самого длинного суффикса
+    к пустому (только форма слова).
+    """
+    shape, low = word_shape(word), word.lower()
+    for k in range(min(MAX_SUFFIX, len(low)), -1, -1):
+        yield shape + (low[-k:] if k else '')
+
+
+def build_oov_model(model: HMMModel, emit_counts) -> HMMModel:
+    """
+    Строит модель эмиссий для неизвестных слов по суффиксам и форме слов.
+    По редким словам (частота не выше RARE_MAX) оцениваются P(tag | форма +
+    суффикс) с интерполяцией к более короткому суффиксу, как в TnT,
+    и переводятся в эмиссии P(word | tag) ~ P(tag | suffix) / P(tag).
+    Для каждого ключа заранее считается целый столбец эмиссий по всем
+    тегам, поэтому при декодировании неизвестному слову нужен
+    один поиск в словаре.
+    """
+    from collections import Counter, defaultdict
+    tag_idx = {t: i for i, t in enumerate(model.tags)}
+    n_tags = len(model.tags)
+
+    word_freq = Counter()
+    for wc in emit_counts.values():
+        word_freq.update(wc)
+    tag_totals = np.zeros(n_tags)
+    key_counts = defaultdict(lambda: np.zeros(n_tags))
+    for tag, wc in emit_counts.items():
+        j = tag_idx[tag]
+        tag_totals[j] += sum(wc.values())
+        for w, cnt in wc.items():
+            if word_freq[w] <= RARE_MAX:
+                for key in oov_keys(w):
+                    key_counts[key][j] += cnt
+    prior = tag_totals / tag_totals.sum()
+
+    # Ключи упорядочены по длине, поэтому вероятность более короткого
+    # суффикса (родителя) всегда посчитана раньше.
+    probs = {}
+    for key in sorted(key_counts, key=len):
+        parent = probs.get(key[:1] + key[2:], prior) if len(key) > 1 else prior
+        counts = key_counts[key]
+        probs[key] = (counts + OOV_SMOOTHING * parent) / (counts.sum() + OOV_SMOOTHING)
+
+    keys = list(probs)
+    oov_index = {key: r for r, key in enumerate(keys)}
+    with np.errstate(divide='ignore'):
+        oov_logp = np.log(np.array([probs[k] for k in keys]).reshape(len(keys), n_tags)) \
+            - np.log(prior) + LOG_SMALL
+    oov_logp[~np.isfinite(oov_logp)] = LOG_SMALL
+    return model._replace(oov_index=oov_index, oov_logp=oov_logp.astype(np.float32))
+
+
+def oov_row(word: str, model: HMMModel):
+    """
+    Номер строки oov_logp для неизвестного слова (самый длинный известный
+    суффикс) или None, если подходящего ключа нет.
+    """
+    for key in oov_keys(word):
+        r = model.oov_index.get(key)
+        if r is not None:
+            return r
+    return None
+
+
+def encode_words(words, model: HMMModel) -> np.ndarray:
+    """
+    Переводит слова в индексы строк эмиссий. Неизвестные слова получают
+    строку модели неизвестных слов, если она есть, иначе строку |V|.
+    """
+    unk = len(model.word_idx)
+    ids = _lookup(model.word_idx, words)
+    missing = np.flatnonzero(ids < 0)
+    if model.oov_index is None:
+        ids[missing] = unk
+        return ids
+    # Ключи всех неизвестных слов ищутся одним вызовом; берётся самый длинный найденный
+    keys = [list(oov_keys(words[i])) for i in missing]
+    rows = iter(_lookup(model.oov_index, [k for ks in keys for k in ks]))
+    for i, ks in zip(missing, keys):
+        found = [r for r in islice(rows, len(ks)) if r >= 0]
+        ids[i] = unk + 1 + found[0] if found else unk
+    return ids
+
+
+def viterbi(words, model: HMMModel):
+    """
+    Точный алгоритм Витерби в лог-пространстве.
+    На каждом токене выполняется одна матричная операция (|T| x |T|)
+    и сохраняются обратные указатели. При ~17 тегах это в 2-3 раза
+    медленнее жадного viterbi_fast: выигрыш в точности, а не в скорости.
+    Возвращает список (word, tag), как viterbi_fast.
+    """
+    n = len(words)
+    if n == 0:
+        return []
+    emis = emission_rows(encode_words(words, model), model)
+    n_tags = len(model.tags)
+    cols = np.arange(n_tags)
+    back = np.empty((n, n_tags), dtype=np.int32)
+
+    score = model.log_pi + emis[0]
+    for i in range(1, n):
+        cand = score[:, None] + model.log_A
+        best_prev = cand.argmax(axis=0)
+        back[i] = best_prev
+        score = cand[best_prev, cols] + emis[i]
+
+    path = np.empty(n, dtype=np.int32)
+    path[-1] = score.argmax()
+    for i in range(n - 1, 0, -1):
+        path[i - 1] = back[i, path[i]]
+    return list(zip(words, (model.tags[k] for k in path)))
+
+
+def viterbi_batch(ids: np.ndarray, lengths: np.ndarray, model: HMMModel) -> np.ndarray:
+    """
+    Витерби для пакета предложений, дополненных до одной длины.
+    ids — матрица индексов слов (N, L), lengths — истинные длины (N,).
+    На позициях за концом предложения счёт не меняется, а обратный
+    указатель тождественный, поэтому дополнение не влияет на результат.
+    Возвращает матрицу индексов тегов (N, L).
+    """
+    n_sents, max_len = ids.shape
+    n_tags = len(model.tags)
+    cols = np.arange(n_tags)
+    emis = emission_rows(ids, model)
+    back = np.empty((n_sents, max_len, n_tags), dtype=np.int32)
+
+    score = model.log_pi + emis[:, 0]
+    for i in range(1, max_len):
+        cand = score[:, :, None] + model.log_A
+        best_prev = cand.argmax(axis=1)
+        new_score = np.take_along_axis(cand, best_prev[:, None, :], axis=1)[:, 0] + emis[:, i]
+        active = (lengths > i)[:, None]
+        back[:, i] = np.where(active, best_prev, cols)
+        score = np.where(active, new_score, score)
+
+    rows = np.arange(n_sents)
+    paths = np.empty((n_sents, max_len), dtype=np.int32)
+    paths[:, -1] = score.argmax(axis=1)
+    for i in range(max_len - 1, 0, -1):
+        paths[:, i - 1] = back[rows, i, paths[:, i]]
+    return paths
+
+
+def _decode_chunk(sents, model: HMMModel):
+    """
+    Дополняет группу предложений до общей длины и размечает её viterbi_batch.
+    """
+    lengths = np.array([len(s) for s in sents])
+    ids = np.full((len(sents), lengths.max()), len(model.word_idx), dtype=np.int64)
+    # Слова всей группы кодируются одним вызовом
+    ids[np.arange(lengths.max()) < lengths[:, None]] = encode_words([w for s in sents for w in s], model)
+    paths = viterbi_batch(ids, lengths, model)
+    return [list(zip(s, (model.tags[t] for t in paths[k, :len(s)])))
+            for k, s in enumerate(sents)]
+
+
+_WORKER_MODEL = None
+
+
+def _init_worker(model):
+    global _WORKER_MODEL
+    _WORKER_MODEL = load_model(model) if isinstance(model, (str, Path)) else model
+
+
+def _decode_chunk_worker(sents):
+    return _decode_chunk(sents, _WORKER_MODEL)
+
+
+def tag_sentences(sentences, model, n_jobs=1, batch_size=BATCH_SIZE):
+    """
+    Пакетный теггинг списка предложений (списков слов).
+    Предложения сортируются по длине и группируются по batch_size,
+    группы размечаются параллельно в n_jobs процессах; массивы модели
+    передаются в процессы один раз при их запуске и только читаются.
+    Вместо HMMModel можно передать путь к модели из save_model —
+    тогда каждый процесс открывает её через memmap.
+    Возвращает список размеченных предложений [(word, tag), ...]
+    в исходном порядке.
+    """
+    source = model
+    if isinstance(model, (str, Path)):
+        model = load_model(model)
+    order = sorted((i for i, s in enumerate(sentences) if s), key=lambda i: len(sentences[i]))
+    chunks = [[sentences[i] for i in order[k:k + batch_size]]
+              for k in range(0, len(order), batch_size)]
+
+    workers = pool_workers(len(chunks), n_jobs)
+    if workers > 1:
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                                 initargs=(source,), mp_context=MP_CONTEXT) as pool:
+            decoded = list(pool.map(_decode_chunk_worker, chunks))
+    else:
+        decoded = [_decode_chunk(chunk, model) for chunk in chunks]
+
+    result = [[] for _ in sentences]
+    tagged_iter = (sent for chunk in decoded for sent in chunk)
+    for i, tagged in zip(order, tagged_iter):
+        result[i] = tagged
+    return result
+
+
+class TrigramModel(NamedTuple):
+    """
+    HMM второго порядка. Эмиссии и словарь берутся из базовой HMMModel,
+    log_A3[t1, t2, t3] = log P(t3 | t1, t2) с интерполяцией униграмм,
+    биграмм и триграмм. Индекс |T| обозначает начало предложения.
+    """
+    base: HMMModel
+    log_A3: np.ndarray
+    lambdas: tuple
+
+
+def train_trigram(sentences, base: HMMModel) -> TrigramModel:
+    """
+    Обучает переходы второго порядка поверх базовой модели.
+    Веса интерполяции подбираются методом deleted interpolation (Brants, TnT).
+    """
+    tag_idx = {t: i for i, t in enumerate(base.tags)}
+    n_tags = len(base.tags)
+    bos = n_tags
+    uni = np.zeros(n_tags)
+    bi = np.zeros((n_tags + 1, n_tags))
+    tri = np.zeros((n_tags + 1, n_tags + 1, n_tags))
+    for sent in sentences:
+        t1 = t2 = bos
+        for _, tag in sent:
+            t3 = tag_idx[tag]
+            uni[t3] += 1
+            bi[t2, t3] += 1
+            tri[t1, t2, t3] += 1
+            t1, t2 = t2, t3
+
+    bi_ctx = bi.sum(axis=1)
+    tri_ctx = tri.sum(axis=2)
+    total = uni.sum()
+    with np.errstate(divide='ignore', invalid='ignore'):
+        c3 = (tri - 1) / (tri_ctx[:, :, None] - 1)
+        c2 = np.broadcast_to((bi - 1) / (bi_ctx[:, None] - 1), tri.shape)
+        c1 = np.broadcast_to((uni - 1) / (total - 1), tri.shape)
+        cases = np.nan_to_num(np.stack([c1, c2, c3]), nan=0.0, posinf=0.0, neginf=0.0)
+    best = cases.argmax(axis=0)
+    weights = np.array([tri[best == k].sum() for k in range(3)])
+    lambdas = weights / weights.sum() if weights.sum() else np.array([1/3, 1/3, 1/3])
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        p1 = uni / total
+        p2 = np.nan_to_num(bi / bi_ctx[:, None])
+        p3 = np.nan_to_num(tri / tri_ctx[:, :, None])
+    probs = lambdas[0] * p1 + lambdas[1] * p2[None, :, :] + lambdas[2] * p3
+    log_A3 = np.log(np.maximum(probs, SMALL_PROB))
+    return TrigramModel(base, log_A3, tuple(lambdas))
+
+
+def viterbi_trigram(words, model: TrigramModel, beam=BEAM_WIDTH):
+    """
+    Декодирование HMM второго порядка лучевым поиском.
+    Состояние — пара последних тегов; гипотезы, пришедшие в одно
+    состояние, объединяются (как в точном Витерби), затем остаются
+    beam лучших состояний. При beam=None поиск точный (до |T|^2 состояний).
+    Возвращает список (word, tag).
+    """
+    n = len(words)
+    if n == 0:
+        return []
+    base = model.base
+    emis = emission_rows(encode_words(words, base), base)
+    n_tags = len(base.tags)
+    tag_range = np.arange(n_tags)
+
+    prev2 = prev1 = np.array([n_tags])
+    score = np.zeros(1)
+    parents, states = [], []
+    for i in range(n):
+        cand = (score[:, None] + model.log_A3[prev2, prev1] + emis[i]).ravel()
+        keys = np.repeat(prev1, n_tags) * (n_tags + 1) + np.tile(tag_range, len(prev1))
+        order = np.lexsort((-cand, keys))
+        first = np.ones(len(order), dtype=bool)
+        first[1:] = keys[order[1:]] != keys[order[:-1]]
+        kept = order[first]
+        if beam is not None and len(kept) > beam:
+            kept = kept[np.argpartition(-cand[kept], beam - 1)[:beam]]
+        parent = kept // n_tags
+        parents.append(parent)
+        states.append(kept % n_tags)
+        prev2, prev1, score = prev1[parent], kept % n_tags, cand[kept]
+
+    k = int(score.argmax())
+    path = [0] * n
+    for i in range(n - 1, -1, -1):
+        path[i] = states[i][k]
+        k = parents[i][k]
+    return list(zip(words, (base.tags[t] for t in path)))
+
+
+def beam_benchmark(test_set, model: TrigramModel, beams=BEAM_WIDTHS):
+    """
+    Сравнивает скорость и точность триграммного декодера при разной
+    ширине луча (None — точный поиск). Возвращает DataFrame с колонками
+    beam, accuracy, tokens_per_sec, ms_per_sentence.
+    """
+    rows = []
+    n_tokens = sum(len(sent) for sent in test_set)
+    for beam in beams:
+        start = time.perf_counter()
+        acc = evaluate_sentences(test_set, model, beam=beam)[0]
+        elapsed = time.perf_counter() - start
+        rows.append({
+            'beam': beam if beam is not None else 'full',
+            'accuracy': acc,
+            'tokens_per_sec': n_tokens / elapsed if elapsed else 0.0,
+            'ms_per_sentence': 1000 * elapsed / max(len(test_set), 1),
+        })
+    return pd.DataFrame(rows)
+
+
 def viterbi_fast(words, tags, pi, A, B):
     """
-    Оптимизированный алгоритм Витерби, не использует логарифмы.
+    Жадный вариант Витерби без логарифмов: на каждом шаге выбирает
+    лучший тег при уже зафиксированном предыдущем.
     """
     state = []
     for idx, w in enumerate(words):
@@ -123,7 +965,8 @@ def viterbi_fast(words, tags, pi, A, B):
 
 def evaluate(test_words, test_base, tags, pi, A, B):
     """
-    Применяет Viterbi, вычисляет точность и список mismatches.
+    Применяет viterbi_fast к плоскому списку слов, вычисляет точность
+    и список mismatches. Разметка по предложениям — evaluate_sentences.
     """
     tagged = viterbi_fast(test_words, tags, pi, A, B)
     correct = sum(1 for (w,p),(w2,gt) in zip(tagged, test_base) if p==gt)
@@ -133,13 +976,46 @@ def evaluate(test_words, test_base, tags, pi, A, B):
     return acc, mismatches, tagged
 
 
+def evaluate_sentences(test_set, model, n_jobs=1, beam=BEAM_WIDTH):
+    """
+    Размечает test_set по предложениям через tag_sentences
+    (или viterbi_trigram с лучом beam для TrigramModel),
+    вычисляет точность и список mismatches.
+    """
+    words = [[w for (w, _) in sent] for sent in test_set]
+    if isinstance(model, TrigramModel):
+        tagged_sents = [viterbi_trigram(sent, model, beam) for sent in words]
+    else:
+        tagged_sents = tag_sentences(words, model, n_jobs=n_jobs)
+    tagged = [pair for sent in tagged_sents for pair in sent]
+    test_base = [pair for sent in test_set for pair in sent]
+    correct = sum(1 for (w,p),(w2,gt) in zip(tagged, test_base) if p==gt)
+    total = len(test_base)
+    acc = correct/total if total else 0.0
+    mismatches = [(w,p,gt) for (w,p),(w2,gt) in zip(tagged, test_base) if p!=gt]
+    return acc, mismatches, tagged
+
+
+def save_emissions(B, path: Path = OUTPUT_DIR / 'emission_probs'):
+    """
+    Сохраняет ненулевые P(word|tag) разреженной таблицей в колоночном
+    формате (common/columnar.py): колонки word, tag, prob.
+    """
+    rows = [(w, tag, p) for tag, wp in B.items() for w, p in wp.items()]
+    write_table(path, {
+        'word': [w for w, _, _ in rows],
+        'tag': [tag for _, tag, _ in rows],
+        'prob': np.array([p for _, _, p in rows], dtype=np.float64),
+    }, schema={'word': STR, 'tag': STR, 'prob': 'float64'})
+
+
 def save_results(pi, A, B, acc, mismatches):
     """
     Сохраняет transition_probs, emission_probs, accuracy и mismatches.
     """
     OUTPUT_DIR.mkdir(parents=True, exist_ok=True)
     pd.DataFrame(A).fillna(0).to_csv(OUTPUT_DIR / 'transition_probs.csv')
-    pd.DataFrame(B).fillna(0).to_csv(OUTPUT_DIR / 'emission_probs.csv')
+    save_emissions(B)
     with open(OUTPUT_DIR / 'predicted_tags.txt', 'w', encoding='utf-8') as f:
         # можно дополнительно сохранять predictions
         pass
@@ -149,15 +1025,24 @@ def save_results(pi, A, B, acc, mismatches):
 
 
 def main():
-    random.seed(SEED)
-    train_set, test_set, train_bag, test_base, test_words = prepare_data()
-    init_c, tag_c, emit_c, trans_c = train_counts(train_set, train_bag)
+    # Обучение идёт по потоку предложений; в памяти остаётся только test_set
+    test_set = []
+    shard = train_sharded(split_stream(iter_corpus(), test_set), n_jobs=N_JOBS)
+    init_c, tag_c, emit_c, trans_c = shard_counts(shard)
     pi, A, B = train_probs(init_c, tag_c, emit_c, trans_c)
     tags = sorted(tag_c)
-    acc, mismatches, _ = evaluate(test_words, test_base, tags, pi, A, B)
+    model = build_oov_model(build_model(tags, pi, A, B), emit_c)
+    save_model(model)
+    # Процессы получают путь и открывают сохранённую модель через memmap
+    acc, mismatches, _ = evaluate_sentences(test_set, MODEL_DIR, n_jobs=N_JOBS)
     print(f"Accuracy: {acc*100:.2f}%")
     save_results(pi, A, B, acc, mismatches)
 
+    trigram = train_trigram(split_stream(iter_corpus(), []), model)
+    bench = beam_benchmark(test_set, trigram)
+    print(bench.to_string(index=False))
+    bench.to_csv(OUTPUT_DIR / 'beam_benchmark.csv', index=False)
+
 
 if __name__ == '__main__':
     main()
@@ -0,0 +1,190 @@
+"""
+Замеры производительности HMM-теггера: время load_sentences, train_counts,
+train_probs и каждого декодера модуля, токены в секунду, пиковый RSS
+и перцентили задержки на предложение. Корпус GSD можно синтетически
+увеличить в несколько раз: он сначала делится на train/test, и повторяются
+уже части, поэтому тестовые предложения не попадают в обучение.
+Каждый масштаб считается в отдельном процессе, так что пиковый RSS
+относится только к нему; пулы внутри него создаются через fork
+(HMM_tagger.MP_CONTEXT) и не перезапускают интерпретатор. У параллельных
+этапов в отчёте указано, сколько процессов реально работало (workers):
+при одном куске данных пул не запускается. Результаты сохраняются в JSON
+(по умолчанию output/benchmark.json), чтобы сравнивать прогоны между собой.
+"""
+from concurrent.futures import ProcessPoolExecutor
+import argparse
+import json
+import multiprocessing
+import platform
+import resource
+import tempfile
+import time
+from pathlib import Path
+
+import numpy as np
+from sklearn.model_selection import train_test_split
+
+import HMM_tagger as hmm
+
+OUTPUT_FILE = hmm.OUTPUT_DIR / 'benchmark.json'
+SCALES = (1, 10)
+
+
+def peak_rss_mb() -> float:
+    """
+    Пиковый RSS процесса и его завершившихся дочерних процессов, МБ.
+    Это максимум с начала процесса, поэтому в отчёте этапа он включает
+    и предыдущие этапы того же масштаба.
+    """
+    own = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    children = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+    return max(own, children) / 1024
+
+
+def timed(fn, *args, **kwargs):
+    """Вызывает fn и возвращает (результат, время в секундах)."""
+    start = time.perf_counter()
+    result = fn(*args, **kwargs)
+    return result, time.perf_counter() - start
+
+
+def stage(name, seconds, n_tokens, **extra) -> dict:
+    """Строка отчёта по одному этапу."""
+    return {
+        'stage': name,
+        'seconds': seconds,
+        'tokens_per_sec': n_tokens / seconds if seconds else None,
+        'peak_rss_mb': peak_rss_mb(),
+        **extra,
+    }
+
+
+def latency_ms(decode, sentences):
+    """Размечает предложения по одному; возвращает время и перцентили задержки."""
+    times = []
+    for sent in sentences:
+        start = time.perf_counter()
+        decode(sent)
+        times.append(time.perf_counter() - start)
+    ms = np.array(times) * 1000
+    percentiles = {f'p{q}': float(np.percentile(ms, q)) for q in (50, 90, 99)} if len(ms) else {}
+    return float(ms.sum() / 1000), percentiles
+
+
+def scaled_corpus(parts, scale, path: Path) -> Path:
+    """
+    Записывает в CoNLL-U корпус, в котором каждая часть (список
+    предложений) повторена scale раз; части идут одна за другой.
+    """
+    with path.open('w', encoding='utf-8') as out:
+        for sents in parts:
+            for _ in range(scale):
+                for sent in sents:
+                    out.writelines(f"{i}\t{w}\t_\t{t}\n" for i, (w, t) in enumerate(sent, 1))
+                    out.write('\n')
+    return path
+
+
+def bench_decoders(test_set, model, pi, A, B, tags, trigram, n_jobs) -> list:
+    """Замеряет все декодеры модуля на одном и том же test_set."""
+    words = [[w for (w, _) in sent] for sent in test_set]
+    n_tokens = sum(len(s) for s in words)
+    results = []
+
+    per_sentence = {
+        'viterbi_fast': lambda s: hmm.viterbi_fast(s, tags, pi, A, B),
+        'viterbi': lambda s: hmm.viterbi(s, model),
+        f'viterbi_trigram[beam={hmm.BEAM_WIDTH}]':
+            lambda s: hmm.viterbi_trigram(s, trigram, hmm.BEAM_WIDTH),
+        'viterbi_trigram[beam=full]': lambda s: hmm.viterbi_trigram(s, trigram, None),
+    }
+    for name, decode in per_sentence.items():
+        seconds, percentiles = latency_ms(decode, words)
+        results.append(stage(f'decode:{name}', seconds, n_tokens, latency_ms=percentiles))
+
+    n_chunks = -(-sum(1 for s in words if s) // hmm.BATCH_SIZE)
+    for workers in sorted({hmm.pool_workers(n_chunks, jobs) for jobs in (1, n_jobs)}):
+        _, seconds = timed(hmm.tag_sentences, words, model, n_jobs=workers)
+        results.append(stage(f'decode:tag_sentences[workers={workers}]', seconds, n_tokens,
+                             n_jobs=n_jobs, workers=workers))
+    return results
+
+
+def run(sources, scale, n_jobs) -> dict:
+    """
+    Полный прогон на корпусе, увеличенном в scale раз. Исходные
+    предложения делятся на train/test до увеличения, поэтому повторы
+    одного предложения оказываются в одной части.
+    """
+    base = [sent for src in sources for sent in hmm.load_sentences(src)]
+    base_train, base_test = train_test_split(base, train_size=0.8, random_state=hmm.SEED)
+    with tempfile.TemporaryDirectory() as tmp:
+        corpus = scaled_corpus([base_train, base_test], scale, Path(tmp) / 'corpus.conllu')
+        sents, t_load = timed(hmm.load_sentences, corpus)
+    n_all = sum(len(s) for s in sents)
+    stages = [stage('load_sentences', t_load, n_all)]
+
+    cut = len(base_train) * scale
+    train_set, test_set = sents[:cut], sents[cut:]
+    n_train = sum(len(s) for s in train_set)
+    counts, t_counts = timed(hmm.train_counts, train_set)
+    stages.append(stage('train_counts', t_counts, n_train))
+    (pi, A, B), t_probs = timed(hmm.train_probs, *counts)
+    stages.append(stage('train_probs', t_probs, n_train))
+    workers = hmm.pool_workers(-(-len(train_set) // hmm.SHARD_SIZE), n_jobs)
+    _, t_sharded = timed(hmm.train_sharded, train_set, n_jobs=workers)
+    stages.append(stage(f'train_sharded[workers={workers}]', t_sharded, n_train,
+                        n_jobs=n_jobs, workers=workers))
+
+    tags = sorted(counts[1])
+    model, t_build = timed(lambda: hmm.build_oov_model(hmm.build_model(tags, pi, A, B), counts[2]))
+    stages.append(stage('build_model', t_build, n_train))
+    trigram, t_tri = timed(hmm.train_trigram, train_set, model)
+    stages.append(stage('train_trigram', t_tri, n_train))
+
+    stages.extend(bench_decoders(test_set, model, pi, A, B, tags, trigram, n_jobs))
+    return {
+        'scale': scale,
+        'sentences': len(sents),
+        'tokens': n_all,
+        'test_tokens': sum(len(s) for s in test_set),
+        'stages': stages,
+    }
+
+
+def run_isolated(sources, scale, n_jobs) -> dict:
+    """run в отдельном (spawn) процессе: пиковый RSS не копится между масштабами."""
+    ctx = multiprocessing.get_context('spawn')
+    with ProcessPoolExecutor(max_workers=1, mp_context=ctx) as pool:
+        return pool.submit(run, sources, scale, n_jobs).result()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--scales', type=int, nargs='+', default=list(SCALES),
+                        help='во сколько раз увеличить корпус GSD')
+    parser.add_argument('--jobs', type=int, default=hmm.N_JOBS,
+                        help='число процессов для tag_sentences')
+    parser.add_argument('--output', type=Path, default=OUTPUT_FILE)
+    args = parser.parse_args()
+
+    sources = [p for p in (hmm.TRAIN_FILE, hmm.TEST_FILE) if p.exists()]
+    report = {
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'machine': platform.machine(),
+        'sources': [p.name for p in sources],
+        'runs': [run_isolated(sources, scale, args.jobs) for scale in args.scales],
+    }
+    args.output.parent.mkdir(parents=True, exist_ok=True)
+    args.output.write_text(json.dumps(report, ensure_ascii=False, indent=2), encoding='utf-8')
+    for r in report['runs']:
+        print(f"scale={r['scale']}, tokens={r['tokens']}")
+        for st in r['stages']:
+            tps = f"{st['tokens_per_sec']:.0f}" if st['tokens_per_sec'] else '-'
+            print(f"  {st['stage']:<36}{st['seconds']:10.4f} s {tps:>12} tok/s")
+    print(f"Результаты сохранены в {args.output}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,88 @@
+"""
+Сопоставление токенов с символьными отрезками исходного текста.
+Используется в tokenization-pipeline (diff.csv, таблицы токенов)
+и pos-taggers (выравнивание разметок при оценке).
+
+Подключение из скрипта подпроекта:
+    sys.path.insert(0, str(Path(__file__).resolve().parents[2] / 'common'))
+    from alignment import token_spans
+"""
+import html
+
+# Насколько далеко (в символах) сначала искать очередной токен
+ALIGN_WINDOW = 64
+# Если токена нет в окне, он ищется дальше, но не дальше RESYNC_WINDOWS
+# окон, и переход принимается, только если за ним в пределах окна
+# находятся и RESYNC_TOKENS следующих токенов
+RESYNC_WINDOWS = 8
+RESYNC_TOKENS = 2
+# Замены, которые токенизаторы делают в тексте (кавычки NLTK, дефис Moses)
+TOKEN_ALIASES = {'``': '"', "''": '"', '@-@': '-'}
+
+
+def token_forms(token: str):
+    """Возможные написания токена в исходном тексте."""
+    yield token
+    if '&' in token:
+        yield html.unescape(token)
+    if token in TOKEN_ALIASES:
+        yield TOKEN_ALIASES[token]
+
+
+def _find(text: str, forms, pos: int, limit: int):
+    """Самое раннее вхождение одного из написаний, начинающееся не дальше limit от pos."""
+    found = [(start, form) for form in forms
+             if (start := text.find(form, pos, pos + limit + len(form))) >= 0]
+    return min(found) if found else None
+
+
+def _confirmed(text: str, tokens: list, pos: int, window: int) -> bool:
+    """Находятся ли tokens подряд, каждый в пределах window от конца предыдущего."""
+    for token in tokens:
+        hit = _find(text, list(token_forms(token)), pos, window)
+        if hit is None:
+            return False
+        pos = hit[0] + len(hit[1])
+    return True
+
+
+def _resync(text: str, tokens: list, i: int, forms, pos: int, window: int):
+    """
+    Поиск токена tokens[i] за пределами окна: среди вхождений на ближайших
+    RESYNC_WINDOWS окнах берётся первое, за которым подтверждаются
+    следующие RESYNC_TOKENS токенов.
+    """
+    end = pos + window * RESYNC_WINDOWS
+    following = tokens[i + 1:i + 1 + RESYNC_TOKENS]
+    while pos <= end and (hit := _find(text, forms, pos, end - pos)) is not None:
+        if _confirmed(text, following, hit[0] + len(hit[1]), window):
+            return hit
+        pos = hit[0] + 1
+    return None
+
+
+def token_spans(text: str, tokens, window: int = ALIGN_WINDOW) -> list[tuple[int, int]]:
+    """
+    Сопоставляет токенам символьные отрезки (start, end) в тексте.
+    Токен сначала ищется не дальше window символов от конца предыдущего,
+    поэтому обычный проход линейный. Если там его нет (длинный пробельный
+    участок, пропущенный бэкендом текст), он ищется на следующих
+    RESYNC_WINDOWS окнах, и переход засчитывается, только если за найденным
+    местом идут и следующие токены. Иначе (токен нормализован бэкендом или
+    пропущен) токен получает пустой отрезок в текущей позиции, а следующие
+    ищутся от неё же. Поиск всегда ограничен, так что время линейно по
+    длине текста и числу токенов.
+    """
+    tokens = list(tokens)
+    spans = []
+    pos = 0
+    for i, token in enumerate(tokens):
+        forms = list(token_forms(token))
+        hit = _find(text, forms, pos, window) or _resync(text, tokens, i, forms, pos, window)
+        if hit:
+            start, form = hit
+            pos = start + len(form)
+            spans.append((start, pos))
+        else:
+            spans.append((pos, pos))
+    return spans
@@ -0,0 +1,227 @@
+"""
+Компактный колоночный формат для результатов токенизации и разметки.
+
+Таблица — каталог name.cols/ с файлами:
+    meta.json       число строк и схема колонок (пишется последним);
+    {колонка}.bin   значения подряд без заголовка (dtype из meta.json);
+    {колонка}.vocab словарь строковой колонки: строки UTF-8 через NUL.
+Строковые колонки (токены, теги) хранятся словарным кодированием:
+в .bin лежат номера в словаре минимальной разрядности (uint8/16/32).
+Целые колонки (символьные отрезки) тоже сужаются до наименьшего типа,
+вмещающего все значения, вещественные хранятся как есть. Файлы .bin
+читаются через np.memmap без разбора, поэтому открыть таблицу и
+посчитать что-то по кодам можно, не загружая её в память.
+
+Подключение из скрипта подпроекта:
+    sys.path.insert(0, str(Path(__file__).resolve().parents[2] / 'common'))
+    from columnar import ColumnarWriter, read_table, write_table
+"""
+import json
+from pathlib import Path
+
+import numpy as np
+
+SUFFIX = '.cols'
+META = 'meta.json'
+STR = 'str'                  # тип строковой (словарной) колонки в схеме
+FORMAT_VERSION = 1
+SEP = '\x00'
+
+
+def _code_dtype(size: int) -> np.dtype:
+    """Наименьший беззнаковый тип для номеров словаря размера size."""
+    for dtype in (np.uint8, np.uint16, np.uint32):
+        if size <= np.iinfo(dtype).max + 1:
+            return np.dtype(dtype)
+    raise ValueError(f"Слишком большой словарь: {size}")
+
+
+def _int_dtype(low: int, high: int, dtype: np.dtype) -> np.dtype:
+    """Наименьший целый тип (беззнаковый, если нет отрицательных) для [low, high]."""
+    kinds = (np.uint8, np.uint16, np.uint32, np.uint64) if low >= 0 else (np.int8, np.int16, np.int32, np.int64)
+    for kind in kinds:
+        info = np.iinfo(kind)
+        if info.min <= low and high <= info.max:
+            return np.dtype(kind)
+    return dtype
+
+
+def table_path(path) -> Path:
+    """Путь к каталогу таблицы (суффикс .cols добавляется при необходимости)."""
+    path = Path(path)
+    return path if path.suffix == SUFFIX else path.with_name(path.name + SUFFIX)
+
+
+def infer_schema(columns: dict) -> dict:
+    """Схема по данным: строки — STR, остальное — dtype numpy."""
+    schema = {}
+    for name, values in columns.items():
+        if isinstance(values, np.ndarray) and values.dtype.kind != 'O':
+            schema[name] = values.dtype.str
+        elif len(values) and isinstance(values[0], str):
+            schema[name] = STR
+        else:
+            schema[name] = np.asarray(values).dtype.str
+    return schema
+
+
+class ColumnarWriter:
+    """
+    Пишет таблицу по частям: append добавляет пакет строк, close сжимает
+    коды и целые колонки до нужной разрядности и записывает словари
+    и meta.json.
+    schema — {колонка: STR или dtype numpy}. Используется как контекстный
+    менеджер; при исключении meta.json не пишется и таблица не читается.
+    """
+
+    def __init__(self, path, schema: dict):
+        self.path = table_path(path)
+        self.schema = {name: STR if kind == STR else np.dtype(kind).str for name, kind in schema.items()}
+        self.rows = 0
+        self.path.mkdir(parents=True, exist_ok=True)
+        for old in [self.path / META, *self.path.glob('*.bin'), *self.path.glob('*.vocab')]:
+            old.unlink(missing_ok=True)
+        self._vocab = {name: {} for name, kind in self.schema.items() if kind == STR}
+        self._range = {name: None for name, kind in self.schema.items()
+                       if kind != STR and np.dtype(kind).kind in 'iu'}
+        self._files = {name: (self.path / f"{name}.bin").open('wb') for name in self.schema}
+
+    def append(self, **columns):
+        """Добавляет пакет строк: колонка=последовательность, все одной длины."""
+        if columns.keys() != self.schema.keys():
+            raise ValueError(f"Ожидались колонки {list(self.schema)}, получены {list(columns)}")
+        lengths = {len(values) for values in columns.values()}
+        if len(lengths) > 1:
+            raise ValueError(f"Колонки разной длины: {sorted(lengths)}")
+        n = lengths.pop()
+        for name, values in columns.items():
+            if self.schema[name] == STR:
+                vocab = self._vocab[name]
+                arr = np.fromiter((vocab.setdefault(v, len(vocab)) for v in values), dtype=np.uint32, count=n)
+            else:
+                arr = np.asarray(values, dtype=self.schema[name])
+                if name in self._range and n:
+                    low, high = int(arr.min()), int(arr.max())
+                    if self._range[name]:
+                        low, high = min(low, self._range[name][0]), max(high, self._range[name][1])
+                    self._range[name] = (low, high)
+            arr.tofile(self._files[name])
+        self.rows += n
+
+    def close(self):
+        for f in self._files.values():
+            f.close()
+        meta = {'version': FORMAT_VERSION, 'rows': self.rows, 'columns': {}}
+        for name, kind in self.schema.items():
+            bin_path = self.path / f"{name}.bin"
+            if kind == STR:
+                vocab = list(self._vocab[name])
+                if any(SEP in v for v in vocab):
+                    raise ValueError(f"Колонка {name}: строки с символом NUL не поддерживаются")
+                (self.path / f"{name}.vocab").write_bytes(SEP.join(vocab).encode('utf-8'))
+                dtype = _code_dtype(len(vocab))
+                self._narrow(bin_path, np.dtype(np.uint32), dtype)
+                meta['columns'][name] = {'type': STR, 'dtype': dtype.str, 'vocab': len(vocab)}
+            else:
+                dtype = np.dtype(kind)
+                if self._range.get(name):
+                    dtype = _int_dtype(*self._range[name], dtype)
+                    self._narrow(bin_path, np.dtype(kind), dtype)
+                meta['columns'][name] = {'type': 'num', 'dtype': dtype.str}
+        (self.path / META).write_text(json.dumps(meta, ensure_ascii=False, indent=1), encoding='utf-8')
+
+    @staticmethod
+    def _narrow(path: Path, dtype: np.dtype, target: np.dtype):
+        if target.itemsize < dtype.itemsize:
+            np.fromfile(path, dtype=dtype).astype(target).tofile(path)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
+        else:
+            for f in self._files.values():
+                f.close()
+
+
+def write_table(path, columns: dict, schema: dict = None) -> Path:
+    """Записывает таблицу целиком; columns — {колонка: последовательность}."""
+    with ColumnarWriter(path, schema or infer_schema(columns)) as writer:
+        writer.append(**columns)
+    return writer.path
+
+
+class ColumnarTable:
+    """
+    Таблица, открытая для чтения. codes и числовые колонки — массивы
+    numpy, при mmap=True отображённые на файлы (только чтение).
+    """
+
+    def __init__(self, path, mmap: bool = True):
+        self.path = table_path(path)
+        meta = json.loads((self.path / META).read_text(encoding='utf-8'))
+        if meta['version'] != FORMAT_VERSION:
+            raise ValueError(f"{self.path}: неподдерживаемая версия формата {meta['version']}")
+        self.rows = meta['rows']
+        self.meta = meta['columns']
+        self.mmap = mmap
+        self._vocab = {}
+
+    @property
+    def columns(self) -> list:
+        return list(self.meta)
+
+    def __len__(self):
+        return self.rows
+
+    def _array(self, name: str) -> np.ndarray:
+        dtype = np.dtype(self.meta[name]['dtype'])
+        path = self.path / f"{name}.bin"
+        if not self.rows:
+            return np.zeros(0, dtype=dtype)
+        if self.mmap:
+            return np.memmap(path, dtype=dtype, mode='r', shape=(self.rows,))
+        return np.fromfile(path, dtype=dtype, count=self.rows)
+
+    def codes(self, name: str) -> np.ndarray:
+        """Номера значений строковой колонки в её словаре."""
+        if self.meta[name]['type'] != STR:
+            raise TypeError(f"Колонка {name} не строковая")
+        return self._array(name)
+
+    def vocab(self, name: str) -> list:
+        """Словарь строковой колонки (в порядке первого появления)."""
+        if name not in self._vocab:
+            if self.meta[name]['type'] != STR:
+                raise TypeError(f"Колонка {name} не строковая")
+            data = (self.path / f"{name}.vocab").read_bytes().decode('utf-8')
+            self._vocab[name] = data.split(SEP) if self.meta[name]['vocab'] else []
+        return self._vocab[name]
+
+    def column(self, name: str) -> np.ndarray:
+        """Значения колонки: строки раскодируются в массив object."""
+        if self.meta[name]['type'] == STR:
+            vocab = np.array(self.vocab(name) or [''], dtype=object)
+            return vocab[self.codes(name)]
+        return self._array(name)
+
+    def __getitem__(self, name: str) -> np.ndarray:
+        return self.column(name)
+
+    def to_pandas(self, columns=None):
+        """DataFrame; строковые колонки — pandas.Categorical поверх кодов."""
+        import pandas as pd
+        data = {}
+        for name in columns or self.columns:
+            if self.meta[name]['type'] == STR:
+                data[name] = pd.Categorical.from_codes(np.asarray(self.codes(name), dtype=np.int64),
+                                                       categories=self.vocab(name))
+            else:
+                data[name] = self._array(name)
+        return pd.DataFrame(data)
+
+
+def read_table(path, mmap: bool = True) -> ColumnarTable:
+    return ColumnarTable(path, mmap)
@@ -0,0 +1,77 @@
+"""
+Кэширующая обёртка над pymorphy3.MorphAnalyzer.
+В текстах одни и те же словоформы повторяются очень часто, поэтому
+разборы запоминаются по поверхностной форме в ограниченном LRU-кэше.
+Используется в pos-taggers и syntax-disambiguation.
+"""
+from collections.abc import Mapping
+from functools import lru_cache
+
+MAXSIZE = 200_000
+
+
+class CachedMorphAnalyzer:
+    """
+    MorphAnalyzer с кэшем разборов. parse(word) возвращает кортеж разборов
+    (тот же, что list(MorphAnalyzer.parse(word))), общий для всех вызовов
+    с этой словоформой, поэтому изменять его нельзя.
+    Остальные атрибуты делегируются исходному анализатору.
+    """
+
+    def __init__(self, morph=None, maxsize: int = MAXSIZE):
+        if morph is None:
+            from pymorphy3 import MorphAnalyzer
+            morph = MorphAnalyzer()
+        self.morph = morph
+        self.maxsize = maxsize
+        self.parse = lru_cache(maxsize=maxsize)(self._parse)
+        self._warm_info = (0, 0)  # попадания и промахи, набранные warm
+
+    def _parse(self, word: str) -> tuple:
+        return tuple(self.morph.parse(word))
+
+    def warm(self, words) -> int:
+        """
+        Заранее разбирает словоформы из частотного списка: словаря
+        {слово: частота} или последовательности слов по убыванию частоты.
+        Берётся не больше maxsize самых частых различных форм; повторы
+        пропускаются. Обращения при прогреве не учитываются в stats().
+        Возвращает число разобранных форм.
+        """
+        if isinstance(words, Mapping):
+            words = sorted(words, key=words.get, reverse=True)
+        seen = set()
+        for word in words:
+            if len(seen) >= self.maxsize:
+                break
+            if word not in seen:
+                seen.add(word)
+                self.parse(word)
+        info = self.parse.cache_info()
+        self._warm_info = (info.hits, info.misses)
+        return len(seen)
+
+    def stats(self) -> dict:
+        """Статистика кэша после прогрева: попадания, промахи, доля попаданий, размер."""
+        info = self.parse.cache_info()
+        hits = info.hits - self._warm_info[0]
+        misses = info.misses - self._warm_info[1]
+        total = hits + misses
+        return {
+            'hits': hits,
+            'misses': misses,
+            'hit_rate': hits / total if total else 0.0,
+            'size': info.currsize,
+            'maxsize': info.maxsize,
+        }
+
+    def clear(self):
+        """Очищает кэш и статистику."""
+        self.parse.cache_clear()
+        self._warm_info = (0, 0)
+
+    def __getattr__(self, name):
+        # morph ещё нет (например, при распаковке pickle) — не уходим в рекурсию
+        if name == 'morph':
+            raise AttributeError(name)
+        return getattr(self.morph, name)
@@ -0,0 +1,201 @@
+"""
+Общий дисковый кэш результатов для токенизаторов, тэггеров и
+определителей языка. Ключ — хэш от (входные данные, имя бэкенда,
+версия бэкенда, настройки), поэтому при неизменных входе и бэкенде
+повторный прогон берёт результат с диска. Размер кэша ограничен,
+при переполнении удаляются записи, к которым дольше всего не обращались.
+
+Кэш выключен по умолчанию: библиотечные функции не пишут на диск, пока
+он не включён переменной окружения NLP_CACHE=1 (или RESULT_CACHE.enabled).
+Каталог задаётся NLP_CACHE_DIR.
+
+Подключение из скрипта подпроекта:
+    sys.path.insert(0, str(Path(__file__).resolve().parents[2] / 'common'))
+    from result_cache import RESULT_CACHE, package_version
+"""
+import hashlib
+import json
+import os
+import pickle
+import tempfile
+from functools import lru_cache, wraps
+from pathlib import Path
+
+ROOT_DIR = Path(__file__).resolve().parent.parent
+CACHE_DIR = Path(os.environ.get('NLP_CACHE_DIR', ROOT_DIR / '.cache' / 'results'))
+MAX_BYTES = 1024 ** 3
+ENABLED = os.environ.get('NLP_CACHE', '') == '1'
+# Через сколько записей пересчитывать размер кэша по диску: в него
+# одновременно пишут несколько процессов, и счётчик процесса устаревает
+RESCAN_PUTS = 1000
+
+
+@lru_cache(maxsize=None)
+def package_version(name: str) -> str:
+    """
+    Версия установленного пакета или 'unknown'. importlib.metadata
+    импортируется здесь, а не при загрузке модуля: он заметно удлиняет импорт.
+    """
+    from importlib import metadata
+    try:
+        return metadata.version(name)
+    except metadata.PackageNotFoundError:
+        return 'unknown'
+
+
+class ResultCache:
+    """
+    Кэш на диске с ключами по содержимому и LRU-вытеснением по размеру.
+    Каждая запись — отдельный pickle-файл root/ab/<sha256>.pkl;
+    время последнего обращения хранится в mtime файла.
+    """
+
+    def __init__(self, root: Path = CACHE_DIR, max_bytes: int = MAX_BYTES, enabled: bool = ENABLED):
+        self.root = Path(root)
+        self.max_bytes = max_bytes
+        self.enabled = enabled
+        self.hits = 0
+        self.misses = 0
+        self._size = None
+        self._puts = 0
+
+    @staticmethod
+    def key(data, backend: str, version: str, config=None) -> str:
+        """
+        Ключ записи: sha256 от входных данных, бэкенда, версии и настроек.
+        data — строка, байты или JSON-сериализуемое значение; тип входит
+        в ключ, поэтому '1' и 1 дают разные ключи.
+        """
+        h = hashlib.sha256()
+        if isinstance(data, str):
+            h.update(b's' + data.encode('utf-8'))
+        elif isinstance(data, (bytes, bytearray, memoryview)):
+            h.update(b'b' + bytes(data))
+        else:
+            h.update(b'j' + json.dumps(data, sort_keys=True, ensure_ascii=False, default=repr).encode('utf-8'))
+        meta = json.dumps([backend, version, config], sort_keys=True, ensure_ascii=False, default=str)
+        h.update(b'\0' + meta.encode('utf-8'))
+        return h.hexdigest()
+
+    def _path(self, key: str) -> Path:
+        return self.root / key[:2] / f'{key}.pkl'
+
+    def get(self, key: str, default=None):
+        """Возвращает сохранённый результат или default."""
+        if not self.enabled:
+            return default
+        path = self._path(key)
+        try:
+            with path.open('rb') as f:
+                value = pickle.load(f)
+        except (FileNotFoundError, EOFError, pickle.UnpicklingError):
+            self.misses += 1
+            return default
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            # Запись успел вытеснить другой процесс; значение уже прочитано
+            pass
+        self.hits += 1
+        return value
+
+    def put(self, key: str, value):
+        """Сохраняет результат; запись атомарная, через временный файл."""
+        if not self.enabled:
+            return
+        path = self._path(key)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        self._puts += 1
+        if self._puts % RESCAN_PUTS == 0:
+            self._size = None
+        size = self.size() - self._file_size(path)
+        fd, tmp = tempfile.mkstemp(dir=path.parent, suffix='.tmp')
+        with os.fdopen(fd, 'wb') as f:
+            pickle.dump(value, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp, path)
+        self._size = size + self._file_size(path)
+        if self._size > self.max_bytes:
+            self.evict()
+
+    @staticmethod
+    def _file_size(path: Path) -> int:
+        try:
+            return path.stat().st_size
+        except FileNotFoundError:
+            return 0
+
+    def _entries(self) -> list:
+        """(mtime, размер, путь) для всех записей; удалённые на ходу пропускаются."""
+        entries = []
+        for p in self.root.glob('*/*.pkl'):
+            try:
+                st = p.stat()
+            except FileNotFoundError:
+                continue
+            entries.append((st.st_mtime, st.st_size, p))
+        return entries
+
+    def size(self) -> int:
+        """
+        Размер кэша в байтах: сканируется при первом вызове и каждые
+        RESCAN_PUTS записей, между сканами оценивается по своим записям.
+        """
+        if self._size is None:
+            self._size = sum(s for _, s, _ in self._entries())
+        return self._size
+
+    def evict(self, target: int = None):
+        """
+        Удаляет самые давно использованные записи, пока размер больше target.
+        Размер пересчитывается по диску, так что учитываются и записи
+        других процессов.
+        """
+        target = int(self.max_bytes * 0.9) if target is None else target
+        entries = sorted(self._entries())
+        size = sum(s for _, s, _ in entries)
+        for _, s, path in entries:
+            if size <= target:
+                break
+            path.unlink(missing_ok=True)
+            size -= s
+        self._size = size
+
+    def clear(self):
+        """Удаляет все записи."""
+        self.evict(target=0)
+
+    def cached(self, compute, data, backend: str, version: str, config=None):
+        """Возвращает результат из кэша или вычисляет compute() и сохраняет его."""
+        key = self.key(data, backend, version, config)
+        missing = object()
+        value = self.get(key, missing)
+        if value is missing:
+            value = compute()
+            self.put(key, value)
+        return value
+
+    def memoize(self, backend: str, version, config=None):
+        """
+        Декоратор для функций вида f(text) -> результат:
+        результат кэшируется по тексту, бэкенду, версии и настройкам.
+        version и config можно передать функциями без аргументов
+        (например, partial(package_version, 'pkg')): они вызываются
+        только при первом обращении к включённому кэшу, а не при импорте.
+        """
+        def decorator(fn):
+            @lru_cache(maxsize=1)
+            def key_parts():
+                return (version() if callable(version) else version,
+                        config() if callable(config) else config)
+
+            @wraps(fn)
+            def wrapper(text):
+                if not self.enabled:
+                    return fn(text)
+                return self.cached(lambda: fn(text), text, backend, *key_parts())
+            wrapper.uncached = fn
+            return wrapper
+        return decorator
+
+
+RESULT_CACHE = ResultCache()
@@ -0,0 +1,46 @@
+from pathlib import Path
+import sys
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+from alignment import ALIGN_WINDOW, RESYNC_WINDOWS, token_spans
+
+
+def covered(text, tokens):
+    return [text[s:e] for s, e in token_spans(text, tokens)]
+
+
+def test_gap_longer_than_window():
+    text = "Начало." + "\n" * 100 + "Это тест..."
+    tokens = ['Начало', '.', 'Это', 'тест', '...']
+    assert 100 > ALIGN_WINDOW
+    assert token_spans(text, tokens) == [(0, 6), (6, 7), (107, 110), (111, 115), (115, 118)]
+
+
+def test_moses_hyphen_and_escapes():
+    text = 'северо-запад & "юг"'
+    tokens = ['северо', '@-@', 'запад', '&amp;', '&quot;', 'юг', '&quot;']
+    assert covered(text, tokens) == ['северо', '-', 'запад', '&', '"', 'юг', '"']
+
+
+def test_missing_token_does_not_shift_the_rest():
+    text = 'раз два три'
+    spans = token_spans(text, ['раз', 'НЕТ', 'два', 'три'])
+    assert spans == [(0, 3), (3, 3), (4, 7), (8, 11)]
+
+
+def test_resync_needs_following_tokens():
+    text = 'начало ' + 'x' * 200 + ' конец. Дальше'
+    assert covered(text, ['начало', 'конец', '.', 'Дальше']) == ['начало', 'конец', '.', 'Дальше']
+    # Слово дальше в тексте, но следующие токены за ним не идут: переход не засчитывается
+    assert token_spans(text, ['начало', 'Дальше', 'x']) == [(0, 6), (6, 6), (7, 8)]
+
+
+def test_normalized_token_recurring_later():
+    text = 'ещё раз. слово ' + 'x ' * 80 + 'еще'
+    spans = token_spans(text, ['еще', 'раз', '.', 'слово'])
+    assert spans == [(0, 0), (4, 7), (7, 8), (9, 14)]
+
+
+def test_fallback_is_bounded():
+    text = 'раз ' + 'x' * (ALIGN_WINDOW * (RESYNC_WINDOWS + 2)) + ' два'
+    assert token_spans(text, ['раз', 'два']) == [(0, 3), (3, 3)]
@@ -0,0 +1,42 @@
+from pathlib import Path
+import sys
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+from morph_cache import CachedMorphAnalyzer
+
+
+class FakeMorph:
+    def __init__(self):
+        self.calls = []
+        self.lang = 'ru'
+
+    def parse(self, word):
+        self.calls.append(word)
+        return [word.lower()]
+
+
+def test_warm_skips_duplicates():
+    morph = FakeMorph()
+    cached = CachedMorphAnalyzer(morph, maxsize=2)
+    assert cached.warm(['и', 'и', 'в', 'в', 'на']) == 2
+    assert morph.calls == ['и', 'в']
+
+
+def test_warm_not_counted_in_stats():
+    cached = CachedMorphAnalyzer(FakeMorph())
+    cached.warm({'и': 10, 'в': 5})
+    assert cached.stats()['hits'] == cached.stats()['misses'] == 0
+    cached.parse('и')
+    cached.parse('дом')
+    stats = cached.stats()
+    assert (stats['hits'], stats['misses'], stats['hit_rate']) == (1, 1, 0.5)
+    assert stats['size'] == 3
+
+
+def test_getattr_without_morph():
+    cached = CachedMorphAnalyzer.__new__(CachedMorphAnalyzer)
+    with pytest.raises(AttributeError):
+        cached.morph
+    assert CachedMorphAnalyzer(FakeMorph()).lang == 'ru'
@@ -1,13 +1,32 @@
 """
 Сравнение двух популярных методов автоматической идентификации языка текста
 (langdetect и langid) на наборе примеров русского, английского и немецкого текстов.
+Результаты определения можно кэшировать на диске (common/result_cache.py,
+включается NLP_CACHE=1).
+
+Для большого потока документов есть пакетный режим (classify_batch):
+документы распределяются по пулу процессов, а длинный текст можно
+заменить префиксом или несколькими окнами из разных частей текста —
+обоим детекторам хватает нескольких сотен символов, поэтому стоимость
+одного документа ограничена сверху.
 """
+import atexit
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache, partial
+from itertools import islice
 from pathlib import Path
 import csv
+import os
+import sys
+import time
+import numpy as np
 import pandas as pd
 from langdetect import detect, DetectorFactory
 import langid
 
+sys.path.insert(0, str(Path(__file__).resolve().parents[2] / 'common'))
+from result_cache import RESULT_CACHE, package_version
+
 # Зафиксируем случайность для langdetect
 DetectorFactory.seed = 0
 
@@ -15,12 +34,22 @@ DetectorFactory.seed = 0
 BASE_DIR = Path(__file__).resolve().parent.parent
 INPUT_DIR = BASE_DIR / 'parse'
 OUTPUT_FILE = BASE_DIR / 'output' / 'results.csv'
+THROUGHPUT_FILE = BASE_DIR / 'output' / 'throughput.csv'
+
+METHODS = ('langdetect', 'langid')
+MODES = ('full', 'prefix', 'sample')
+MAX_CHARS = 1000      # сколько символов документа передаётся детектору
+WINDOWS = 3           # число окон в режиме sample
+N_JOBS = os.cpu_count() or 1
+CHUNKSIZE = 64        # документов на одну задачу пула
+DOC_CHARS = 4000      # размер документов для замера пропускной способности
 
 def load_text(file_path: Path) -> str:
     """Загружает текст из файла и возвращает его содержимое."""
     return file_path.read_text(encoding='utf-8-sig')
 
 
+@RESULT_CACHE.memoize('langdetect', partial(package_version, 'langdetect'), {'seed': DetectorFactory.seed})
 def classify_langdetect(text: str) -> str:
     """Определяет язык с помощью langdetect."""
     try:
@@ -29,18 +58,187 @@ def classify_langdetect(text: str) -> str:
         return 'unknown'
 
 
+@RESULT_CACHE.memoize('langid', partial(package_version, 'langid'))
 def classify_langid(text: str) -> (str, float):
     """Определяет язык и уверенность с помощью langid."""
     lang, score = langid.classify(text)
     return lang, score
 
 
+CLASSIFIERS = {'langdetect': classify_langdetect, 'langid': classify_langid}
+
+
+@lru_cache(maxsize=None)
+def restricted_langid(langs: tuple):
+    """
+    Отдельный классификатор langid, выбирающий только из языков langs.
+    На коротких текстах полный набор языков часто путает близкие языки
+    (русский абзац определяется как сербский или украинский); глобальный
+    классификатор langid при этом не меняется.
+    """
+    from langid.langid import LanguageIdentifier, model
+    identifier = LanguageIdentifier.from_modelstring(model)
+    identifier.set_languages(list(langs))
+    return identifier
+
+
+def _cut(text: str, start: int, width: int) -> str:
+    """Фрагмент text[start:start + width], выровненный по пробелам."""
+    end = start + width
+    if start > 0:
+        ws = text.find(' ', start, end)
+        if ws >= 0:
+            start = ws + 1
+    if end < len(text):
+        ws = text.rfind(' ', start, end)
+        if ws > start:
+            end = ws
+    return text[start:end]
+
+
+def sample_text(text: str, mode: str = 'sample', max_chars: int = MAX_CHARS,
+                windows: int = WINDOWS) -> str:
+    """
+    Часть текста, по которой определяется язык:
+    full — весь текст, prefix — первые max_chars символов,
+    sample — windows равномерно расставленных окон общей длиной max_chars.
+    """
+    if mode not in MODES:
+        raise ValueError(f"Неизвестный режим: {mode}")
+    if mode == 'full' or len(text) <= max_chars:
+        return text
+    if mode == 'prefix' or windows <= 1:
+        return _cut(text, 0, max_chars)
+    width = max_chars // windows
+    step = (len(text) - width) / (windows - 1)
+    return '\n'.join(_cut(text, int(i * step), width) for i in range(windows))
+
+
+def _warm_up():
+    """Загружает модели детекторов заранее, чтобы не учитывать это в задержке."""
+    for classify in CLASSIFIERS.values():
+        classify.uncached('warm up')
+
+
+def _classify_doc(task) -> dict:
+    """
+    Определяет язык одного документа всеми методами.
+    Возвращает {метод: (язык, score, секунды)}; у langdetect score пустой.
+    Дисковый кэш не используется: в потоке документы почти не повторяются.
+    """
+    text, methods, mode, max_chars = task
+    sample = sample_text(text, mode, max_chars)
+    result = {}
+    for method in methods:
+        start = time.perf_counter()
+        res = CLASSIFIERS[method].uncached(sample)
+        lang, score = res if isinstance(res, tuple) else (res, '')
+        result[method] = (lang, score, time.perf_counter() - start)
+    return result
+
+
+_POOLS = {}
+
+
+def _pool_for(n_jobs: int) -> ProcessPoolExecutor:
+    """Пул из n_jobs процессов с загруженными моделями (создаётся один раз на процесс)."""
+    if n_jobs not in _POOLS:
+        _POOLS[n_jobs] = ProcessPoolExecutor(max_workers=n_jobs, initializer=_warm_up)
+    return _POOLS[n_jobs]
+
+
+def shutdown_pools():
+    """Останавливает процессы пулов classify_batch."""
+    while _POOLS:
+        _POOLS.popitem()[1].shutdown()
+
+
+atexit.register(shutdown_pools)
+
+
+def iter_classify(texts, methods=METHODS, mode: str = 'sample', max_chars: int = MAX_CHARS,
+                  n_jobs: int = N_JOBS, chunksize: int = CHUNKSIZE, pool=None):
+    """
+    Лениво определяет язык потока документов, сохраняя порядок.
+    В пул одновременно отправляется не больше n_jobs * chunksize * 4
+    документов, поэтому память не зависит от длины потока.
+    Без явного pool при n_jobs > 1 используется общий пул модуля,
+    так что повторные вызовы не платят за запуск процессов и загрузку моделей.
+    """
+    tasks = ((text, tuple(methods), mode, max_chars) for text in texts)
+    if pool is None and n_jobs <= 1:
+        _warm_up()
+        yield from map(_classify_doc, tasks)
+        return
+    if pool is None:
+        pool = _pool_for(n_jobs)
+    block = n_jobs * chunksize * 4
+    while batch := list(islice(tasks, block)):
+        yield from pool.map(_classify_doc, batch, chunksize=chunksize)
+
+
+def classify_batch(texts, methods=METHODS, mode: str = 'sample', max_chars: int = MAX_CHARS,
+                   n_jobs: int = N_JOBS, chunksize: int = CHUNKSIZE, pool=None) -> list:
+    """Пакетное определение языка: список результатов _classify_doc."""
+    return list(iter_classify(texts, methods, mode, max_chars, n_jobs, chunksize, pool))
+
+
+def split_documents(text: str, size: int = DOC_CHARS) -> list:
+    """Нарезает текст на документы примерно по size символов."""
+    docs, start = [], 0
+    while start < len(text):
+        end = start + size
+        if end < len(text):
+            ws = text.rfind(' ', start, end)
+            if ws > start:
+                end = ws
+        docs.append(text[start:end].strip())
+        start = end
+    return [d for d in docs if d]
+
+
+def throughput(texts, n_jobs: int = N_JOBS, max_chars: int = MAX_CHARS) -> pd.DataFrame:
+    """
+    Замер для каждого режима: документы в секунду, перцентили задержки
+    на документ (мкс) по методам, согласие langdetect и langid между
+    собой и с их же ответами в режиме full.
+    Пул запускается до замера, поэтому в нём нет старта процессов и загрузки моделей.
+    """
+    _warm_up()
+    classify_batch(texts[:n_jobs * CHUNKSIZE], mode='prefix', max_chars=max_chars, n_jobs=n_jobs)
+    rows, full = [], None
+    for mode in MODES:
+        start = time.perf_counter()
+        results = classify_batch(texts, mode=mode, max_chars=max_chars, n_jobs=n_jobs)
+        seconds = time.perf_counter() - start
+        langs = {m: np.array([r[m][0] for r in results]) for m in METHODS}
+        if mode == 'full':
+            full = langs
+        agreement = float(np.mean(langs['langdetect'] == langs['langid'])) if results else 0.0
+        for method in METHODS:
+            latency = np.array([r[method][2] for r in results]) * 1e6
+            rows.append({
+                'mode': mode,
+                'method': method,
+                'documents': len(results),
+                'seconds': seconds,
+                'docs_per_sec': len(results) / seconds if seconds else 0.0,
+                'latency_us_p50': float(np.percentile(latency, 50)) if len(latency) else 0.0,
+                'latency_us_p99': float(np.percentile(latency, 99)) if len(latency) else 0.0,
+                'agreement': agreement,
+                'agreement_with_full': float(np.mean(langs[method] == full[method])) if results else 0.0,
+            })
+    return pd.DataFrame(rows)
+
+
 def main():
     OUTPUT_FILE.parent.mkdir(parents=True, exist_ok=True)
 
     rows = []
-    # Проходим по всем .txt файлам в папке parse (на уровне проекта)
-    for txt_file in sorted(INPUT_DIR.glob('*.txt')):
+    # Проходим по всем .txt файлам в папке parse (на уровне проекта);
+    # здесь язык определяется по всему тексту, окна sample_text — только для замера
+    files = sorted(INPUT_DIR.glob('*.txt'))
+    for txt_file in files:
         text = load_text(txt_file)
         # langdetect
         ld = classify_langdetect(text)
@@ -64,6 +262,14 @@ def main():
     df.to_csv(OUTPUT_FILE, index=False, quoting=csv.QUOTE_NONNUMERIC)
     print(f"Готово! Результаты сохранены в {OUTPUT_FILE}")
 
+    # Пропускная способность пакетного режима (full, prefix, sample) на фрагментах тех же текстов
+    docs = [doc for txt_file in files
+            for doc in split_documents(load_text(txt_file))]
+    stats = throughput(docs)
+    stats.to_csv(THROUGHPUT_FILE, index=False, quoting=csv.QUOTE_NONNUMERIC)
+    print(stats.to_string(index=False))
+    print(f"Замеры сохранены в {THROUGHPUT_FILE}")
+
 
 if __name__ == '__main__':
     main()
@@ -0,0 +1,192 @@
+"""
+Собственный определитель языка на символьных n-граммах.
+Профили языков строятся по текстам из parse/ (Чехов, Моэм, Ремарк):
+n-граммы хэшируются в вектор фиксированной длины, веса — логарифмы
+сглаженных частот (мультиномиальный наивный Байес). Пакет документов
+классифицируется одним умножением матрицы признаков на матрицу весов.
+Хэширование детерминированное, без случайности и внешних зависимостей,
+кроме numpy.
+
+Запуск как скрипта сравнивает скорость и согласие с langdetect и langid
+на отложенных фрагментах текстов (output/ngram_benchmark.csv).
+"""
+from pathlib import Path
+import csv
+import time
+
+import numpy as np
+import pandas as pd
+
+BASE_DIR = Path(__file__).resolve().parent.parent
+INPUT_DIR = BASE_DIR / 'parse'
+OUTPUT_DIR = BASE_DIR / 'output'
+MODEL_FILE = OUTPUT_DIR / 'ngram_model.npz'
+BENCHMARK_FILE = OUTPUT_DIR / 'ngram_benchmark.csv'
+
+# Язык каждого обучающего текста
+TRAIN_LANGS = {
+    'Чехов langid.txt': 'ru',
+    'Maugham langid.txt': 'en',
+    'Remarque langid.txt': 'de',
+}
+ORDERS = (1, 2, 3)
+BITS = 14             # размер вектора признаков 2 ** BITS
+ALPHA = 0.5           # сглаживание частот
+BATCH_SIZE = 256      # документов в одном умножении матриц
+TRAIN_SHARE = 0.8     # доля текста для обучения в замере
+DOC_CHARS = 300       # размер отложенных фрагментов в замере
+
+PRIME = np.uint64(1_000_003)
+MIX = np.uint64(0x9E3779B97F4A7C15)
+SEP = '\x00'
+
+
+def hash_ngrams(codes: np.ndarray, orders=ORDERS, bits: int = BITS):
+    """
+    Хэши n-грамм массива кодов символов.
+    Документы в codes разделены нулём; n-граммы, задевающие разделитель,
+    отбрасываются. Возвращает (номер документа, корзина) для каждой n-граммы.
+    """
+    codes = codes.astype(np.uint64)
+    sep_cum = np.concatenate(([0], np.cumsum(codes == 0)))
+    docs, buckets = [], []
+    for n in orders:
+        m = len(codes) - n + 1
+        if m <= 0:
+            continue
+        h = np.full(m, n, dtype=np.uint64)
+        for k in range(n):
+            h = h * PRIME + codes[k:k + m]
+        valid = sep_cum[n:n + m] == sep_cum[:m]
+        docs.append(sep_cum[:m][valid])
+        buckets.append(((h * MIX) >> np.uint64(64 - bits))[valid])
+    if not docs:
+        return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+    return np.concatenate(docs).astype(np.int64), np.concatenate(buckets).astype(np.int64)
+
+
+def encode(docs) -> np.ndarray:
+    """Коды символов документов в нижнем регистре, разделённых нулём."""
+    text = SEP.join(d.replace(SEP, ' ').lower() for d in docs)
+    return np.frombuffer(text.encode('utf-32-le'), dtype=np.uint32)
+
+
+class NgramLangID:
+    """Мультиномиальный наивный Байес на хэшированных символьных n-граммах."""
+
+    def __init__(self, orders=ORDERS, bits: int = BITS, alpha: float = ALPHA):
+        self.orders = tuple(orders)
+        self.bits = bits
+        self.alpha = alpha
+        self.langs = []
+        self.weights = None   # (число языков, 2 ** bits), float32
+
+    def features(self, docs) -> np.ndarray:
+        """Матрица счётчиков n-грамм (число документов, 2 ** bits)."""
+        dim = 1 << self.bits
+        doc_ids, buckets = hash_ngrams(encode(docs), self.orders, self.bits)
+        counts = np.bincount(doc_ids * dim + buckets, minlength=len(docs) * dim)
+        return counts.reshape(len(docs), dim).astype(np.float32)
+
+    def fit(self, texts: dict) -> 'NgramLangID':
+        """Обучает профили; texts — {язык: текст или список текстов}."""
+        self.langs = sorted(texts)
+        counts = np.stack([
+            self.features([t] if isinstance(t, str) else list(t)).sum(axis=0)
+            for t in (texts[lang] for lang in self.langs)
+        ])
+        counts += self.alpha
+        self.weights = np.log(counts / counts.sum(axis=1, keepdims=True)).astype(np.float32)
+        return self
+
+    def scores(self, docs, batch_size: int = BATCH_SIZE) -> np.ndarray:
+        """Логарифмы правдоподобия документов для каждого языка."""
+        docs = list(docs)
+        out = np.empty((len(docs), len(self.langs)), dtype=np.float32)
+        for start in range(0, len(docs), batch_size):
+            batch = docs[start:start + batch_size]
+            out[start:start + len(batch)] = self.features(batch) @ self.weights.T
+        return out
+
+    def classify(self, docs, batch_size: int = BATCH_SIZE) -> list:
+        """Список (язык, логарифм правдоподобия) для каждого документа."""
+        scores = self.scores(docs, batch_size)
+        best = scores.argmax(axis=1)
+        return [(self.langs[i], float(s[i])) for i, s in zip(best, scores)]
+
+    def save(self, path: Path = MODEL_FILE):
+        path.parent.mkdir(parents=True, exist_ok=True)
+        np.savez_compressed(path, langs=np.array(self.langs), weights=self.weights,
+                            orders=np.array(self.orders), bits=self.bits, alpha=self.alpha)
+
+    @classmethod
+    def load(cls, path: Path = MODEL_FILE) -> 'NgramLangID':
+        data = np.load(path)
+        model = cls(tuple(data['orders']), int(data['bits']), float(data['alpha']))
+        model.langs = [str(lang) for lang in data['langs']]
+        model.weights = data['weights']
+        return model
+
+
+def load_corpus(input_dir: Path = INPUT_DIR) -> dict:
+    """{язык: текст} для размеченных файлов из parse/."""
+    return {lang: (input_dir / name).read_text(encoding='utf-8-sig')
+            for name, lang in TRAIN_LANGS.items() if (input_dir / name).exists()}
+
+
+def benchmark(corpus: dict) -> pd.DataFrame:
+    """
+    Обучает модель на первых TRAIN_SHARE каждого текста и сравнивает её
+    с langdetect и langid на фрагментах оставшейся части: время, документы
+    в секунду, точность относительно языка текста и согласие методов.
+    """
+    from languade_id import classify_batch, split_documents, _warm_up
+
+    train, docs, gold = {}, [], []
+    for lang, text in corpus.items():
+        cut = int(len(text) * TRAIN_SHARE)
+        train[lang] = text[:cut]
+        held = split_documents(text[cut:], DOC_CHARS)
+        docs.extend(held)
+        gold.extend([lang] * len(held))
+    model = NgramLangID().fit(train)
+
+    predictions, seconds = {}, {}
+    start = time.perf_counter()
+    predictions['ngram'] = [lang for lang, _ in model.classify(docs)]
+    seconds['ngram'] = time.perf_counter() - start
+    _warm_up()
+    for method in ('langdetect', 'langid'):
+        start = time.perf_counter()
+        results = classify_batch(docs, methods=(method,), mode='full', n_jobs=1)
+        seconds[method] = time.perf_counter() - start
+        predictions[method] = [r[method][0] for r in results]
+
+    gold = np.array(gold)
+    rows = []
+    for method, pred in predictions.items():
+        pred = np.array(pred)
+        rows.append({
+            'method': method,
+            'documents': len(docs),
+            'seconds': seconds[method],
+            'docs_per_sec': len(docs) / seconds[method] if seconds[method] else 0.0,
+            'accuracy': float(np.mean(pred == gold)) if len(docs) else 0.0,
+            **{f'agreement_{other}': float(np.mean(pred == np.array(p))) if len(docs) else 0.0
+               for other, p in predictions.items() if other != method},
+        })
+    return pd.DataFrame(rows)
+
+
+def main():
+    corpus = load_corpus()
+    stats = benchmark(corpus)
+    OUTPUT_DIR.mkdir(parents=True, exist_ok=True)
+    stats.to_csv(BENCHMARK_FILE, index=False, quoting=csv.QUOTE_NONNUMERIC)
+    print(stats.to_string(index=False))
+    NgramLangID().fit(corpus).save()
+    print(f"Модель сохранена в {MODEL_FILE}, замеры — в {BENCHMARK_FILE}")
+
+
+if __name__ == '__main__':
+    main()
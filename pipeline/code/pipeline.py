@@ -0,0 +1,376 @@
+"""
+Сквозной потоковый конвейер по модулям проекта:
+определение языка (langid) -> токенизация (razdel и др.) ->
+POS-теггинг pymorphy3 и spaCy -> HMM-теггер.
+
+Каждый этап — генератор над потоком документов, работающий в своём
+потоке; этапы связаны очередями ограниченного размера, поэтому быстрый
+этап ждёт медленный, а память не растёт с длиной входа. Сами вычисления
+этапа (langid, razdel, pymorphy3 — чистый Python, упирающийся в GIL)
+выполняются пакетами в отдельном процессе этого этапа (если доступно
+больше одного ядра), так что этапы работают параллельно; поток только
+передаёт пакеты. Промежуточные
+CSV не пишутся: документ проходит все этапы в памяти и сохраняется
+одной строкой в output/pipeline.jsonl.
+
+Документ — словарь: id, text, lang, lang_score, tokens {токенизатор: [...]},
+pos {метод: [[token, tag], ...]}, hmm [[word, tag], ...].
+Дисковый кэш результатов (common/result_cache.py) на этапах не
+используется: документы потока почти не повторяются, а запись каждого
+результата на диск стоила бы дороже самого вычисления.
+Тексты не на русском (по результату langid) проходят дальше
+без токенизации и разметки: все инструменты ниже рассчитаны на русский.
+langid выбирает только из LANGID_LANGS — языков корпусов проекта:
+с полным набором языков короткие русские абзацы определяются как
+сербские или украинские и терялись бы.
+
+Модули подпроектов загружаются по пути через importlib, так как имена
+pos-taggers.py и каталога «HMM tagger» нельзя импортировать обычным образом.
+"""
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache, partial
+from itertools import islice
+from pathlib import Path
+import argparse
+import importlib.util
+import json
+import multiprocessing
+import os
+import queue
+import sys
+import threading
+import time
+
+ROOT_DIR = Path(__file__).resolve().parents[2]
+BASE_DIR = Path(__file__).resolve().parent.parent
+OUTPUT_FILE = BASE_DIR / 'output' / 'pipeline.jsonl'
+DEFAULT_INPUTS = [ROOT_DIR / 'pos-taggers' / 'parse', ROOT_DIR / 'language-identification' / 'parse']
+
+MODULES = {
+    'langid': ROOT_DIR / 'language-identification' / 'code' / 'languade_id.py',
+    'tokenization': ROOT_DIR / 'tokenization-pipeline' / 'code' / 'tokenization_comparison.py',
+    'pos': ROOT_DIR / 'pos-taggers' / 'code' / 'pos-taggers.py',
+    'hmm': ROOT_DIR / 'HMM tagger' / 'code' / 'HMM_tagger.py',
+}
+STAGES = ('langid', 'tokenize', 'pymorphy', 'spacy', 'hmm')
+LANGS = {'ru'}                 # языки, которые размечаются после langid
+LANGID_LANGS = ('ru', 'en', 'de')  # из каких языков выбирает langid
+TOKENIZER_NAMES = ('razdel',)
+HMM_TOKENIZER = 'razdel'       # чьи токены получает HMM-теггер
+SENT_END = {'.', '!', '?', '…'}
+QUEUE_SIZE = 64                # документов в очереди между этапами
+BATCH_SIZE = 32                # документов в пакете для пакетных этапов
+# Процессы этапов имеют смысл, только если ядер больше одного
+N_CPUS = len(os.sched_getaffinity(0)) if hasattr(os, 'sched_getaffinity') else (os.cpu_count() or 1)
+POLL_SECONDS = 0.1             # как часто ждущий очереди поток проверяет остановку
+
+_DONE = object()
+
+
+@lru_cache(maxsize=None)
+def load_module(key: str):
+    """Загружает модуль подпроекта по пути (один раз на процесс)."""
+    path = MODULES[key]
+    sys.path.insert(0, str(path.parent))
+    spec = importlib.util.spec_from_file_location(path.stem, path)
+    module = importlib.util.module_from_spec(spec)
+    # Регистрируем до выполнения: пулы процессов внутри модулей находят функции по имени модуля
+    sys.modules[spec.name] = module
+    spec.loader.exec_module(module)
+    return module
+
+
+def batched(docs, size: int):
+    """Пакеты по size документов из потока."""
+    docs = iter(docs)
+    while batch := list(islice(docs, size)):
+        yield batch
+
+
+def selected(doc) -> bool:
+    """Нужно ли размечать документ (язык не определён или из LANGS)."""
+    return doc.get('lang', next(iter(LANGS))) in LANGS
+
+
+# Пакетные вычисления этапов: выполняются в процессе этапа или в текущем
+
+def _run(pool, fn, *args):
+    """fn(*args) в процессе этапа (pool) или, если пула нет, в текущем процессе."""
+    return fn(*args) if pool is None else pool.submit(fn, *args).result()
+
+
+def _langid_batch(texts):
+    langid = load_module('langid')
+    classify = langid.restricted_langid(LANGID_LANGS).classify
+    return [classify(langid.sample_text(text)) for text in texts]
+
+
+def _tokenize_batch(names, texts):
+    get_tokenizer = load_module('tokenization').get_tokenizer
+    return {name: get_tokenizer(name).uncached(texts) for name in names}
+
+
+def _pymorphy_batch(texts):
+    tag = load_module('pos').tag_pymorphy.uncached
+    return [[list(pair) for pair in tag(text)] for text in texts]
+
+
+def _spacy_batch(texts):
+    tagged = load_module('pos').tag_spacy_batch(texts, cache=None)
+    return [[list(pair) for pair in tags] for tags in tagged]
+
+
+@lru_cache(maxsize=None)
+def _hmm_model(model):
+    return load_module('hmm').load_model(model)
+
+
+def _hmm_batch(sents, model):
+    hmm = load_module('hmm')
+    model = _hmm_model(model) if isinstance(model, (str, Path)) else model
+    return [[list(pair) for pair in tagged] for tagged in hmm.tag_sentences(sents, model)]
+
+
+# Этапы: генераторы документ -> документ
+
+def stage_langid(docs, pool=None, batch_size=BATCH_SIZE):
+    for batch in batched(docs, batch_size):
+        for doc, (lang, score) in zip(batch, _run(pool, _langid_batch, [doc['text'] for doc in batch])):
+            doc['lang'], doc['lang_score'] = lang, score
+        yield from batch
+
+
+def stage_tokenize(docs, pool=None, names=TOKENIZER_NAMES, batch_size=BATCH_SIZE):
+    for batch in batched(docs, batch_size):
+        todo = [doc for doc in batch if selected(doc)]
+        if todo:
+            tokens = _run(pool, _tokenize_batch, tuple(names), [doc['text'] for doc in todo])
+            for name, per_doc in tokens.items():
+                for doc, toks in zip(todo, per_doc):
+                    doc.setdefault('tokens', {})[name] = toks
+        yield from batch
+
+
+def stage_pymorphy(docs, pool=None, batch_size=BATCH_SIZE):
+    for batch in batched(docs, batch_size):
+        todo = [doc for doc in batch if selected(doc)]
+        if todo:
+            for doc, tags in zip(todo, _run(pool, _pymorphy_batch, [doc['text'] for doc in todo])):
+                doc.setdefault('pos', {})['pymorphy3'] = tags
+        yield from batch
+
+
+def stage_spacy(docs, pool=None, batch_size=BATCH_SIZE):
+    for batch in batched(docs, batch_size):
+        todo = [doc for doc in batch if selected(doc)]
+        if todo:
+            for doc, tags in zip(todo, _run(pool, _spacy_batch, [doc['text'] for doc in todo])):
+                doc.setdefault('pos', {})['spacy'] = tags
+        yield from batch
+
+
+def split_sentences(tokens):
+    """Делит токены на предложения по конечной пунктуации."""
+    sent = []
+    for tok in tokens:
+        sent.append(tok)
+        if tok in SENT_END:
+            yield sent
+            sent = []
+    if sent:
+        yield sent
+
+
+def stage_hmm(docs, pool=None, model=None, batch_size=BATCH_SIZE):
+    """model — путь к модели или HMMModel; по умолчанию MODEL_DIR из HMM_tagger."""
+    model = model or str(load_module('hmm').MODEL_DIR)
+    for batch in batched(docs, batch_size):
+        todo = [doc for doc in batch if selected(doc)]
+        sents, owners = [], []
+        for doc in todo:
+            for sent in split_sentences(doc['tokens'][HMM_TOKENIZER]):
+                sents.append(sent)
+                owners.append(doc)
+            doc['hmm'] = []
+        if sents:
+            for doc, tagged in zip(owners, _run(pool, _hmm_batch, sents, model)):
+                doc['hmm'].extend(tagged)
+        yield from batch
+
+
+def build_stages(names=STAGES):
+    """Список этапов по именам с проверкой зависимостей."""
+    funcs = {'langid': stage_langid, 'tokenize': stage_tokenize, 'pymorphy': stage_pymorphy,
+             'spacy': stage_spacy, 'hmm': stage_hmm}
+    names = list(names)
+    unknown = [n for n in names if n not in funcs]
+    if unknown:
+        raise ValueError(f"Неизвестные этапы: {', '.join(unknown)}. Доступны: {', '.join(funcs)}")
+    if 'hmm' in names and ('tokenize' not in names or names.index('tokenize') > names.index('hmm')):
+        raise ValueError("Этапу hmm нужны токены: поставьте tokenize перед ним")
+    if 'hmm' in names and HMM_TOKENIZER not in TOKENIZER_NAMES:
+        raise ValueError(f"Этапу hmm нужны токены {HMM_TOKENIZER}")
+    return [funcs[n] for n in names]
+
+
+def missing_stages(names) -> dict:
+    """
+    Этапы, для которых не установлена модель: {этап: причина}.
+    Такие этапы пропускаются, а не падают посреди потока.
+    """
+    missing = {}
+    if 'spacy' in names:
+        model = load_module('pos').SPACY_MODEL
+        if importlib.util.find_spec(model) is None:
+            missing['spacy'] = f"Модель spaCy {model} не установлена (python -m spacy download {model})"
+    if 'hmm' in names and not (load_module('hmm').MODEL_DIR / 'tags.txt').exists():
+        missing['hmm'] = "Модель HMM не найдена (сначала запустите HMM_tagger.py)"
+    return missing
+
+
+# Запуск этапов в потоках с очередями
+
+class _Failure:
+    """Исключение этапа, передаётся по очередям до потребителя."""
+
+    def __init__(self, error):
+        self.error = error
+
+
+def _put(q: queue.Queue, item, stop: threading.Event) -> bool:
+    """Кладёт item в очередь; False, если конвейер остановлен раньше."""
+    while not stop.is_set():
+        try:
+            q.put(item, timeout=POLL_SECONDS)
+            return True
+        except queue.Full:
+            pass
+    return False
+
+
+def _drain(q: queue.Queue, stop: threading.Event = None):
+    """Элементы очереди до _DONE; при остановке конвейера поток просто заканчивается."""
+    while True:
+        try:
+            item = q.get(timeout=POLL_SECONDS)
+        except queue.Empty:
+            if stop is not None and stop.is_set():
+                return
+            continue
+        if item is _DONE:
+            return
+        if isinstance(item, _Failure):
+            raise item.error
+        yield item
+
+
+def _pump(make_items, out: queue.Queue, stop: threading.Event):
+    """Передаёт в очередь элементы make_items() (вызывается уже в потоке этапа)."""
+    try:
+        for item in make_items():
+            if not _put(out, item, stop):
+                return
+    except BaseException as err:
+        _put(out, _Failure(err), stop)
+    else:
+        _put(out, _DONE, stop)
+
+
+def _mp_context():
+    """
+    Контекст процессов этапов. fork из процесса с работающими потоками
+    небезопасен, поэтому используется forkserver (или spawn, где его нет).
+    """
+    methods = multiprocessing.get_all_start_methods()
+    return multiprocessing.get_context('forkserver' if 'forkserver' in methods else 'spawn')
+
+
+def run_pipeline(docs, stages, queue_size: int = QUEUE_SIZE, processes: bool = None):
+    """
+    Пропускает поток документов через этапы, каждый в своём потоке.
+    При processes=True пакеты каждого этапа вычисляются в отдельном
+    процессе этого этапа (по умолчанию — если доступно больше одного ядра). Очереди между этапами ограничены queue_size.
+    Возвращает генератор обработанных документов в исходном порядке;
+    исключение любого этапа пробрасывается потребителю. Если потребитель
+    прекращает чтение раньше или получает исключение, потоки этапов
+    останавливаются, а процессы завершаются.
+    """
+    if processes is None:
+        processes = N_CPUS > 1
+    stop = threading.Event()
+    context = _mp_context() if processes else None
+    pools = [ProcessPoolExecutor(max_workers=1, mp_context=context) if processes else None
+             for _ in stages]
+    queues = [queue.Queue(maxsize=queue_size) for _ in range(len(stages) + 1)]
+    workers = [threading.Thread(target=_pump, args=(partial(iter, docs), queues[0], stop), daemon=True)]
+    for stage, pool, inq, outq in zip(stages, pools, queues, queues[1:]):
+        make_items = partial(stage, _drain(inq, stop), pool=pool)
+        workers.append(threading.Thread(target=_pump, args=(make_items, outq, stop), daemon=True))
+    try:
+        for w in workers:
+            w.start()
+        yield from _drain(queues[-1])
+    finally:
+        stop.set()
+        for w in workers:
+            if w.ident is not None:
+                w.join()
+        for pool in pools:
+            if pool is not None:
+                pool.shutdown(cancel_futures=True)
+
+
+def iter_documents(paths, paragraphs: bool = False):
+    """
+    Документы из файлов и каталогов (*.txt). При paragraphs=True каждый
+    непустой абзац — отдельный документ.
+    """
+    load_text = load_module('pos').load_text
+    for path in paths:
+        files = sorted(path.glob('*.txt')) if path.is_dir() else [path]
+        for file_path in files:
+            text = load_text(file_path)
+            parts = text.split('\n') if paragraphs else [text]
+            for i, part in enumerate(p for p in parts if p.strip()):
+                doc_id = f"{file_path.name}#{i}" if paragraphs else file_path.name
+                yield {'id': doc_id, 'text': part}
+
+
+def write_jsonl(docs, path: Path = OUTPUT_FILE) -> int:
+    """Записывает документы по одному в строке JSON, возвращает их число."""
+    path.parent.mkdir(parents=True, exist_ok=True)
+    n = 0
+    with path.open('w', encoding='utf-8') as f:
+        for doc in docs:
+            f.write(json.dumps(doc, ensure_ascii=False) + '\n')
+            n += 1
+    return n
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('inputs', type=Path, nargs='*', default=DEFAULT_INPUTS,
+                        help='файлы или каталоги с .txt')
+    parser.add_argument('--stages', nargs='+', default=list(STAGES), help='этапы по порядку')
+    parser.add_argument('--paragraphs', action='store_true', help='каждый абзац — отдельный документ')
+    parser.add_argument('--queue-size', type=int, default=QUEUE_SIZE)
+    parser.add_argument('--output', type=Path, default=OUTPUT_FILE)
+    parser.add_argument('--no-processes', action='store_true',
+                        help='вычислять этапы в потоках текущего процесса')
+    args = parser.parse_args()
+
+    missing = missing_stages(args.stages)
+    for name, reason in missing.items():
+        print(f"{reason}, этап {name} пропущен")
+    args.stages = [s for s in args.stages if s not in missing]
+    stages = build_stages(args.stages)
+    start = time.perf_counter()
+    docs = run_pipeline(iter_documents(args.inputs, args.paragraphs), stages, args.queue_size,
+                        processes=False if args.no_processes else None)
+    n = write_jsonl(docs, args.output)
+    seconds = time.perf_counter() - start
+    print(f"Документов: {n}, {seconds:.2f} с ({n / seconds:.1f} док/с). Результаты: {args.output}")
+
+
+if __name__ == '__main__':
+    main()
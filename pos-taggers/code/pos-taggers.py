@@ -1,25 +1,64 @@
 """
-Сравнение POS-тэггеров pymorphy3 и spaCy для русского текста
+Сравнение POS-тэггеров pymorphy3 и spaCy для русского текста.
+Результаты теггинга можно кэшировать на диске (common/result_cache.py,
+включается NLP_CACHE=1).
+
+Импорт модуля ничего тяжёлого не загружает: pymorphy3 и spaCy
+импортируются и инициализируются при первом обращении через
+get_morph() и get_nlp(), поэтому процесс, которому нужен один
+бэкенд, не платит за другой. Модель spaCy не скачивается
+автоматически: если её нет, get_nlp() сообщает, как её установить.
 """
+from functools import lru_cache, partial
 from pathlib import Path
-import csv
-from pymorphy3 import MorphAnalyzer
-from pymorphy3.tokenizers import simple_word_tokenize
-import spacy
+import os
+import re
+import sys
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[2] / 'common'))
+from result_cache import RESULT_CACHE, package_version
+from morph_cache import CachedMorphAnalyzer
 
 BASE_DIR = Path(__file__).resolve().parent.parent
 INPUT_DIR = BASE_DIR / 'parse'
 OUTPUT_DIR = BASE_DIR / 'output'
 
-# Инициализация анализаторов
-morph = MorphAnalyzer()
-# Загружаем модель spaCy ru_core_news_sm, загружаем её при отсутствии
-try:
-    nlp = spacy.load('ru_core_news_sm')
-except OSError:
-    import spacy.cli
-    spacy.cli.download('ru_core_news_sm')
-    nlp = spacy.load('ru_core_news_sm')
+SPACY_MODEL = 'ru_core_news_sm'
+# Компоненты spaCy, не нужные для POS-теггинга
+SPACY_EXCLUDE = ['parser', 'lemmatizer', 'ner']
+# Пакетный режим spaCy: размер пакета, число процессов и максимальная
+# длина куска, на которые режутся большие тексты
+SPACY_BATCH_SIZE = 64
+SPACY_N_PROCESS = os.cpu_count() or 1
+SPLIT_CHARS = 100_000
+SENT_END = re.compile(r'(?<=[.!?…])\s+')
+
+
+@lru_cache(maxsize=None)
+def get_morph() -> CachedMorphAnalyzer:
+    """
+    Анализатор pymorphy3, создаётся при первом вызове.
+    Разборы кэшируются по словоформе.
+    """
+    from pymorphy3 import MorphAnalyzer
+    return CachedMorphAnalyzer(MorphAnalyzer())
+
+
+@lru_cache(maxsize=None)
+def get_nlp():
+    """
+    Конвейер spaCy только с компонентами, нужными для POS,
+    загружается при первом вызове. Модель не скачивается:
+    при её отсутствии выбрасывается RuntimeError с подсказкой.
+    """
+    import spacy
+    try:
+        return spacy.load(SPACY_MODEL, exclude=SPACY_EXCLUDE)
+    except OSError as err:
+        raise RuntimeError(
+            f"Модель spaCy {SPACY_MODEL} не установлена. "
+            f"Установите её командой: python -m spacy download {SPACY_MODEL}"
+        ) from err
 
 
 def load_text(file_path: Path) -> str:
@@ -33,42 +72,120 @@ def load_text(file_path: Path) -> str:
         return file_path.read_text(encoding='cp1251')
 
 
+@RESULT_CACHE.memoize('pymorphy3', partial(package_version, 'pymorphy3'),
+                      lambda: {'dicts': package_version('pymorphy3-dicts-ru')})
 def tag_pymorphy(text: str) -> list[tuple[str, str]]:
     """
     Токенизация и POS-теггинг через pymorphy3.
     Возвращает список кортежей (token, POS_tag).
     """
+    from pymorphy3.tokenizers import simple_word_tokenize
+    morph = get_morph()
     tokens = simple_word_tokenize(text)
     tags = []
     for tok in tokens:
         parsed = morph.parse(tok)[0]
-        pos = parsed.tag.POS or 'X'
+        pos = str(parsed.tag.POS or 'X')
         tags.append((parsed.word, pos))
     return tags
 
 
+def split_text(text: str, max_chars: int = SPLIT_CHARS) -> list[str]:
+    """
+    Режет текст на куски не длиннее max_chars по границам абзацев;
+    слишком длинные абзацы режутся по предложениям. Пробелы между
+    предложениями остаются в конце предыдущего куска, поэтому
+    ''.join(split_text(text)) == text и отрезки токенов совпадают с текстом.
+    Текст короче max_chars возвращается целиком.
+    """
+    if len(text) <= max_chars:
+        return [text]
+    units = []
+    for para in text.splitlines(keepends=True):
+        if len(para) <= max_chars:
+            units.append(para)
+            continue
+        cuts = [0, *(m.end() for m in SENT_END.finditer(para)), len(para)]
+        for sent in (para[i:j] for i, j in zip(cuts, cuts[1:]) if i < j):
+            units.extend(sent[i:i + max_chars] for i in range(0, len(sent), max_chars))
+    pieces, buf, size = [], [], 0
+    for unit in units:
+        if size + len(unit) > max_chars and buf:
+            pieces.append(''.join(buf))
+            buf, size = [], 0
+        buf.append(unit)
+        size += len(unit)
+    if buf:
+        pieces.append(''.join(buf))
+    return pieces
+
+
+def tag_spacy_batch(texts: list[str], batch_size: int = SPACY_BATCH_SIZE,
+                    n_process: int = 1, cache=RESULT_CACHE) -> list[list[tuple[str, str]]]:
+    """
+    Пакетный POS-теггинг через nlp.pipe. Большие тексты режутся split_text,
+    все куски всех текстов идут в nlp.pipe с batch_size и n_process,
+    затем результаты собираются обратно по текстам.
+    Результаты кэшируются по тексту в cache (None — без кэша);
+    в nlp.pipe попадают только промахи.
+    """
+    use_cache = cache is not None and cache.enabled
+    if use_cache:
+        config = {'model': SPACY_MODEL, 'model_version': package_version(SPACY_MODEL),
+                  'exclude': SPACY_EXCLUDE, 'split_chars': SPLIT_CHARS}
+        version = package_version('spacy')
+        keys = [cache.key(t, 'spacy', version, config) for t in texts]
+        results = [cache.get(k) for k in keys]
+    else:
+        results = [None] * len(texts)
+    missing = [i for i, r in enumerate(results) if r is None]
+
+    pieces, owners = [], []
+    for i in missing:
+        results[i] = []
+        for piece in split_text(texts[i]):
+            pieces.append(piece)
+            owners.append(i)
+    if not pieces:
+        return results
+    docs = get_nlp().pipe(pieces, batch_size=batch_size, n_process=n_process)
+    for i, doc in zip(owners, docs):
+        results[i].extend((token.text, token.pos_) for token in doc)
+    if use_cache:
+        for i in missing:
+            cache.put(keys[i], results[i])
+    return results
+
+
 def tag_spacy(text: str) -> list[tuple[str, str]]:
     """
     POS-теггинг через spaCy.
     Возвращает список (token, pos_), где pos_ — универсальная POS-тег.
     """
-    doc = nlp(text)
-    return [(token.text, token.pos_) for token in doc]
+    return tag_spacy_batch([text])[0]
 
 
-def save_to_csv(results: dict[str, list[tuple[str, str]]], prefix: str):
+def save_tagged(results: dict[str, list[tuple[str, str]]], prefix: str, text: str):
     """
-    Сохраняет результаты теггинга в CSV-файлы.
-    Для каждого метода создаёт файл output/{prefix}_{method}.csv
+    Сохраняет результаты теггинга в колоночном формате (common/columnar.py).
+    Для каждого метода создаёт таблицу output/{prefix}_{method}.cols
+    с колонками token, pos (словарное кодирование) и start, end —
+    символьный отрезок токена в тексте (пустой, если токен не найден).
     """
+    # numpy нужен только при записи: импорт модуля остаётся лёгким
+    from columnar import STR, write_table
+    from pos_evaluation import token_offsets
+    schema = {'token': STR, 'pos': STR, 'start': 'int64', 'end': 'int64'}
     OUTPUT_DIR.mkdir(parents=True, exist_ok=True)
     for method, tags in results.items():
-        path = OUTPUT_DIR / f"{prefix}_{method}.csv"
-        with open(path, 'w', newline='', encoding='utf-8') as f:
-            writer = csv.writer(f)
-            writer.writerow(['token', 'pos'])
-            for token, pos in tags:
-                writer.writerow([token, pos])
+        tokens = [token for token, _ in tags]
+        spans = token_offsets(text, tokens)
+        write_table(OUTPUT_DIR / f"{prefix}_{method}", {
+            'token': tokens,
+            'pos': [pos for _, pos in tags],
+            'start': spans[:, 0],
+            'end': spans[:, 1],
+        }, schema=schema)
 
 
 def main():
@@ -76,12 +193,19 @@ def main():
     Основная функция: обходит все тексты в папке parse/,
     применяет два метода теггинга и сохраняет результаты.
     """
-    for file_path in sorted(INPUT_DIR.glob('*.txt')):
-        text = load_text(file_path)
+    files = sorted(INPUT_DIR.glob('*.txt'))
+    texts = [load_text(file_path) for file_path in files]
+    spacy_tags = tag_spacy_batch(texts, n_process=SPACY_N_PROCESS)
+    for file_path, text, sp in zip(files, texts, spacy_tags):
         pym = tag_pymorphy(text)
-        sp = tag_spacy(text)
-        save_to_csv({'pymorphy3': pym, 'spacy': sp}, file_path.stem)
+        save_tagged({'pymorphy3': pym, 'spacy': sp}, file_path.stem, text)
         print(f"Processed: {file_path.name}")
+    stats = get_morph().stats()
+    print(f"pymorphy3 cache: {stats['hits']} hits, {stats['misses']} misses, "
+          f"hit rate {stats['hit_rate']:.1%}")
+
+    from pos_evaluation import evaluate_corpus, iter_documents, save_report
+    print(save_report(evaluate_corpus(iter_documents())).to_string(index=False))
 
 
 if __name__ == '__main__':
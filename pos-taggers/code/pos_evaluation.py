@@ -0,0 +1,256 @@
+"""
+Оценка POS-тэггеров: согласие pymorphy3 и spaCy между собой и, если есть
+эталонная разметка, точность каждого из них относительно эталона.
+
+Потоки токенов выравниваются по символьным отрезкам исходного текста,
+теги обоих тэггеров (и эталона) переводятся в общий универсальный набор,
+затем матрицы ошибок, точность, полнота и F1 по тегам считаются
+векторно через numpy. Матрицы отдельных документов складываются,
+поэтому корпус из тысяч документов обрабатывается за секунды.
+
+Разметки читаются из output/ (таблицы .cols, для старых прогонов — CSV).
+Эталон ищется в parse/gold/{имя текста}.csv с колонками token,pos;
+теги могут быть в наборе OpenCorpora, UD или НКРЯ (RuEval-2010),
+набор определяется автоматически.
+"""
+from pathlib import Path
+import csv
+import re
+import sys
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[2] / 'common'))
+from alignment import token_spans
+from columnar import SUFFIX, read_table
+
+BASE_DIR = Path(__file__).resolve().parent.parent
+INPUT_DIR = BASE_DIR / 'parse'
+OUTPUT_DIR = BASE_DIR / 'output'
+GOLD_DIR = INPUT_DIR / 'gold'
+METHODS = ('pymorphy3', 'spacy')
+
+# Общий набор тегов (по мотивам универсального набора Petrov et al.).
+# DET сводится к ADJ, так как pymorphy3 размечает местоимённые
+# прилагательные как ADJF; SCONJ и CCONJ — к CONJ.
+UNIVERSAL_TAGS = ['NOUN', 'VERB', 'ADJ', 'ADV', 'PRON', 'ADP', 'NUM', 'CONJ', 'PRT', 'PUNCT', 'X']
+TAG_INDEX = {t: i for i, t in enumerate(UNIVERSAL_TAGS)}
+
+TAGSETS = {
+    'opencorpora': {
+        'NOUN': 'NOUN', 'ADJF': 'ADJ', 'ADJS': 'ADJ', 'COMP': 'ADJ',
+        'VERB': 'VERB', 'INFN': 'VERB', 'PRTF': 'VERB', 'PRTS': 'VERB', 'GRND': 'VERB',
+        'NUMR': 'NUM', 'ADVB': 'ADV', 'PRED': 'ADV', 'NPRO': 'PRON',
+        'PREP': 'ADP', 'CONJ': 'CONJ', 'PRCL': 'PRT', 'INTJ': 'X', 'X': 'X',
+    },
+    'ud': {
+        'NOUN': 'NOUN', 'PROPN': 'NOUN', 'VERB': 'VERB', 'AUX': 'VERB',
+        'ADJ': 'ADJ', 'DET': 'ADJ', 'ADV': 'ADV', 'PRON': 'PRON', 'ADP': 'ADP',
+        'NUM': 'NUM', 'CCONJ': 'CONJ', 'SCONJ': 'CONJ', 'PART': 'PRT',
+        'PUNCT': 'PUNCT', 'SYM': 'PUNCT', 'INTJ': 'X', 'X': 'X',
+    },
+    'rnc': {
+        'S': 'NOUN', 'A': 'ADJ', 'ANUM': 'ADJ', 'APRO': 'ADJ', 'NUM': 'NUM',
+        'V': 'VERB', 'ADV': 'ADV', 'ADVPRO': 'ADV', 'PRAEDIC': 'ADV', 'PARENTH': 'ADV',
+        'SPRO': 'PRON', 'PR': 'ADP', 'CONJ': 'CONJ', 'PART': 'PRT',
+        'INTJ': 'X', 'INIT': 'NOUN', 'NONLEX': 'X',
+    },
+}
+METHOD_TAGSETS = {'pymorphy3': 'opencorpora', 'spacy': 'ud'}
+# Теги, токены с которыми не участвуют в сравнении (пробелы spaCy)
+SKIP_TAGS = {'SPACE'}
+PUNCT_RE = re.compile(r'^[^\w\s]+$')
+DIGITS_RE = re.compile(r'^\d+([.,]\d+)?$')
+
+
+def load_tagged(path: Path) -> tuple[list[str], list[str]]:
+    """Читает разметку: таблицу .cols (см. save_tagged) или CSV с колонками token,pos."""
+    if path.suffix == SUFFIX:
+        table = read_table(path)
+        return list(table['token']), list(table['pos'])
+    with open(path, newline='', encoding='utf-8') as f:
+        rows = list(csv.DictReader(f))
+    return [r['token'] for r in rows], [r['pos'] for r in rows]
+
+
+def detect_tagset(tags) -> str:
+    """Выбирает набор тегов, в который попадает больше всего тегов."""
+    tags = set(tags) - SKIP_TAGS
+    return max(TAGSETS, key=lambda name: len(tags & TAGSETS[name].keys()))
+
+
+def to_universal(tokens, tags, tagset: str) -> np.ndarray:
+    """
+    Переводит теги в индексы UNIVERSAL_TAGS; -1 — токен не сравнивается.
+    Пунктуация и числа, которые pymorphy3 помечает как X, уточняются по форме токена.
+    """
+    mapping = TAGSETS[tagset]
+    ids = np.empty(len(tags), dtype=np.int64)
+    for i, (tok, tag) in enumerate(zip(tokens, tags)):
+        if tag in SKIP_TAGS or not tok.strip():
+            ids[i] = -1
+            continue
+        common = mapping.get(tag, 'X')
+        if common == 'X':
+            if PUNCT_RE.match(tok):
+                common = 'PUNCT'
+            elif DIGITS_RE.match(tok):
+                common = 'NUM'
+        ids[i] = TAG_INDEX[common]
+    return ids
+
+
+def fold(text: str) -> str:
+    """
+    Нижний регистр и ё -> е с сохранением длины строки: pymorphy3
+    возвращает слова в нижнем регистре и с ё, которой в тексте может не быть.
+    """
+    low = text.lower()
+    if len(low) != len(text):
+        low = ''.join(ch.lower() if len(ch.lower()) == 1 else ch for ch in text)
+    return low.replace('ё', 'е')
+
+
+def token_offsets(text: str, tokens) -> np.ndarray:
+    """
+    Символьные отрезки токенов в тексте (общий token_spans из
+    common/alignment.py, без учёта регистра и различия ё/е).
+    Ненайденный токен получает пустой отрезок и в выравнивание не попадает.
+    """
+    spans = token_spans(fold(text), [fold(tok) for tok in tokens])
+    return np.array(spans, dtype=np.int64).reshape(len(spans), 2)
+
+
+def align(spans_a: np.ndarray, spans_b: np.ndarray, text_len: int):
+    """
+    Пары токенов двух потоков с совпадающими непустыми отрезками текста;
+    пустые отрезки (ненайденные токены) ни с чем не сопоставляются.
+    Возвращает индексы (idx_a, idx_b) одинаковой длины.
+    """
+    def keys(spans):
+        idx = np.flatnonzero(spans[:, 0] < spans[:, 1])
+        return idx, spans[idx, 0] * (text_len + 1) + spans[idx, 1]
+    (rows_a, keys_a), (rows_b, keys_b) = keys(spans_a), keys(spans_b)
+    _, idx_a, idx_b = np.intersect1d(keys_a, keys_b, return_indices=True)
+    return rows_a[idx_a], rows_b[idx_b]
+
+
+def confusion(ref: np.ndarray, pred: np.ndarray) -> np.ndarray:
+    """Матрица ошибок (эталон x предсказание) по парам, где оба тега заданы."""
+    k = len(UNIVERSAL_TAGS)
+    mask = (ref >= 0) & (pred >= 0)
+    return np.bincount(ref[mask] * k + pred[mask], minlength=k * k).reshape(k, k)
+
+
+def tag_report(conf: np.ndarray) -> pd.DataFrame:
+    """Точность, полнота, F1 и число эталонных токенов по каждому тегу."""
+    tp = np.diag(conf).astype(float)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        precision = np.nan_to_num(tp / conf.sum(axis=0))
+        recall = np.nan_to_num(tp / conf.sum(axis=1))
+        f1 = np.nan_to_num(2 * precision * recall / (precision + recall))
+    return pd.DataFrame({'tag': UNIVERSAL_TAGS, 'precision': precision, 'recall': recall,
+                         'f1': f1, 'support': conf.sum(axis=1)})
+
+
+def kappa(conf: np.ndarray) -> float:
+    """Каппа Коэна по матрице согласия двух разметок."""
+    total = conf.sum()
+    if not total:
+        return 0.0
+    observed = np.trace(conf) / total
+    expected = (conf.sum(axis=0) * conf.sum(axis=1)).sum() / total ** 2
+    return float((observed - expected) / (1 - expected)) if expected < 1 else 1.0
+
+
+def evaluate_document(text: str, predictions: dict, gold=None) -> dict:
+    """
+    Матрицы ошибок для одного документа.
+    predictions — {метод: (tokens, tags)}, gold — (tokens, tags) или None.
+    Ключи результата: (эталон, метод) — 'gold' или имя метода в роли эталона.
+    """
+    streams = {}
+    for name, (tokens, tags) in predictions.items():
+        tagset = METHOD_TAGSETS.get(name) or detect_tagset(tags)
+        streams[name] = (token_offsets(text, tokens), to_universal(tokens, tags, tagset))
+    if gold is not None:
+        tokens, tags = gold
+        streams['gold'] = (token_offsets(text, tokens), to_universal(tokens, tags, detect_tagset(tags)))
+
+    names = list(predictions)
+    pairs = [('gold', n) for n in names if 'gold' in streams]
+    pairs += [(a, b) for i, a in enumerate(names) for b in names[i + 1:]]
+    result = {}
+    for ref, pred in pairs:
+        (spans_r, ids_r), (spans_p, ids_p) = streams[ref], streams[pred]
+        idx_r, idx_p = align(spans_r, spans_p, len(text))
+        result[(ref, pred)] = confusion(ids_r[idx_r], ids_p[idx_p])
+    return result
+
+
+def evaluate_corpus(documents) -> dict:
+    """
+    Складывает матрицы evaluate_document по документам.
+    documents — итерируемый набор (text, predictions, gold).
+    """
+    total = {}
+    for text, predictions, gold in documents:
+        for key, conf in evaluate_document(text, predictions, gold).items():
+            total[key] = total.get(key, 0) + conf
+    return total
+
+
+def save_report(confusions: dict, output_dir: Path = OUTPUT_DIR) -> pd.DataFrame:
+    """
+    Сохраняет evaluation.csv (метрики по тегам для каждой пары) и
+    confusion_{эталон}_{метод}.csv. Возвращает сводку: точность
+    (доля совпавших тегов) и каппа для каждой пары.
+    """
+    output_dir.mkdir(parents=True, exist_ok=True)
+    reports, summary = [], []
+    for (ref, pred), conf in confusions.items():
+        rep = tag_report(conf)
+        rep.insert(0, 'method', pred)
+        rep.insert(0, 'reference', ref)
+        reports.append(rep)
+        pd.DataFrame(conf, index=UNIVERSAL_TAGS, columns=UNIVERSAL_TAGS).to_csv(
+            output_dir / f'confusion_{ref}_{pred}.csv')
+        total = conf.sum()
+        summary.append({'reference': ref, 'method': pred, 'tokens': int(total),
+                        'accuracy': np.trace(conf) / total if total else 0.0,
+                        'kappa': kappa(conf)})
+    if reports:
+        pd.concat(reports, ignore_index=True).to_csv(output_dir / 'evaluation.csv', index=False)
+    return pd.DataFrame(summary)
+
+
+def iter_documents(input_dir: Path = INPUT_DIR, output_dir: Path = OUTPUT_DIR):
+    """
+    Документы для оценки: исходный текст, разметки из output/ и эталон,
+    если он есть в parse/gold/.
+    """
+    from importlib import import_module
+    load_text = import_module('pos-taggers').load_text
+    for file_path in sorted(input_dir.glob('*.txt')):
+        predictions = {}
+        for method in METHODS:
+            for suffix in (SUFFIX, '.csv'):
+                path = output_dir / f"{file_path.stem}_{method}{suffix}"
+                if path.exists():
+                    predictions[method] = load_tagged(path)
+                    break
+        if not predictions:
+            continue
+        gold_path = GOLD_DIR / f"{file_path.stem}.csv"
+        gold = load_tagged(gold_path) if gold_path.exists() else None
+        yield load_text(file_path), predictions, gold
+
+
+def main():
+    summary = save_report(evaluate_corpus(iter_documents()))
+    print(summary.to_string(index=False))
+
+
+if __name__ == '__main__':
+    main()
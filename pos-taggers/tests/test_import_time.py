@@ -0,0 +1,35 @@
+from pathlib import Path
+import json
+import subprocess
+import sys
+
+PATH = Path(__file__).resolve().parents[1] / 'code' / 'pos-taggers.py'
+# Бюджет на импорт модуля (без запуска интерпретатора): воркеры пула
+# должны стартовать за миллисекунды
+IMPORT_BUDGET = 0.1
+HEAVY = ('pymorphy3', 'spacy', 'numpy', 'pandas')
+
+SCRIPT = f"""
+import importlib.util, json, sys, time
+start = time.perf_counter()
+spec = importlib.util.spec_from_file_location('pos_taggers', {str(PATH)!r})
+module = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(module)
+seconds = time.perf_counter() - start
+print(json.dumps({{'seconds': seconds, 'heavy': [m for m in {HEAVY!r} if m in sys.modules]}}))
+"""
+
+
+def run_import():
+    out = subprocess.run([sys.executable, '-c', SCRIPT], capture_output=True, text=True, check=True)
+    return json.loads(out.stdout)
+
+
+def test_import_is_light():
+    assert run_import()['heavy'] == []
+
+
+def test_import_time_budget():
+    # Лучший из нескольких запусков, чтобы не зависеть от случайной нагрузки
+    best = min(run_import()['seconds'] for _ in range(3))
+    assert best < IMPORT_BUDGET, f"импорт занял {best:.3f} с, бюджет {IMPORT_BUDGET} с"
@@ -0,0 +1,25 @@
+from pathlib import Path
+import importlib.util
+
+PATH = Path(__file__).resolve().parents[1] / 'code' / 'pos-taggers.py'
+spec = importlib.util.spec_from_file_location('pos_taggers', PATH)
+pos_taggers = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(pos_taggers)
+split_text = pos_taggers.split_text
+
+
+def test_pieces_join_back_to_text():
+    text = "Первое. Второе!\n\nТретье?  Четвёртое.\nПятое…\t Шестое" * 3
+    for n in (5, 12, 20, 40):
+        pieces = split_text(text, n)
+        assert ''.join(pieces) == text
+        assert all(len(p) <= n for p in pieces)
+
+
+def test_long_paragraph_cut_after_separator():
+    text = "Третье?  Четвёртое.\n"
+    assert split_text(text, 10) == ["Третье?  ", "Четвёртое.", "\n"]
+
+
+def test_short_text_is_kept():
+    assert split_text("Один абзац.", 100) == ["Один абзац."]
@@ -1,27 +1,247 @@
 """
 Сравнение четырех методов стемминга для немецких слов:
 Porter, Snowball, Lancaster, Regexp.
+
+Пакетный режим (stem_batch, iter_stem) рассчитан на большие словари и
+потоки токенов: повторяющиеся формы стеммируются один раз, результаты
+запоминаются отдельно для каждого стеммера (не больше MEMO_MAXSIZE
+последних использованных форм), уникальные формы можно
+распределить по пулу процессов. Замер скорости и памяти:
+    python stemmers-german.py --benchmark [--words список.txt] [--jobs N]
 """
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
+from itertools import islice
+from pathlib import Path
+import argparse
+import csv
+import random
+import re
+import time
+import tracemalloc
+
 from nltk.stem import PorterStemmer, SnowballStemmer, LancasterStemmer, RegexpStemmer
-porter = PorterStemmer()
-lancaster = LancasterStemmer()
-snowball = SnowballStemmer(language='german')
-regexp = RegexpStemmer('e$|n$|er$|s$|st$|t$|en$|et$|est$|in$|erin$|', min=3)
 
-words = ['Fische','Blumen','Kinder', 'Parks', 'höre', 'badest','arbeitet', 'reisen', 'gefahren', 'Lehrerin', 'Schüler']
-print("{0:20}{1:20}{2:20}{3:30}{4:40}".format("Word","Porter Stemmer","Snowball Stemmer","Lancaster Stemmer",'Regexp Stemmer'))
-for word in words:
-    print("{0:20}{1:20}{2:20}{3:30}{4:40}".format(word,porter.stem(word),snowball.stem(word),lancaster.stem(word),regexp.stem(word)))
+BASE_DIR = Path(__file__).resolve().parent.parent
+OUTPUT_DIR = BASE_DIR / 'output'
+BENCHMARK_FILE = OUTPUT_DIR / 'benchmark.csv'
+
+REGEXP = 'e$|n$|er$|s$|st$|t$|en$|et$|est$|in$|erin$|'
+STEMMERS = {
+    'porter': PorterStemmer,
+    'snowball': lambda: SnowballStemmer(language='german'),
+    'lancaster': LancasterStemmer,
+    'regexp': lambda: RegexpStemmer(REGEXP, min=3),
+}
+CHUNKSIZE = 2000          # уникальных слов на одну задачу пула
+BATCH_SIZE = 100_000      # токенов в одном пакете iter_stem
+BENCH_TOKENS = 1_000_000  # размер синтетического потока для замера
+SEED = 42
+MEMO_MAXSIZE = 1_000_000  # запоминаемых форм на один стеммер
+
+WORDS = ['Fische', 'Blumen', 'Kinder', 'Parks', 'höre', 'badest', 'arbeitet', 'reisen', 'gefahren', 'Lehrerin', 'Schüler']
+
+# Запомненные основы: {стеммер: {слово: основа}} в порядке последнего использования
+_MEMO = {name: OrderedDict() for name in STEMMERS}
+
+
+@lru_cache(maxsize=None)
+def get_stemmer(name: str):
+    """Экземпляр стеммера по имени (создаётся один раз в процессе)."""
+    if name not in STEMMERS:
+        raise ValueError(f"Неизвестный стеммер: {name}. Доступны: {', '.join(STEMMERS)}")
+    return STEMMERS[name]()
+
+
+def _stem_chunk(task) -> list:
+    name, words = task
+    stem = get_stemmer(name).stem
+    return [stem(w) for w in words]
+
+
+def _stem_unique(words: list, name: str, n_jobs: int, chunksize: int, pool=None) -> list:
+    """
+    Стемминг списка уникальных слов: в переданном пуле pool, иначе
+    при n_jobs > 1 — во временном пуле процессов.
+    """
+    if (pool is None and n_jobs <= 1) or len(words) <= chunksize:
+        return _stem_chunk((name, words))
+    chunks = [(name, words[i:i + chunksize]) for i in range(0, len(words), chunksize)]
+    if pool is not None:
+        return [s for part in pool.map(_stem_chunk, chunks) for s in part]
+    with ProcessPoolExecutor(max_workers=n_jobs) as pool:
+        return [s for part in pool.map(_stem_chunk, chunks) for s in part]
+
+
+def stem_batch(words, name: str = 'snowball', n_jobs: int = 1, chunksize: int = CHUNKSIZE,
+               pool=None) -> list:
+    """
+    Основы для последовательности слов в том же порядке.
+    Каждая новая форма стеммируется один раз, дальше берётся из памяти;
+    при переполнении памяти вытесняются давно не встречавшиеся формы.
+    Новые формы стеммируются в пуле pool, если он передан.
+    """
+    words = list(words)
+    memo = _MEMO.setdefault(name, OrderedDict())
+    stems, todo = {}, []
+    for w in dict.fromkeys(words):
+        if w in memo:
+            memo.move_to_end(w)
+            stems[w] = memo[w]
+        else:
+            todo.append(w)
+    if todo:
+        new = dict(zip(todo, _stem_unique(todo, name, n_jobs, chunksize, pool)))
+        stems.update(new)
+        memo.update(new)
+        for _ in range(len(memo) - MEMO_MAXSIZE):
+            memo.popitem(last=False)
+    return [stems[w] for w in words]
+
+
+def iter_stem(tokens, name: str = 'snowball', n_jobs: int = 1, batch_size: int = BATCH_SIZE):
+    """
+    Лениво стеммирует поток токенов пакетами по batch_size.
+    При n_jobs > 1 один пул процессов обслуживает все пакеты потока.
+    """
+    tokens = iter(tokens)
+    if n_jobs <= 1:
+        while batch := list(islice(tokens, batch_size)):
+            yield from stem_batch(batch, name)
+        return
+    with ProcessPoolExecutor(max_workers=n_jobs) as pool:
+        while batch := list(islice(tokens, batch_size)):
+            yield from stem_batch(batch, name, n_jobs, pool=pool)
+
+
+def clear_cache(name: str = None):
+    """Сбрасывает запомненные основы одного или всех стеммеров."""
+    for key in ([name] if name else list(_MEMO)):
+        _MEMO[key] = OrderedDict()
+
+
+def load_words(path: Path) -> list:
+    """Слова из текстового файла (по одному в строке или сплошной текст)."""
+    return re.findall(r'\w+', path.read_text(encoding='utf-8-sig'))
+
+
+def synthetic_tokens(n_tokens: int = BENCH_TOKENS, seed: int = SEED) -> list:
+    """
+    Синтетический немецкий поток: корни с приставками, суффиксами и
+    композитами; частоты форм убывают по закону Ципфа, как в реальных текстах.
+    """
+    roots = ['Fisch', 'Blume', 'Kind', 'Park', 'hör', 'bad', 'arbeit', 'reis', 'fahr', 'Lehr',
+             'Schul', 'Haus', 'Stadt', 'Land', 'Wasser', 'Zeit', 'Buch', 'Spiel', 'Bahn', 'Frau',
+             'Mann', 'Welt', 'Arbeit', 'Sprach', 'spiel', 'schreib', 'les', 'geh', 'komm', 'mach',
+             'sag', 'wohn', 'lern', 'kauf', 'Freund', 'Bau', 'Tag', 'Nacht', 'Weg', 'Markt']
+    prefixes = ['', 'ge', 'be', 'ver', 'ent', 'er', 'zer', 'über', 'unter', 'vor']
+    suffixes = ['', 'e', 'en', 'er', 'ern', 'es', 'est', 'et', 'st', 't', 'te', 'ten',
+                'ung', 'ungen', 'in', 'innen', 'lich', 'keit', 'heit', 'chen']
+    vocab = [p + r + s for r in roots for p in prefixes for s in suffixes]
+    vocab += [a + b.lower() + s for a in roots[:20] for b in roots for s in suffixes[:8]]
+    rng = random.Random(seed)
+    rng.shuffle(vocab)
+    weights = [1 / rank for rank in range(1, len(vocab) + 1)]
+    return rng.choices(vocab, weights=weights, k=n_tokens)
+
+
+def benchmark(tokens: list, names=tuple(STEMMERS), n_jobs: int = 1) -> list:
+    """
+    Для каждого стеммера: время прямого стемминга каждого токена и
+    пакетного режима с дедупликацией (с пустой памятью и повторно),
+    слова в секунду и пиковая память пакетного прогона.
+    Время измеряется без tracemalloc, пиковая память — отдельным прогоном
+    с пустой памятью. tracemalloc видит только текущий процесс, поэтому
+    при n_jobs > 1 пиковая память не измеряется (peak_mb пустой).
+    """
+    n_unique = len(set(tokens))
+    rows = []
+    for name in names:
+        stem = get_stemmer(name).stem
+        start = time.perf_counter()
+        for w in tokens:
+            stem(w)
+        naive = time.perf_counter() - start
+
+        clear_cache(name)
+        start = time.perf_counter()
+        stem_batch(tokens, name, n_jobs)
+        cold = time.perf_counter() - start
+
+        start = time.perf_counter()
+        stem_batch(tokens, name, n_jobs)
+        warm = time.perf_counter() - start
+
+        peak_mb = ''
+        if n_jobs <= 1:
+            clear_cache(name)
+            tracemalloc.start()
+            stem_batch(tokens, name, n_jobs)
+            _, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            peak_mb = peak / 2 ** 20
+        rows.append({
+            'stemmer': name,
+            'tokens': len(tokens),
+            'unique': n_unique,
+            'n_jobs': n_jobs,
+            'naive_words_per_sec': len(tokens) / naive,
+            'batch_words_per_sec': len(tokens) / cold,
+            'memoized_words_per_sec': len(tokens) / warm,
+            'peak_mb': peak_mb,
+        })
+        clear_cache(name)
+    return rows
+
+
+def print_table(words):
+    """Таблица основ для всех стеммеров."""
+    stems = {name: stem_batch(words, name) for name in STEMMERS}
+    print("{0:20}{1:20}{2:20}{3:30}{4:40}".format("Word", "Porter Stemmer", "Snowball Stemmer", "Lancaster Stemmer", 'Regexp Stemmer'))
+    for i, word in enumerate(words):
+        print("{0:20}{1:20}{2:20}{3:30}{4:40}".format(word, stems['porter'][i], stems['snowball'][i], stems['lancaster'][i], stems['regexp'][i]))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--benchmark', action='store_true', help='замер скорости и памяти')
+    parser.add_argument('--words', type=Path, help='файл со словами для замера (иначе синтетический поток)')
+    parser.add_argument('--tokens', type=int, default=BENCH_TOKENS, help='размер синтетического потока')
+    parser.add_argument('--jobs', type=int, default=1, help='число процессов')
+    args = parser.parse_args()
+
+    print_table(WORDS)
+    if not args.benchmark:
+        return
+    tokens = load_words(args.words) if args.words else synthetic_tokens(args.tokens)
+    rows = benchmark(tokens, n_jobs=args.jobs)
+    OUTPUT_DIR.mkdir(parents=True, exist_ok=True)
+    with BENCHMARK_FILE.open('w', newline='', encoding='utf-8') as f:
+        writer = csv.DictWriter(f, fieldnames=list(rows[0]))
+        writer.writeheader()
+        writer.writerows(rows)
+    print()
+    print("{0:12}{1:>14}{2:>14}{3:>14}{4:>10}".format('Stemmer', 'naive w/s', 'batch w/s', 'memo w/s', 'peak MB'))
+    for r in rows:
+        peak = f"{r['peak_mb']:.1f}" if r['peak_mb'] != '' else '-'
+        print("{0:12}{1:>14.0f}{2:>14.0f}{3:>14.0f}{4:>10}".format(
+            r['stemmer'], r['naive_words_per_sec'], r['batch_words_per_sec'], r['memoized_words_per_sec'], peak))
+    print(f"Замеры сохранены в {BENCHMARK_FILE}")
+
+
+if __name__ == '__main__':
+    main()
 
 """
-Вывод: 
-SnowballStemmer даёт наиболее осмысленные основы: 
+Вывод:
+SnowballStemmer даёт наиболее осмысленные основы:
 Blumen→blum, reisen→reis, gefahren→gefahr. Это оптимальный выбор для немецкого стемминга.
 
-PorterStemmer и LancasterStemmer изначально разработаны для английского. 
+PorterStemmer и LancasterStemmer изначально разработаны для английского.
 Они иногда вообще не обрабатывают многие немецкие формы (badest→badest), и не убирают Umlaut.
 
-RegexpStemmer - элементарный, просто обрезает указанные суффиксы; 
+RegexpStemmer - элементарный, просто обрезает указанные суффиксы;
 при этом не приводит к нижнему регистру и может быть слишком грязным.
 """
 
@@ -0,0 +1,359 @@
+"""
+CKY-разбор для PCFG на numpy.
+
+Грамматика приводится к бинарному виду и переводится в массивы индексов
+правил. Таблицы Витерби и inside-вероятностей заполняются сразу для всех
+отрезков одной длины и для всего пакета предложений. Лучшее дерево
+восстанавливается по обратным ссылкам, k лучших деревьев — ленивым
+перебором по той же таблице (Huang, Chiang, 2005, алгоритм 3).
+"""
+import heapq
+from itertools import count
+
+import numpy as np
+from nltk.grammar import Nonterminal, is_nonterminal
+from nltk.tree import ProbabilisticTree, Tree
+
+BIN_SEP = '|'
+
+
+def _groups(lhs: np.ndarray):
+    """Начала групп правил с одинаковой левой частью (правила отсортированы по lhs)."""
+    starts = np.flatnonzero(np.r_[True, lhs[1:] != lhs[:-1]]) if len(lhs) else np.zeros(0, int)
+    return starts, lhs[starts], np.diff(np.r_[starts, len(lhs)])
+
+
+def _group_argmax(scores: np.ndarray, starts, sizes):
+    """
+    Максимум по группам последней оси и индекс первого правила,
+    на котором он достигается.
+    """
+    best = np.maximum.reduceat(scores, starts, axis=-1)
+    idx = np.where(scores == np.repeat(best, sizes, axis=-1), np.arange(scores.shape[-1]), scores.shape[-1])
+    return best, np.minimum.reduceat(idx, starts, axis=-1)
+
+
+class CKYParser:
+    """
+    Разбор PCFG алгоритмом CKY. Правила A -> B C D бинаризуются
+    (A -> B A|<C-D>, A|<C-D> -> C D), терминалы внутри длинных правил
+    заменяются вспомогательными предтерминалами; в деревьях
+    вспомогательные узлы не появляются. Унарные правила не должны
+    образовывать циклов, пустые правила не поддерживаются. Слова, которых
+    нет в грамматике, дают ValueError, как в парсерах NLTK.
+    """
+
+    def __init__(self, grammar):
+        self.grammar = grammar
+        self._index = {}
+        self.symbols = []
+        self.hidden = set()
+        self.lexicon = {}
+        binary, unary, seen = [], [], set()
+
+        for prod in grammar.productions():
+            lhs, rhs, logp = prod.lhs(), list(prod.rhs()), float(np.log(prod.prob()))
+            if not rhs:
+                raise ValueError(f"Пустые правила не поддерживаются: {prod}")
+            if len(rhs) == 1 and not is_nonterminal(rhs[0]):
+                self.lexicon.setdefault(rhs[0], []).append((self._sym(lhs), logp))
+                continue
+            for i, x in enumerate(rhs):
+                if not is_nonterminal(x):
+                    pre = Nonterminal(f"{BIN_SEP}'{x}'")
+                    if pre not in seen:
+                        seen.add(pre)
+                        self.lexicon.setdefault(x, []).append((self._sym(pre, hidden=True), 0.0))
+                    rhs[i] = pre
+            if len(rhs) == 1:
+                unary.append((self._sym(lhs), self._sym(rhs[0]), logp))
+                continue
+            parent = self._sym(lhs)
+            while len(rhs) > 2:
+                new = Nonterminal(f"{lhs.symbol()}{BIN_SEP}<{'-'.join(str(x) for x in rhs[1:])}>")
+                fresh = new not in seen
+                seen.add(new)
+                binary.append((parent, self._sym(rhs[0]), self._sym(new, hidden=True), logp))
+                if not fresh:
+                    break
+                parent, rhs, logp = self._index[new], rhs[1:], 0.0
+            else:
+                binary.append((parent, self._sym(rhs[0]), self._sym(rhs[1]), logp))
+
+        self.start = self._index.setdefault(grammar.start(), len(self.symbols))
+        if self.start == len(self.symbols):
+            self.symbols.append(grammar.start())
+        self.n_symbols = len(self.symbols)
+
+        binary.sort(key=lambda r: r[0])
+        b = np.array(binary, dtype=float).reshape(-1, 4)
+        self.b_lhs, self.b_left, self.b_right = (b[:, c].astype(np.int64) for c in range(3))
+        self.b_logp = b[:, 3]
+        self.b_starts, self.b_groups, self.b_sizes = _groups(self.b_lhs)
+
+        u = np.array(unary, dtype=float).reshape(-1, 3)
+        self.u_lhs, self.u_child = u[:, 0].astype(np.int64), u[:, 1].astype(np.int64)
+        self.u_logp = u[:, 2]
+        self.u_levels = self._unary_levels()
+
+    def _sym(self, nt, hidden=False) -> int:
+        if nt not in self._index:
+            self._index[nt] = len(self.symbols)
+            self.symbols.append(nt)
+            if hidden:
+                self.hidden.add(self._index[nt])
+        return self._index[nt]
+
+    def _unary_levels(self) -> list:
+        """
+        Унарные правила по уровням: правило уровня L выводит символ, все
+        унарные потомки которого уже обработаны на уровнях < L. Один проход
+        по уровням даёт замыкание по унарным правилам.
+        """
+        level = np.zeros(self.n_symbols, dtype=np.int64)
+        for _ in range(self.n_symbols + 1):
+            new = level.copy()
+            np.maximum.at(new, self.u_lhs, level[self.u_child] + 1)
+            if np.array_equal(new, level):
+                break
+            level = new
+        else:
+            raise ValueError("Унарные правила образуют цикл")
+        levels = []
+        for lev in range(1, level.max() + 1 if len(level) else 1):
+            rules = np.flatnonzero(level[self.u_lhs] == lev)
+            rules = rules[np.argsort(self.u_lhs[rules], kind='stable')]
+            levels.append((rules, *_groups(self.u_lhs[rules])))
+        return levels
+
+    # Заполнение таблиц
+
+    def _lexical(self, sentences, n, log: bool):
+        """Таблица (B, n+1, n+1, N) с заполненными лексическими ячейками."""
+        fill = -np.inf if log else 0.0
+        chart = np.full((len(sentences), n + 1, n + 1, self.n_symbols), fill)
+        for b, tokens in enumerate(sentences):
+            for t, word in enumerate(tokens):
+                cell = chart[b, t, t + 1]
+                for sym, logp in self.lexicon.get(word, ()):
+                    if log:
+                        cell[sym] = max(cell[sym], logp)
+                    else:
+                        cell[sym] += np.exp(logp)
+        return chart
+
+    def _unary(self, cells, back=None, log=True):
+        """Замыкание ячеек (..., N) по унарным правилам, на месте."""
+        nb = len(self.b_lhs)
+        for rules, starts, groups, sizes in self.u_levels:
+            child = cells[..., self.u_child[rules]]
+            if log:
+                best, first = _group_argmax(child + self.u_logp[rules], starts, sizes)
+                better = best > cells[..., groups]
+                cells[..., groups] = np.where(better, best, cells[..., groups])
+                back[..., groups] = np.where(better, nb + rules[first], back[..., groups])
+            else:
+                cells[..., groups] += np.add.reduceat(child * np.exp(self.u_logp[rules]), starts, axis=-1)
+
+    def _fill(self, sentences, log: bool):
+        """
+        Заполняет таблицу Витерби (log=True, с обратными ссылками)
+        или inside-вероятностей (log=False) для пакета предложений.
+        """
+        for tokens in sentences:
+            self.grammar.check_coverage(tokens)
+        n = max((len(s) for s in sentences), default=0)
+        chart = self._lexical(sentences, n, log)
+        rule = np.full(chart.shape, -1, dtype=np.int32) if log else None
+        split = np.zeros(chart.shape, dtype=np.int32) if log else None
+        diag = np.arange(n)
+        cells = chart[:, diag, diag + 1]
+        back = rule[:, diag, diag + 1] if log else None
+        self._unary(cells, back=back, log=log)
+        chart[:, diag, diag + 1] = cells
+        if log:
+            rule[:, diag, diag + 1] = back
+        if not len(self.b_lhs):
+            return chart, rule, split
+
+        p = self.b_logp if log else np.exp(self.b_logp)
+        for length in range(2, n + 1):
+            i = np.arange(n - length + 1)[:, None]
+            k = i + np.arange(1, length)[None, :]
+            left = chart[:, i, k][..., self.b_left]
+            right = chart[:, k, i + length][..., self.b_right]
+            if log:
+                cand = left + right + p
+                best_k = cand.argmax(axis=2)
+                best = np.take_along_axis(cand, best_k[:, :, None], axis=2)[:, :, 0]
+                cells, first = _group_argmax(best, self.b_starts, self.b_sizes)
+                span = np.full(cells.shape[:2] + (self.n_symbols,), -np.inf)
+                span[..., self.b_groups] = cells
+                back = np.full(span.shape, -1, dtype=np.int32)
+                back[..., self.b_groups] = np.where(np.isfinite(cells), first, -1)
+                kk = np.zeros(span.shape, dtype=np.int32)
+                kk[..., self.b_groups] = i + 1 + np.take_along_axis(best_k, first, axis=-1)
+                self._unary(span, back=back, log=True)
+                rows = i[:, 0]
+                chart[:, rows, rows + length] = span
+                rule[:, rows, rows + length] = back
+                split[:, rows, rows + length] = kk
+            else:
+                best = (left * right * p).sum(axis=2)
+                span = np.zeros(best.shape[:2] + (self.n_symbols,))
+                span[..., self.b_groups] = np.add.reduceat(best, self.b_starts, axis=-1)
+                self._unary(span, log=False)
+                rows = i[:, 0]
+                chart[:, rows, rows + length] = span
+        return chart, rule, split
+
+    # Деревья
+
+    def _label(self, sym):
+        nt = self.symbols[sym]
+        return nt.symbol() if isinstance(nt, Nonterminal) else nt
+
+    def _node(self, sym, children):
+        """Узлы для вставки в родителя: вспомогательный символ раскрывается."""
+        return children if sym in self.hidden else [Tree(self._label(sym), children)]
+
+    def _viterbi_tree(self, tokens, rule, split, i, j, sym):
+        r = rule[i, j, sym]
+        if r < 0:
+            return self._node(sym, [tokens[i]])
+        nb = len(self.b_lhs)
+        if r >= nb:
+            return self._node(sym, self._viterbi_tree(tokens, rule, split, i, j, self.u_child[r - nb]))
+        k = split[i, j, sym]
+        return self._node(sym, self._viterbi_tree(tokens, rule, split, i, k, self.b_left[r])
+                          + self._viterbi_tree(tokens, rule, split, k, j, self.b_right[r]))
+
+    def _root(self, children, logp):
+        tree = children[0]
+        return ProbabilisticTree(tree.label(), list(tree), prob=float(np.exp(logp)))
+
+    def viterbi_batch(self, sentences) -> list:
+        """Лучшее дерево каждого предложения (ProbabilisticTree) или None."""
+        sentences = [list(s) for s in sentences]
+        chart, rule, split = self._fill(sentences, log=True)
+        result = []
+        for b, tokens in enumerate(sentences):
+            n = len(tokens)
+            score = chart[b, 0, n, self.start] if n else -np.inf
+            if not np.isfinite(score):
+                result.append(None)
+                continue
+            children = self._viterbi_tree(tokens, rule[b], split[b], 0, n, self.start)
+            result.append(self._root(children, score))
+        return result
+
+    def inside_batch(self, sentences) -> np.ndarray:
+        """Вероятность каждого предложения (сумма по всем деревьям)."""
+        sentences = [list(s) for s in sentences]
+        chart, _, _ = self._fill(sentences, log=False)
+        lengths = np.array([len(s) for s in sentences], dtype=np.int64)
+        return np.where(lengths > 0, chart[np.arange(len(sentences)), 0, lengths, self.start], 0.0)
+
+    def parse(self, tokens, k=None):
+        """
+        Деревья предложения по убыванию вероятности (не больше k).
+        Перебор ленивый: следующее дерево строится только при запросе.
+        """
+        tokens = list(tokens)
+        chart, _, _ = self._fill([tokens], log=True)
+        n = len(tokens)
+        if not n or not np.isfinite(chart[0, 0, n, self.start]):
+            return
+        best = _KBest(self, tokens, chart[0])
+        root = (0, n, self.start)
+        for rank in count():
+            if k is not None and rank >= k:
+                return
+            d = best.kth(root, rank)
+            if d is None:
+                return
+            yield self._root(best.tree(root, rank), d[0])
+
+    def kbest_batch(self, sentences, k) -> list:
+        """k лучших деревьев для каждого предложения."""
+        return [list(self.parse(tokens, k)) for tokens in sentences]
+
+
+class _KBest:
+    """
+    Ленивый перебор выводов по таблице Витерби одного предложения.
+    Вершина — (i, j, символ); вывод — (логарифм вероятности, ребро, ранги детей).
+    """
+
+    def __init__(self, parser: CKYParser, tokens, chart):
+        self.p = parser
+        self.tokens = tokens
+        self.chart = chart
+        self.derivs = {}
+        self.cand = {}
+        self.seen = {}
+        self.tie = count()
+
+    def edges(self, node):
+        """Входящие рёбра вершины: (логарифм вероятности правила, дети)."""
+        i, j, sym = node
+        p, chart = self.p, self.chart
+        out = []
+        if j == i + 1:
+            out += [(logp, ()) for s, logp in p.lexicon.get(self.tokens[i], ()) if s == sym]
+        for u in np.flatnonzero(p.u_lhs == sym):
+            child = p.u_child[u]
+            if np.isfinite(chart[i, j, child]):
+                out.append((p.u_logp[u], ((i, j, child),)))
+        for r in np.flatnonzero(p.b_lhs == sym):
+            for k in range(i + 1, j):
+                left, right = p.b_left[r], p.b_right[r]
+                if np.isfinite(chart[i, k, left]) and np.isfinite(chart[k, j, right]):
+                    out.append((p.b_logp[r], ((i, k, left), (k, j, right))))
+        return out
+
+    def _score(self, edge, ranks):
+        logp, tails = edge
+        total = logp
+        for tail, rank in zip(tails, ranks):
+            d = self.kth(tail, rank)
+            if d is None:
+                return None
+            total += d[0]
+        return total
+
+    def _push(self, node, edge, ranks):
+        key = (id(edge), ranks)
+        if key in self.seen[node]:
+            return
+        self.seen[node].add(key)
+        score = self._score(edge, ranks)
+        if score is not None:
+            heapq.heappush(self.cand[node], (-score, next(self.tie), edge, ranks))
+
+    def kth(self, node, k):
+        """k-й по вероятности вывод вершины (с нуля) или None."""
+        derivs = self.derivs.setdefault(node, [])
+        if node not in self.cand:
+            self.cand[node], self.seen[node] = [], set()
+            for edge in self.edges(node):
+                self._push(node, edge, (0,) * len(edge[1]))
+        while len(derivs) <= k:
+            if derivs:
+                _, edge, ranks = derivs[-1]
+                for t in range(len(ranks)):
+                    self._push(node, edge, ranks[:t] + (ranks[t] + 1,) + ranks[t + 1:])
+            if not self.cand[node]:
+                return None
+            neg, _, edge, ranks = heapq.heappop(self.cand[node])
+            derivs.append((-neg, edge, ranks))
+        return derivs[k]
+
+    def tree(self, node, k):
+        """Дерево k-го вывода вершины (список узлов для вставки в родителя)."""
+        _, (_, tails), ranks = self.kth(node, k)
+        if not tails:
+            children = [self.tokens[node[0]]]
+        else:
+            children = [c for tail, rank in zip(tails, ranks) for c in self.tree(tail, rank)]
+        return self.p._node(node[2], children)
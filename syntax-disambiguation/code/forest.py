@@ -0,0 +1,79 @@
+"""
+Упакованный лес разборов поверх таблицы FeatureChart.
+
+Таблица NLTK уже хранит общие подразборы: у каждого ребра есть списки
+дочерних рёбер, из которых оно получено. Число деревьев считается по этим
+спискам динамическим программированием (произведение по детям, сумма по
+вариантам), а сами деревья строятся лениво и по одному, в том же порядке,
+что и у Chart.parses. Поэтому проверка неоднозначности длинного
+предложения не требует перечисления экспоненциального числа деревьев.
+"""
+from itertools import islice
+
+from nltk.featstruct import TYPE, unify
+from nltk.parse.chart import LeafEdge
+from nltk.parse.featurechart import FeatureTreeEdge
+from nltk.tree import Tree
+
+
+class ParseForest:
+    """Лес разборов предложения: корни — полные рёбра со стартовым символом."""
+
+    def __init__(self, chart, start):
+        self.chart = chart
+        self.roots = [
+            edge for edge in chart.select(start=0, end=chart.num_leaves())
+            if isinstance(edge, FeatureTreeEdge)
+            and edge.lhs()[TYPE] == start[TYPE]
+            and unify(edge.lhs(), start, rename_vars=True)
+        ]
+
+    def count(self) -> int:
+        """Число деревьев разбора без их построения."""
+        return sum(self._count(root, {}) for root in self.roots)
+
+    def _count(self, edge, memo) -> int:
+        if edge in memo:
+            return memo[edge]
+        if isinstance(edge, LeafEdge):
+            return 1
+        if edge.is_incomplete():
+            return 0
+        # Пока ребро считается, оно даёт 0: так отсекаются циклы, как в Chart.trees
+        memo[edge] = 0
+        total = 0
+        for cpl in self.chart.child_pointer_lists(edge):
+            n = 1
+            for child in cpl:
+                n *= self._count(child, memo)
+                if not n:
+                    break
+            total += n
+        memo[edge] = total
+        return total
+
+    def trees(self, max_trees=None):
+        """Итератор деревьев (не больше max_trees), строятся по мере запроса."""
+        trees = (tree for root in self.roots for tree in self._trees(root, frozenset()))
+        return islice(trees, max_trees)
+
+    def _trees(self, edge, ancestors):
+        if isinstance(edge, LeafEdge):
+            yield self.chart.leaf(edge.start())
+            return
+        if edge.is_incomplete() or edge in ancestors:
+            return
+        ancestors = ancestors | {edge}
+        lhs = edge.lhs().symbol()
+        for cpl in self.chart.child_pointer_lists(edge):
+            for children in self._product(tuple(cpl), ancestors):
+                yield Tree(lhs, children)
+
+    def _product(self, cpl, ancestors):
+        """Ленивое декартово произведение деревьев детей (первый ребёнок меняется медленнее всех)."""
+        if not cpl:
+            yield []
+            return
+        for first in self._trees(cpl[0], ancestors):
+            for rest in self._product(cpl[1:], ancestors):
+                yield [first] + rest
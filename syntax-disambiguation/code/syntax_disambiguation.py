@@ -2,99 +2,128 @@
 """
 Снятие синтаксической неоднозначности в русском предложении двумя подходами:
 1) Морфологически расширенная FCFG с ViterbiParser
-2) Статистическая PCFG с InsideChartParser и ViterbiParser
+2) Статистическая PCFG с векторизованным CKY (cky.py)
 """
+from functools import lru_cache
 from pathlib import Path
-import codecs
+import sys
 from nltk import word_tokenize
-from nltk.parse import ViterbiParser, load_parser
-from nltk.grammar import PCFG
-from nltk.parse import pchart
+from nltk.parse.featurechart import FeatureChart, FeatureChartParser
+from nltk.grammar import PCFG, FeatureGrammar
 import pymorphy3 as pm
 
+from cky import CKYParser
+from forest import ParseForest
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[2] / 'common'))
+from morph_cache import CachedMorphAnalyzer
+
 # Пути
 CODE_DIR = Path(__file__).resolve().parent
 PARSE_DIR = CODE_DIR.parent / 'parse'
 OUTPUT_DIR = CODE_DIR.parent / 'output'
 OUTPUT_DIR.mkdir(exist_ok=True)
 RULES_FILE = PARSE_DIR / 'rules.txt'
-FCFG_FILE  = PARSE_DIR / 'test.fcfg'
 
-# Морфологический анализатор
-m = pm.MorphAnalyzer()
+# Морфологический анализатор с кэшем разборов по словоформе
+m = CachedMorphAnalyzer(pm.MorphAnalyzer())
+
+
+@lru_cache(maxsize=None)
+def lexical_rules(x):
+    """
+    Морфологические правила FCFG для одного слова (строки грамматики).
+    """
+    parses = m.parse(x)
+    if not parses:
+        print(f"Error: No parse found for {x}")
+        return ()
+    rules = []
+    for y in parses:
+        if y.tag.POS in ("NOUN", "ADJF", "PRTF"):
+            strk = f"{y.tag.POS}[C={y.tag.case}, G={y.tag.gender}, NUM={y.tag.number}, PER=3, NF=u'{y.normal_form}'] -> '{y.word}'\n"
+        elif y.tag.POS in ("ADJS", "PRTS"):
+            strk = f"{y.tag.POS}[G={y.tag.gender}, NUM={y.tag.number}, NF=u'{y.normal_form}'] -> '{y.word}'\n"
+        elif y.tag.POS == "NUMR":
+            strk = f"{y.tag.POS}[C={y.tag.case}, NF=u'{y.normal_form}'] -> '{y.word}'\n"
+        elif y.tag.POS in ("ADVB", "GRND", "COMP", "PRED", "PRCL", "INTJ"):
+            strk = f"{y.tag.POS}[NF=u'{y.normal_form}'] -> '{y.word}'\n"
+        elif y.tag.POS in ("PREP", "CONJ"):
+            strk = f"{y.tag.POS}[NF=u'{y.normal_form}'] -> '{y.word}'\n"
+            rules.append(strk)
+            break
+        elif y.tag.POS == "NPRO" and y.normal_form not in ("это", "нечего"):
+            if y.tag.person and y.tag.person[0] == '3' and y.tag.number == 'sing':
+                strk = f"{y.tag.POS}[C={y.tag.case}, G={y.tag.gender}, NUM={y.tag.number}, PER={y.tag.person[0]}, NF=u'{y.normal_form}'] -> '{y.word}'\n"
+            else:
+                strk = f"{y.tag.POS}[C={y.tag.case}, NUM={y.tag.number}, PER={y.tag.person[0]}, NF=u'{y.normal_form}'] -> '{y.word}'\n"
+        elif y.tag.POS in ("VERB", "INFN"):
+            if y.tag.tense == 'past':
+                strk = f"{y.tag.POS}[TR={y.tag.transitivity}, TENSE={y.tag.tense}, G={y.tag.gender}, NUM={y.tag.number}, PER=0, NF=u'{y.normal_form}'] -> '{y.word}'\n"
+            elif y.tag.POS == 'INFN':
+                strk = f"{y.tag.POS}[TR={y.tag.transitivity}, TENSE=0, G=0, NUM=0, PER=0, NF=u'{y.normal_form}'] -> '{y.word}'\n"
+            else:
+                strk = f"{y.tag.POS}[TR={y.tag.transitivity}, TENSE={y.tag.tense}, G=0, NUM={y.tag.number}, PER={y.tag.person[0]}, NF=u'{y.normal_form}'] -> '{y.word}'\n"
+        else:
+            continue
+        rules.append(strk)
+    return tuple(rules)
+
+
+@lru_cache(maxsize=None)
+def lexical_productions(x):
+    """Скомпилированные лексические правила слова (кэшируются по словоформе)."""
+    rules = lexical_rules(x)
+    if not rules:
+        return ()
+    return tuple(FeatureGrammar.fromstring(''.join(rules)).productions())
+
 
-# Сбрасываем и записываем базовые правила
-with codecs.open(FCFG_FILE, mode='w', encoding='utf-8') as f_out:
-    with codecs.open(RULES_FILE, mode='r', encoding='utf-8') as f_rules:
-        f_out.writelines(f_rules.readlines())
+@lru_cache(maxsize=1)
+def base_grammar():
+    """Базовая грамматика из rules.txt; компилируется один раз."""
+    return FeatureGrammar.fromstring(RULES_FILE.read_text(encoding='utf-8'))
 
 
-def pm3fcfg(phrase):
+def sentence_parser(words):
     """
-    Дописывает в test.fcfg морфологические правила для каждого слова.
+    Парсер FCFG для предложения: правила базовой грамматики (скомпилированы
+    один раз) и лексика слов из памяти собираются в одну FeatureGrammar.
     """
-    with codecs.open(FCFG_FILE, mode='a', encoding='utf-8') as f:
-        for x in phrase:
-            parses = m.parse(x)
-            if not parses:
-                print(f"Error: No parse found for {x}")
-                continue
-            for y in parses:
-                if y.tag.POS in ("NOUN", "ADJF", "PRTF"):
-                    strk = f"{y.tag.POS}[C={y.tag.case}, G={y.tag.gender}, NUM={y.tag.number}, PER=3, NF=u'{y.normal_form}'] -> '{y.word}'\n"
-                elif y.tag.POS in ("ADJS", "PRTS"):
-                    strk = f"{y.tag.POS}[G={y.tag.gender}, NUM={y.tag.number}, NF=u'{y.normal_form}'] -> '{y.word}'\n"
-                elif y.tag.POS == "NUMR":
-                    strk = f"{y.tag.POS}[C={y.tag.case}, NF=u'{y.normal_form}'] -> '{y.word}'\n"
-                elif y.tag.POS in ("ADVB", "GRND", "COMP", "PRED", "PRCL", "INTJ"):
-                    strk = f"{y.tag.POS}[NF=u'{y.normal_form}'] -> '{y.word}'\n"
-                elif y.tag.POS in ("PREP", "CONJ"):
-                    strk = f"{y.tag.POS}[NF=u'{y.normal_form}'] -> '{y.word}'\n"
-                    f.write(strk)
-                    break
-                elif y.tag.POS == "NPRO" and y.normal_form not in ("это", "нечего"):
-                    if y.tag.person and y.tag.person[0] == '3' and y.tag.number == 'sing':
-                        strk = f"{y.tag.POS}[C={y.tag.case}, G={y.tag.gender}, NUM={y.tag.number}, PER={y.tag.person[0]}, NF=u'{y.normal_form}'] -> '{y.word}'\n"
-                    else:
-                        strk = f"{y.tag.POS}[C={y.tag.case}, NUM={y.tag.number}, PER={y.tag.person[0]}, NF=u'{y.normal_form}'] -> '{y.word}'\n"
-                elif y.tag.POS in ("VERB", "INFN"):
-                    if y.tag.tense == 'past':
-                        strk = f"{y.tag.POS}[TR={y.tag.transitivity}, TENSE={y.tag.tense}, G={y.tag.gender}, NUM={y.tag.number}, PER=0, NF=u'{y.normal_form}'] -> '{y.word}'\n"
-                    elif y.tag.POS == 'INFN':
-                        strk = f"{y.tag.POS}[TR={y.tag.transitivity}, TENSE=0, G=0, NUM=0, PER=0, NF=u'{y.normal_form}'] -> '{y.word}'\n"
-                    else:
-                        strk = f"{y.tag.POS}[TR={y.tag.transitivity}, TENSE={y.tag.tense}, G=0, NUM={y.tag.number}, PER={y.tag.person[0]}, NF=u'{y.normal_form}'] -> '{y.word}'\n"
-                else:
-                    continue
-                f.write(strk)
+    base = base_grammar()
+    lexicon = list(dict.fromkeys(prod for x in dict.fromkeys(words) for prod in lexical_productions(x)))
+    grammar = FeatureGrammar(base.start(), base.productions() + lexicon)
+    return FeatureChartParser(grammar, chart_class=FeatureChart)
 
 
 def test_ambiguity(text, max_trees=2):
     """
-    Тест синтаксической неоднозначности по FCFG.
+    Тест синтаксической неоднозначности по FCFG. Разборы считаются по
+    упакованному лесу, строятся только первые max_trees деревьев.
     Сохраняет результаты в output/fcfg_parses.txt.
     """
     words = word_tokenize(text.lower())
     fcfg_out = OUTPUT_DIR / 'fcfg_parses.txt'
     with fcfg_out.open('w', encoding='utf-8') as outf:
         outf.write(f"Токены: {words}\n")
-        pm3fcfg(words)
-        cp = load_parser(str(FCFG_FILE), trace=0)
-        trees = list(cp.parse(words))
-        if len(trees) > 1:
-            outf.write(f"Обнаружены неоднозначности: {len(trees)} разборов\n")
-            for i, tree in enumerate(trees[:max_trees], 1):
+        cp = sentence_parser(words)
+        forest = ParseForest(cp.chart_parse(words), cp.grammar().start())
+        n_trees = forest.count()
+        if n_trees > 1:
+            outf.write(f"Обнаружены неоднозначности: {n_trees} разборов\n")
+            for i, tree in enumerate(forest.trees(max_trees), 1):
                 outf.write(f"Разбор {i} из {max_trees} (максимум):\n{tree}\n")
-        elif len(trees) == 1:
+        elif n_trees == 1:
             outf.write("Неоднозначности не обнаружены. Один разбор:\n")
-            outf.write(f"{trees[0]}\n")
+            outf.write(f"{next(forest.trees())}\n")
         else:
             outf.write("Неоднозначности не обнаружены\n")
 
 
 def pcfg_parsing(text):
     """
-    PCFG-разбор с InsideChartParser и ViterbiParser.
+    PCFG-разбор алгоритмом CKY: все деревья по убыванию вероятности,
+    лучшее дерево по Витерби и inside-вероятность предложения.
     Сохраняет результаты в output/pcfg_parses.txt.
     """
     grammar_with_penalty = PCFG.fromstring("""
@@ -121,12 +150,14 @@ def pcfg_parsing(text):
     out_file = OUTPUT_DIR / 'pcfg_parses.txt'
     with out_file.open('w', encoding='utf-8') as outf:
         outf.write("Деревья с применением штрафов:\n")
-        inside = pchart.InsideChartParser(grammar_with_penalty)
-        vt = ViterbiParser(grammar_with_penalty)
-        for t in inside.parse(tokens):
-            outf.write(f"Дерево разбора с InsideChartParser. Вероятность: {t.prob():.4f}:\n{t}\n")
-        for t in vt.parse(tokens):
-            outf.write(f"Дерево разбора с ViterbiParser. Вероятность: {t.prob():.4f}:\n{t}\n")
+        cky = CKYParser(grammar_with_penalty)
+        for t in cky.parse(tokens):
+            outf.write(f"Дерево разбора CKY (все разборы). Вероятность: {t.prob():.4f}:\n{t}\n")
+        for t in cky.viterbi_batch([tokens]):
+            if t is not None:
+                outf.write(f"Дерево разбора CKY (Витерби). Вероятность: {t.prob():.4f}:\n{t}\n")
+        prob, = cky.inside_batch([tokens])
+        outf.write(f"Вероятность предложения (inside): {prob:.4f}\n")
 
 
 def main():
@@ -0,0 +1,74 @@
+from pathlib import Path
+import sys
+
+import pytest
+from nltk.grammar import PCFG
+from nltk.parse import ViterbiParser
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / 'code'))
+from cky import CKYParser
+
+GRAMMAR = PCFG.fromstring("""
+    S    -> NP VP                     [0.9]
+    S    -> VP                        [0.1]
+    VP   -> V                         [0.1]
+    VP   -> V NP                      [0.3]
+    VP   -> V PP                      [0.2]
+    VP   -> V NP PP                   [0.3]
+    VP   -> V 'на' NP                 [0.1]
+    NP   -> Name                      [0.4]
+    NP   -> N                         [0.4]
+    NP   -> NP PP                     [0.2]
+    PP   -> P NP                      [1.0]
+    V    -> 'пошёл'                   [0.5]
+    V    -> 'увидел'                  [0.5]
+    N    -> 'стадион'                 [0.4]
+    N    -> 'собакой'                 [0.3]
+    N    -> 'собаку'                  [0.3]
+    Name -> 'Джон'                    [1.0]
+    P    -> 'на'                      [0.5]
+    P    -> 'с'                       [0.5]
+""")
+
+SENTENCES = [
+    'Джон пошёл на стадион с собакой'.split(),
+    'Джон увидел собаку на стадион'.split(),
+    'увидел собаку'.split(),
+    'пошёл'.split(),
+    'Джон собаку'.split(),
+]
+
+
+def test_viterbi_matches_nltk():
+    cky = CKYParser(GRAMMAR)
+    nltk_parser = ViterbiParser(GRAMMAR)
+    for tokens, tree in zip(SENTENCES, cky.viterbi_batch(SENTENCES)):
+        expected = next(nltk_parser.parse(tokens), None)
+        if expected is None:
+            assert tree is None
+        else:
+            assert tree.prob() == pytest.approx(expected.prob())
+            assert str(tree) == str(expected)
+
+
+def test_kbest_is_sorted_and_sums_to_inside():
+    cky = CKYParser(GRAMMAR)
+    inside = cky.inside_batch(SENTENCES)
+    for tokens, total in zip(SENTENCES, inside):
+        probs = [t.prob() for t in cky.parse(tokens)]
+        assert probs == sorted(probs, reverse=True)
+        assert sum(probs) == pytest.approx(total)
+        if probs:
+            assert probs[0] == pytest.approx(cky.viterbi_batch([tokens])[0].prob())
+
+
+def test_uncovered_word_raises_like_nltk():
+    tokens = 'Джон пошёл на рынок'.split()
+    with pytest.raises(ValueError) as expected:
+        list(ViterbiParser(GRAMMAR).parse(tokens))
+    cky = CKYParser(GRAMMAR)
+    for call in (lambda: cky.viterbi_batch([tokens]), lambda: cky.inside_batch([tokens]),
+                 lambda: list(cky.parse(tokens))):
+        with pytest.raises(ValueError) as raised:
+            call()
+        assert str(raised.value) == str(expected.value)
@@ -1,9 +1,25 @@
 """
 Сравнение токенизаторов русского текста.
 Скрипт обрабатывает входной файл, прогоняет несколько методов токенизации,
-сохраняет результаты в текстовые файлы и формирует две сводные таблицы:
-- counts.csv — количество токенов для каждого метода
-- tokens.csv — полная таблица с токенами разных методов
+сохраняет токены каждого метода с их символьными отрезками в колоночном
+формате (output/{метод}.cols, см. common/columnar.py) и формирует две
+сводные таблицы:
+- counts.csv — количество токенов и время работы для каждого метода
+- diff.csv — участки текста, которые методы токенизируют по-разному:
+  токены каждого метода сопоставляются с символьными отрезками исходного
+  текста, и расхождения ищутся одним проходом сразу по всем методам
+
+Токенизаторы собраны в реестр TOKENIZERS: каждая модель загружается
+при первом обращении один раз на процесс и дальше переиспользуется,
+у всех бэкендов единый пакетный метод tokenize(texts).
+run_tokenizers может запускать бэкенды одновременно: в потоках те, что
+работают вне интерпретатора (Moses — отдельный процесс, UDPipe — C++),
+каждый в своём процессе — токенизаторы на чистом Python.
+Большие файлы обрабатываются потоково (tokenize_stream): текст читается
+кусками по границам абзацев, токены и счётчики пишутся по мере работы.
+Результаты токенизации можно кэшировать на диске (common/result_cache.py,
+включается NLP_CACHE=1) по тексту, бэкенду и его версии; модель при
+попадании в кэш не загружается.
 """
 import warnings
 warnings.filterwarnings('ignore')
@@ -11,18 +27,23 @@ warnings.filterwarnings('ignore')
 import logging
 logging.getLogger('stanza').setLevel(logging.WARNING)
 
-from itertools import zip_longest
+import atexit
+import csv
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from contextlib import ExitStack
 from pathlib import Path
 import pandas as pd
 
-import nltk
 from razdel import tokenize as razdel_tokenize
 from segtok.tokenizer import word_tokenizer as segtok_tokenize
 from pymorphy3 import tokenizers as pym_tokenizers
-from spacy.lang.ru import Russian
-import stanza
-import ufal.udpipe
-from mosestokenizer import MosesTokenizer
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[2] / 'common'))
+from result_cache import RESULT_CACHE, package_version
+from columnar import STR, ColumnarWriter
+from alignment import token_spans
 
 # Пути к файлам и директориям
 BASE_DIR = Path(__file__).resolve().parent.parent
@@ -30,79 +51,399 @@ INPUT_FILE = BASE_DIR / 'parse' / 'Чехов.txt'
 MODEL_FILE = BASE_DIR / 'parse' / 'russian-syntagrus-ud-2.0-170801.udpipe'
 OUTPUT_DIR = BASE_DIR / 'output'
 
+# Размер куска текста для потоковой обработки (в символах) и размер файла,
+# начиная с которого main переходит в потоковый режим
+CHUNK_CHARS = 1_000_000
+STREAM_MIN_BYTES = 50 * 1024 * 1024
+# Во сколько раз кусок может превысить CHUNK_CHARS в ожидании пустой строки
+# (в текстах, где абзацы не разделены пустыми строками)
+MAX_CHUNK_FACTOR = 4
+# Колонки выходных таблиц токенов: токен и его отрезок [start, end) в тексте
+TOKEN_SCHEMA = {'token': STR, 'start': 'int64', 'end': 'int64'}
+
+
+class Tokenizer:
+    """
+    Токенизатор с ленивой загрузкой: loader вызывается при первом
+    обращении и возвращает функцию, размечающую список текстов.
+    executor — где запускать бэкенд в конкурентном режиме:
+    'thread' или 'process'. Результаты кэшируются в cache с ключом
+    (текст, name, версия пакета package, config).
+    """
+
+    def __init__(self, name: str, loader, executor: str = 'process',
+                 package: str = None, config=None, cache=RESULT_CACHE):
+        self.name = name
+        self._loader = loader
+        self._batch_fn = None
+        self.executor = executor
+        self.package = package or name
+        self.config = config
+        self.cache = cache
+
+    @property
+    def loaded(self) -> bool:
+        return self._batch_fn is not None
+
+    def load(self) -> 'Tokenizer':
+        """Загружает модель, если она ещё не загружена."""
+        if self._batch_fn is None:
+            self._batch_fn = self._loader()
+        return self
+
+    def uncached(self, texts: list[str]) -> list[list[str]]:
+        """Токенизирует пакет текстов моделью, минуя кэш."""
+        return self.load()._batch_fn(list(texts))
+
+    def tokenize(self, texts: list[str]) -> list[list[str]]:
+        """
+        Токенизирует пакет текстов, возвращает список токенов для каждого.
+        Модель вызывается только для текстов, которых нет в кэше.
+        """
+        texts = list(texts)
+        if self.cache is None or not self.cache.enabled:
+            return self.uncached(texts)
+        version = package_version(self.package)
+        keys = [self.cache.key(t, self.name, version, self.config) for t in texts]
+        results = [self.cache.get(k) for k in keys]
+        missing = [i for i, r in enumerate(results) if r is None]
+        if missing:
+            computed = self.uncached([texts[i] for i in missing])
+            for i, tokens in zip(missing, computed):
+                self.cache.put(keys[i], tokens)
+                results[i] = tokens
+        return results
+
+
+def _load_nltk():
+    from nltk import word_tokenize
+    return lambda texts: [word_tokenize(t) for t in texts]
+
+
+def _load_razdel():
+    return lambda texts: [[tok.text for tok in razdel_tokenize(t)] for t in texts]
+
+
+def _load_segtok():
+    return lambda texts: [list(segtok_tokenize(t)) for t in texts]
+
+
+def _load_pymorphy():
+    return lambda texts: [pym_tokenizers.simple_word_tokenize(t) for t in texts]
+
+
+def _load_spacy():
+    from spacy.lang.ru import Russian
+    nlp = Russian()
+    return lambda texts: [[token.text for token in doc] for doc in nlp.pipe(texts)]
+
+
+def _load_stanza():
+    import stanza
+    nlp = stanza.Pipeline(lang='ru', processors='tokenize', use_gpu=False, verbose=False)
+    return lambda texts: [[w.text for sent in nlp(t).sentences for w in sent.words]
+                          for t in texts]
+
+
+def _load_moses():
+    from mosestokenizer import MosesTokenizer
+    mtok = MosesTokenizer('ru')
+    atexit.register(mtok.close)
+
+    def run(texts):
+        return [[tok for line in t.splitlines() for tok in mtok(line)] for t in texts]
+    return run
+
+
+def _load_udpipe():
+    import ufal.udpipe
+    model = ufal.udpipe.Model.load(str(MODEL_FILE))
+    pipeline = ufal.udpipe.Pipeline(
+        model, 'tokenize',
+        ufal.udpipe.Pipeline.DEFAULT,
+        ufal.udpipe.Pipeline.DEFAULT,
+        ufal.udpipe.Pipeline.DEFAULT
+    )
+
+    def run(texts):
+        result = []
+        for text in texts:
+            tokens = []
+            for line in pipeline.process(text).split('\n'):
+                parts = line.split('\t')
+                if len(parts) > 1:
+                    tokens.append(parts[1])
+            result.append(tokens)
+        return result
+    # pipeline ссылается на model, поэтому модель должна жить вместе с ним
+    run.model = model
+    return run
+
+
+# Реестр токенизаторов; порядок совпадает с порядком колонок в diff.csv
+TOKENIZERS = {name: Tokenizer(name, loader, executor, package, config)
+              for name, loader, executor, package, config in [
+    ('nltk', _load_nltk, 'process', 'nltk', None),
+    ('razdel', _load_razdel, 'process', 'razdel', None),
+    ('segtok', _load_segtok, 'process', 'segtok', None),
+    ('pymorphy', _load_pymorphy, 'process', 'pymorphy3', None),
+    ('spacy', _load_spacy, 'process', 'spacy', None),
+    ('stanza', _load_stanza, 'process', 'stanza', {'processors': 'tokenize'}),
+    ('moses', _load_moses, 'thread', 'mosestokenizer', None),
+    ('ufal', _load_udpipe, 'thread', 'ufal.udpipe', {'model': MODEL_FILE.name}),
+]}
+
+
+def get_tokenizer(name: str) -> Tokenizer:
+    """Возвращает токенизатор из реестра по имени."""
+    try:
+        return TOKENIZERS[name]
+    except KeyError:
+        raise ValueError(f"Неизвестный токенизатор: {name}. Доступны: {', '.join(TOKENIZERS)}")
+
+
 def tokenize_nltk(text: str) -> list[str]:
     """Токенизация через NLTK"""
-    from nltk import word_tokenize
-    return word_tokenize(text)
+    return TOKENIZERS['nltk'].tokenize([text])[0]
 
 
 def tokenize_razdel(text: str) -> list[str]:
     """Токенизация через Razdel"""
-    return [tok.text for tok in razdel_tokenize(text)]
+    return TOKENIZERS['razdel'].tokenize([text])[0]
 
 
 def tokenize_segtok(text: str) -> list[str]:
     """Токенизация через Segtok"""
-    return list(segtok_tokenize(text))
+    return TOKENIZERS['segtok'].tokenize([text])[0]
 
 
 def tokenize_pymorphy(text: str) -> list[str]:
     """Токенизация через Pymorphy3"""
-    return pym_tokenizers.simple_word_tokenize(text)
+    return TOKENIZERS['pymorphy'].tokenize([text])[0]
 
 
 def tokenize_spacy(text: str) -> list[str]:
     """Токенизация через spaCy"""
-    nlp = Russian()
-    doc = nlp(text)
-    return [token.text for token in doc]
+    return TOKENIZERS['spacy'].tokenize([text])[0]
 
 
 def tokenize_stanza(text: str) -> list[str]:
     """Токенизация через Stanza (UDPipe)"""
-    nlp = stanza.Pipeline(lang='ru', processors='tokenize', use_gpu=False, verbose=False)
-    doc = nlp(text)
-    return [w.text for sent in doc.sentences for w in sent.words]
+    return TOKENIZERS['stanza'].tokenize([text])[0]
 
 
 def tokenize_moses(text: str) -> list[str]:
     """Токенизация через MosesTokenizer"""
-    with MosesTokenizer('ru') as mtok:
-        tokens = []
-        for line in text.splitlines():
-            tokens.extend(mtok(line))
-        return list(tokens)
+    return TOKENIZERS['moses'].tokenize([text])[0]
 
 
 def tokenize_udpipe(text: str) -> list[str]:
     """Токенизация через модель UDPipe"""
-    model = ufal.udpipe.Model.load(str(MODEL_FILE))
-    pipeline = ufal.udpipe.Pipeline(
-        model, 'tokenize',
-        ufal.udpipe.Pipeline.DEFAULT,
-        ufal.udpipe.Pipeline.DEFAULT,
-        ufal.udpipe.Pipeline.DEFAULT
-    )
-    processed = pipeline.process(text)
-    tokens = []
-    for line in processed.split('\n'):
-        parts = line.split('\t')
-        if len(parts) > 1:
-            tokens.append(parts[1])
-    return tokens
-
-
-def diff_func(arr1: list[str], arr2: list[str], name1: str, name2: str):
-    """Сравнение уникальных токенов двух списков"""
-    set1, set2 = set(arr1), set(arr2)
-    diff1 = set1 - set2
-    diff2 = set2 - set1
-    print(f"\nСравниваем {name1} vs {name2}: ")
-    print(f"В {name1}, но не в {name2}: {diff1}")
-    print(f"В {name2}, но не в {name1}: {diff2}")
-
-
-def main():
+    return TOKENIZERS['ufal'].tokenize([text])[0]
+
+
+def _timed_tokenize(name: str, texts: list[str]):
+    """Токенизирует тексты бэкендом name и возвращает (токены, время в секундах)."""
+    start = time.perf_counter()
+    tokens = TOKENIZERS[name].tokenize(texts)
+    return tokens, time.perf_counter() - start
+
+
+# Исполнители бэкендов: общий пул потоков и по отдельному процессу
+# на каждый процессный бэкенд, чтобы каждая модель загружалась
+# только в своём процессе. Создаются при первом запуске и живут до выхода.
+_POOLS = {}
+
+
+def _pool_for(name: str):
+    """Исполнитель бэкенда name (создаётся один раз на процесс)."""
+    key = name if TOKENIZERS[name].executor == 'process' else 'thread'
+    if key not in _POOLS:
+        _POOLS[key] = ProcessPoolExecutor(max_workers=1) if key != 'thread' \
+            else ThreadPoolExecutor(max_workers=len(TOKENIZERS))
+    return _POOLS[key]
+
+
+def shutdown_pools():
+    """Останавливает процессы и потоки бэкендов (модели в них выгружаются)."""
+    while _POOLS:
+        _POOLS.popitem()[1].shutdown()
+
+
+atexit.register(shutdown_pools)
+
+
+def _make_pools(names) -> dict:
+    """Исполнители под бэкенды names: имя -> executor."""
+    return {name: _pool_for(name) for name in names}
+
+
+def _run_on_pools(texts, names, pools):
+    """
+    Запускает бэкенды names на текстах: по очереди, если pools=None,
+    иначе одновременно, каждый в своём исполнителе из pools.
+    Возвращает словарь имя -> (токены, время).
+    """
+    if pools is None:
+        return {name: _timed_tokenize(name, texts) for name in names}
+    futures = {name: pools[name].submit(_timed_tokenize, name, texts) for name in names}
+    return {name: f.result() for name, f in futures.items()}
+
+
+def run_tokenizers(texts: list[str], names=None, concurrent=True):
+    """
+    Прогоняет тексты через несколько токенизаторов.
+    При concurrent=True бэкенды работают одновременно согласно
+    Tokenizer.executor: в общем пуле потоков или каждый в своём процессе,
+    иначе по очереди. Процессы переиспользуются между вызовами, поэтому
+    модели в них загружаются один раз.
+    Возвращает два словаря: имя -> токены для каждого текста
+    и имя -> время работы бэкенда в секундах.
+    """
+    names = list(names or TOKENIZERS)
+    results = _run_on_pools(texts, names, _make_pools(names) if concurrent else None)
+    tokens = {name: res[0] for name, res in results.items()}
+    timings = {name: res[1] for name, res in results.items()}
+    return tokens, timings
+
+
+def align_regions(tokens: dict, spans: dict):
+    """
+    Один проход по токенам всех бэкендов сразу. Текст делится на участки,
+    границы которых совпадают у всех бэкендов; для каждого участка выдаётся
+    (start, end, {имя: [токены]}, agree), где agree — все бэкенды
+    разбили участок одинаково.
+    """
+    names = list(tokens)
+    ptr = dict.fromkeys(names, 0)
+    while True:
+        current = [spans[n][ptr[n]] if ptr[n] < len(spans[n]) else None for n in names]
+        # Частый случай: все бэкенды выдали один и тот же токен
+        if current[0] is not None and current[0][0] < current[0][1] \
+                and all(c == current[0] for c in current[1:]):
+            yield (*current[0], {n: [tokens[n][ptr[n]]] for n in names}, True)
+            for n in names:
+                ptr[n] += 1
+            continue
+        heads = [c[0] for c in current if c is not None]
+        if not heads:
+            return
+        start = end = min(heads)
+        taken = {n: [] for n in names}
+        first, changed = True, True
+        while changed:
+            changed = False
+            for n in names:
+                sp = spans[n]
+                while ptr[n] < len(sp) and (sp[ptr[n]][0] < end or (first and sp[ptr[n]][0] == start)):
+                    taken[n].append(ptr[n])
+                    end = max(end, sp[ptr[n]][1])
+                    ptr[n] += 1
+                    changed = True
+            first = False
+        region = [[spans[n][i] for i in taken[n]] for n in names]
+        agree = all(r == region[0] for r in region[1:])
+        yield start, end, {n: [tokens[n][i] for i in taken[n]] for n in names}, agree
+
+
+def write_diff(writer, text: str, tokens: dict, offset: int = 0, spans: dict = None):
+    """
+    Выравнивает токены всех бэкендов по тексту и пишет в writer (csv.writer)
+    только участки расхождений: start, end, исходный фрагмент и токены
+    каждого бэкенда через пробел. offset сдвигает позиции (для кусков
+    потокового режима). spans — уже найденные отрезки token_spans, если есть.
+    Возвращает (число участков, число расхождений).
+    """
+    if spans is None:
+        spans = {name: token_spans(text, toks) for name, toks in tokens.items()}
+    n_regions = n_diff = 0
+    for start, end, parts, agree in align_regions(tokens, spans):
+        n_regions += 1
+        if not agree:
+            n_diff += 1
+            writer.writerow([offset + start, offset + end, text[start:end],
+                             *(' '.join(parts[name]) for name in tokens)])
+    return n_regions, n_diff
+
+
+def append_tokens(writer: ColumnarWriter, tokens: list[str], spans, offset: int = 0):
+    """Дописывает токены и их отрезки (со сдвигом offset) в таблицу токенов."""
+    writer.append(token=tokens, start=[start + offset for start, _ in spans],
+                  end=[end + offset for _, end in spans])
+
+
+def iter_chunks(path: Path, chunk_chars: int = CHUNK_CHARS):
+    """
+    Читает файл кусками примерно по chunk_chars символов.
+    Куски режутся после пустой строки (границы абзаца), поэтому абзацы,
+    предложения и токены не разрываются. Если пустых строк нет дольше
+    MAX_CHUNK_FACTOR * chunk_chars символов (абзац — одна строка),
+    кусок режется по концу строки. Токенизаторы, которые смотрят на
+    следующий абзац (segtok), могут иначе разобрать точку в конце куска.
+    """
+    with open(path, encoding='utf-8-sig') as f:
+        buf, size = [], 0
+        for line in f:
+            buf.append(line)
+            size += len(line)
+            if size >= chunk_chars and (not line.strip() or size >= MAX_CHUNK_FACTOR * chunk_chars):
+                yield ''.join(buf)
+                buf, size = [], 0
+        if buf:
+            yield ''.join(buf)
+
+
+def write_counts(counts: dict, timings: dict, output_dir: Path = OUTPUT_DIR):
+    """Сохраняет counts.csv: число токенов и время работы каждого бэкенда."""
+    pd.DataFrame({
+        'tokenizer': list(counts),
+        'count': list(counts.values()),
+        'seconds': [round(timings[name], 4) for name in counts],
+    }).to_csv(output_dir / 'counts.csv', index=False)
+
+
+def _open_diff(stack: ExitStack, output_dir: Path, names):
+    """Открывает diff.csv, пишет заголовок и возвращает csv.writer."""
+    f = stack.enter_context((output_dir / 'diff.csv').open('w', newline='', encoding='utf-8'))
+    writer = csv.writer(f)
+    writer.writerow(['start', 'end', 'text', *names])
+    return writer
+
+
+def tokenize_stream(path: Path, output_dir: Path = OUTPUT_DIR, names=None,
+                    concurrent=True, chunk_chars: int = CHUNK_CHARS):
+    """
+    Потоковая токенизация большого файла: куски из iter_chunks по очереди
+    проходят через все бэкенды, токены дописываются в output/{name}.cols,
+    расхождения — в diff.csv, а counts.csv обновляется после каждого куска.
+    В памяти одновременно находится только один кусок и его токены.
+    Возвращает итоговые счётчики токенов и время по бэкендам.
+    """
+    names = list(names or TOKENIZERS)
+    counts = dict.fromkeys(names, 0)
+    timings = dict.fromkeys(names, 0.0)
+    output_dir.mkdir(parents=True, exist_ok=True)
+    with ExitStack() as stack:
+        writers = {name: stack.enter_context(ColumnarWriter(output_dir / name, TOKEN_SCHEMA))
+                   for name in names}
+        diff_writer = _open_diff(stack, output_dir, names)
+        offset = 0
+        pools = _make_pools(names) if concurrent else None
+        for chunk in iter_chunks(path, chunk_chars):
+            results = _run_on_pools([chunk], names, pools)
+            tokens = {name: res[0][0] for name, res in results.items()}
+            spans = {name: token_spans(chunk, toks) for name, toks in tokens.items()}
+            write_diff(diff_writer, chunk, tokens, offset, spans)
+            for name, (_, seconds) in results.items():
+                append_tokens(writers[name], tokens[name], spans[name], offset)
+                counts[name] += len(tokens[name])
+                timings[name] += seconds
+            offset += len(chunk)
+            write_counts(counts, timings, output_dir)
+    return counts, timings
+
+
+def main(concurrent=True, stream=None):
     # Проверка наличия входных файлов
     if not INPUT_FILE.exists():
         print(f"Файл с текстом не найден: {INPUT_FILE}")
@@ -111,6 +452,14 @@ def main():
         print(f"UDPipe модель не найдена: {MODEL_FILE}")
         return
 
+    # Большие корпуса обрабатываются потоково
+    if stream is None:
+        stream = INPUT_FILE.stat().st_size >= STREAM_MIN_BYTES
+    if stream:
+        counts, _ = tokenize_stream(INPUT_FILE, concurrent=concurrent)
+        print(f"Потоковая токенизация завершена: {counts}")
+        return
+
     # Чтение входного текста
     text = INPUT_FILE.read_text(encoding='utf-8-sig')
 
@@ -118,35 +467,24 @@ def main():
     OUTPUT_DIR.mkdir(parents=True, exist_ok=True)
 
     # Токенизация всеми методами
-    arrays = {
-        'nltk': tokenize_nltk(text),
-        'razdel': tokenize_razdel(text),
-        'segtok': tokenize_segtok(text),
-        'pymorphy': tokenize_pymorphy(text),
-        'spacy': tokenize_spacy(text),
-        'stanza': tokenize_stanza(text),
-        'moses': tokenize_moses(text),
-        'ufal': tokenize_udpipe(text),
-    }
-
-    # Сохранение результатов в файлы
+    start = time.perf_counter()
+    batches, timings = run_tokenizers([text], concurrent=concurrent)
+    arrays = {name: tokens[0] for name, tokens in batches.items()}
+    print(f"Токенизация заняла {time.perf_counter() - start:.2f} с")
+
+    # Сохранение токенов с их отрезками в тексте
+    spans = {name: token_spans(text, tokens) for name, tokens in arrays.items()}
     for name, tokens in arrays.items():
-        (OUTPUT_DIR / f"{name}.txt").write_text("\n".join(tokens), encoding='utf-8')
-
-    # Сравнения
-    diff_func(arrays['nltk'], arrays['razdel'], 'nltk', 'razdel')
-    diff_func(arrays['segtok'], arrays['pymorphy'], 'segtok', 'pymorphy')
-    diff_func(arrays['stanza'], arrays['spacy'], 'stanza', 'spacy')
-    diff_func(arrays['moses'], arrays['ufal'], 'moses', 'ufal')
-
-    # Формирование сводных таблиц
-    counts = {name: len(tokens) for name, tokens in arrays.items()}
-    df_counts = pd.DataFrame({'tokenizer': list(counts.keys()), 'count': list(counts.values())})
-    df_counts.to_csv(OUTPUT_DIR / 'counts.csv', index=False)
-
-    rows = list(zip_longest(*arrays.values(), fillvalue=''))
-    df_tokens = pd.DataFrame(rows, columns=arrays.keys())
-    df_tokens.to_csv(OUTPUT_DIR / 'tokens.csv', index=False)
+        with ColumnarWriter(OUTPUT_DIR / name, TOKEN_SCHEMA) as writer:
+            append_tokens(writer, tokens, spans[name])
+
+    # Сравнение: выравнивание по тексту и участки расхождений
+    with ExitStack() as stack:
+        n_regions, n_diff = write_diff(_open_diff(stack, OUTPUT_DIR, list(arrays)), text, arrays, spans=spans)
+    print(f"Участков: {n_regions}, расхождений между методами: {n_diff}")
+
+    # Сводная таблица
+    write_counts({name: len(tokens) for name, tokens in arrays.items()}, timings)
 
 
 if __name__ == '__main__':